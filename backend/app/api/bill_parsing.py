@@ -1,68 +1,337 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from typing import Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Dict, Any, List, Optional
+import asyncio
 import json
+import math
+from app.core import config
 from app.services.gemini_service import GeminiService
-from app.core.database import DatabaseService
-from app.models.schemas import GeminiBillResponse, BillResponse, BillWithItems
+from app.core.database import DatabaseService, ItemInsertError
+from app.services.parse_jobs import ParseJobQueue, JOB_SAVING
+from app.services.resilience import UpstreamUnavailableError, Deadline, DeadlineExceededError
+from app.api.dependencies import get_gemini_service, get_db_service, get_job_queue, get_deadline
+from app.api.cancellation import (
+    CLIENT_CLOSED_REQUEST, ClientDisconnectedError, ensure_still_wanted, run_until_disconnected
+)
+from app.api.uploads import read_image_upload
+from app.models.schemas import GeminiBillResponse, BillResponse, BillWithItems, ItemCreate
 
 router = APIRouter()
 
+async def _save_parsed_bill(
+    db_service: DatabaseService,
+    gemini_result: dict,
+    request: Optional[Request] = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """
+    Validate a Gemini parse and store it as a new bill with its items.
+    Nothing is written if the client has already gone away or the deadline has passed.
+    """
+    # Validate the Gemini response
+    try:
+        parsed_bill = GeminiBillResponse(**gemini_result)
+    except Exception as e:
+        # If JSON parsing fails, return the raw response
+        return {
+            "success": False,
+            "raw_response": gemini_result,
+            "error": f"Failed to parse Gemini response: {str(e)}"
+        }
+    
+    await ensure_still_wanted(request, deadline)
+    
+    # Once started, finish writing the bill even if the caller is cancelled so no half-written bill is left
+    return await asyncio.shield(_write_parsed_bill(db_service, parsed_bill))
+
+async def _write_parsed_bill(db_service: DatabaseService, parsed_bill: GeminiBillResponse) -> Dict[str, Any]:
+    """Store a validated parse as a new bill with its items"""
+    # Create bill in database
+    bill = await db_service.create_bill(currency=parsed_bill.currency)
+    bill_id = bill["id"]
+    
+    # Create items in database
+    failed_items = []
+    try:
+        await db_service.create_items(bill_id, [item.dict() for item in parsed_bill.items])
+    except ItemInsertError as e:
+        # The bill exists; report the lines that could not be stored instead of losing it
+        failed_items = e.failures
+    
+    # Get the complete bill with items
+    complete_bill = await db_service.get_bill_with_items(bill_id)
+    
+    result = {
+        "success": True,
+        "bill": complete_bill,
+        "link_token": bill["link_token"],  # Include the unhashed token for sharing
+        "parsed_data": parsed_bill.dict()
+    }
+    if failed_items:
+        result["failed_items"] = failed_items
+    return result
+
+def _sse_event(event: str, data: Any) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def make_parse_job_handler(gemini_service: GeminiService, db_service: DatabaseService):
+    """
+    Build the handler the background job queue runs for each uploaded bill
+    """
+    async def run_parse_job(image_bytes: bytes, filename: str, mime_type: str, set_status) -> Dict[str, Any]:
+        gemini_result = await gemini_service.aparse_bill_from_bytes(image_bytes, filename, mime_type)
+        await set_status(JOB_SAVING)
+        return await _save_parsed_bill(db_service, gemini_result)
+    
+    return run_parse_job
+
 @router.post("/parse-bill")
-async def parse_bill(file: UploadFile = File(...)):
+async def parse_bill(
+    request: Request,
+    file: UploadFile = File(...),
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    db_service: DatabaseService = Depends(get_db_service),
+    deadline: Deadline = Depends(get_deadline),
+):
     """
-    Parse a bill image using Gemini AI and create a bill in the database
+    Parse a bill image using Gemini AI and create a bill in the database.
+    
+    The work is cancelled if the client disconnects, and fails with 504 once
+    the request deadline (X-Request-Timeout header or default) has passed.
     """
+    # Check the upload's size and type (413/415 on bad files)
+    image = await read_image_upload(file)
     try:
-        # Validate file type
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Read file content
-        content = await file.read()
-        
-        # Initialize services
-        gemini_service = GeminiService()
-        db_service = DatabaseService()
-        
+        content = await run_in_threadpool(image.read)
+    finally:
+        image.close()
+    
+    async def parse_and_save():
         # Parse the bill with Gemini
-        gemini_result = gemini_service.parse_bill_from_bytes(content, file.filename)
+        gemini_result = await gemini_service.aparse_bill_from_bytes(
+            content, image.filename, image.mime_type, image.sha256, deadline=deadline
+        )
+        return await _save_parsed_bill(db_service, gemini_result, request, deadline)
+    
+    try:
+        return await run_until_disconnected(request, parse_and_save())
         
-        # Validate the Gemini response
+    except ClientDisconnectedError:
+        # Nobody is listening any more; skip the work and the response body
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=f"Error parsing bill: {str(e)}")
+    except UpstreamUnavailableError as e:
+        # Fail fast while Gemini is throttled or unhealthy instead of inviting immediate retries
+        raise HTTPException(
+            status_code=503,
+            detail=f"Error parsing bill: {str(e)}",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error parsing bill: {str(e)}")
+
+@router.post("/parse-bill/stream")
+async def parse_bill_stream(
+    file: UploadFile = File(...),
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    db_service: DatabaseService = Depends(get_db_service),
+    deadline: Deadline = Depends(get_deadline),
+):
+    """
+    Parse a bill image and stream the result as Server-Sent Events.
+    
+    The bill is created as soon as the first line item has been generated
+    (event "bill_created" with the link token), and every item is stored and
+    sent (event "item", or "item_error" if it could not be stored) while the
+    model is still working on the rest.
+    The stream ends with "done" carrying the complete bill, or "error".
+    The request deadline bounds how long we wait for the model to start
+    answering; a client disconnect stops the stream and any further writes.
+    """
+    image = await read_image_upload(file)
+    try:
+        content = await run_in_threadpool(image.read)
+    finally:
+        image.close()
+    
+    async def stream_events():
+        bill = None
         try:
-            parsed_bill = GeminiBillResponse(**gemini_result)
-        except Exception as e:
-            # If JSON parsing fails, return the raw response
-            return {
+            async for kind, payload in gemini_service.astream_bill_items(
+                content, image.filename, image.mime_type, image.sha256, deadline=deadline
+            ):
+                if kind == "item":
+                    try:
+                        item = ItemCreate(**payload)
+                    except Exception:
+                        # Incomplete or invalid line; the final parse still reports it
+                        continue
+                    
+                    if bill is None:
+                        bill = await db_service.create_bill()
+                        yield _sse_event("bill_created", {"bill_id": bill["id"], "link_token": bill["link_token"]})
+                    
+                    try:
+                        created_items = await db_service.create_items(bill["id"], [item.dict()])
+                    except ItemInsertError as e:
+                        yield _sse_event("item_error", {"item": payload, "error": e.failures[0]["error"]})
+                        continue
+                    for created_item in created_items:
+                        yield _sse_event("item", created_item)
+                    continue
+                
+                # Final parse of the whole response
+                if "error" in payload:
+                    yield _sse_event("error", {
+                        "success": False,
+                        "raw_response": payload,
+                        "error": f"Failed to parse Gemini response: {payload['error']}"
+                    })
+                elif bill is None:
+                    # Nothing was streamed (e.g. no recognizable items); store it the regular way
+                    yield _sse_event("done", await _save_parsed_bill(db_service, payload))
+                else:
+                    if payload.get("currency") and payload["currency"] != bill["currency"]:
+                        await db_service.update_bill(bill["id"], {"currency": payload["currency"]})
+                    complete_bill = await db_service.get_bill_with_items(bill["id"])
+                    yield _sse_event("done", {
+                        "success": True,
+                        "bill": complete_bill,
+                        "link_token": bill["link_token"],
+                        "parsed_data": payload
+                    })
+        except UpstreamUnavailableError as e:
+            yield _sse_event("error", {
                 "success": False,
-                "raw_response": gemini_result,
-                "error": f"Failed to parse Gemini response: {str(e)}"
-            }
-        
-        # Create bill in database
-        bill = db_service.create_bill(currency=parsed_bill.currency)
-        bill_id = bill["id"]
-        
-        # Create items in database
-        items = db_service.create_items(bill_id, [item.dict() for item in parsed_bill.items])
-        
-        # Get the complete bill with items
-        complete_bill = db_service.get_bill_with_items(bill_id)
+                "error": f"Error parsing bill: {str(e)}",
+                "retry_after": math.ceil(e.retry_after)
+            })
+        except Exception as e:
+            yield _sse_event("error", {"success": False, "error": f"Error parsing bill: {str(e)}"})
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/parse-bills")
+async def parse_bills(
+    files: List[UploadFile] = File(...),
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    db_service: DatabaseService = Depends(get_db_service),
+    deadline: Deadline = Depends(get_deadline),
+):
+    """
+    Parse several bill images concurrently and create a bill for each.
+    
+    Results are streamed back as newline-delimited JSON in completion order,
+    one object per file with its original index. A failing image only fails
+    its own entry. Each file gets the request timeout from the moment its
+    parse starts, so waiting for a free slot does not count against it, and
+    outstanding parses stop when the client disconnects.
+    """
+    if len(files) > config.BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {config.BATCH_MAX_FILES} files per batch")
+    
+    semaphore = asyncio.Semaphore(config.BATCH_MAX_CONCURRENCY)
+    
+    async def parse_one(index: int, file: UploadFile) -> Dict[str, Any]:
+        async with semaphore:
+            file_deadline = Deadline(deadline.timeout)
+            try:
+                # Read inside the semaphore so only in-flight images are held in memory
+                image = await read_image_upload(file)
+                try:
+                    content = await run_in_threadpool(image.read)
+                finally:
+                    image.close()
+                gemini_result = await gemini_service.aparse_bill_from_bytes(
+                    content, image.filename, image.mime_type, image.sha256, deadline=file_deadline
+                )
+                result = await _save_parsed_bill(db_service, gemini_result, deadline=file_deadline)
+            except HTTPException as e:
+                result = {"success": False, "error": e.detail}
+            except UpstreamUnavailableError as e:
+                result = {"success": False, "error": f"Error parsing bill: {str(e)}", "retry_after": math.ceil(e.retry_after)}
+            except Exception as e:
+                result = {"success": False, "error": f"Error parsing bill: {str(e)}"}
         
-        return {
-            "success": True,
-            "bill": complete_bill,
-            "link_token": bill["link_token"],  # Include the unhashed token for sharing
-            "parsed_data": parsed_bill.dict()
+        return {"index": index, "filename": file.filename, **result}
+    
+    async def stream_results():
+        tasks = [asyncio.create_task(parse_one(index, file)) for index, file in enumerate(files)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                yield json.dumps(result, default=str) + "\n"
+        finally:
+            # Stop outstanding parses if the client goes away
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.post("/parse-jobs", status_code=202)
+async def create_parse_job(
+    file: UploadFile = File(...),
+    job_queue: ParseJobQueue = Depends(get_job_queue),
+):
+    """
+    Queue a bill image for parsing and return immediately with a job id.
+    Poll GET /parse-jobs/{job_id} or subscribe to /parse-jobs/{job_id}/events for progress.
+    """
+    # The upload is streamed into the job spool without being loaded into memory
+    image = await read_image_upload(file)
+    try:
+        job = await job_queue.submit(image.filename, image.mime_type, image.spool)
+    finally:
+        image.close()
+    
+    return JSONResponse(
+        status_code=202,
+        headers={"Location": f"/api/ai/parse-jobs/{job['id']}"},
+        content={
+            "job_id": job["id"],
+            "status": job["status"],
+            "status_url": f"/api/ai/parse-jobs/{job['id']}",
+            "events_url": f"/api/ai/parse-jobs/{job['id']}/events"
         }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error parsing bill: {str(e)}")
+    )
+
+@router.get("/parse-jobs/{job_id}")
+async def get_parse_job(job_id: str, job_queue: ParseJobQueue = Depends(get_job_queue)):
+    """
+    Get the status of a parse job, including the created bill once it has completed
+    """
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/parse-jobs/{job_id}/events")
+async def parse_job_events(job_id: str, job_queue: ParseJobQueue = Depends(get_job_queue)):
+    """
+    Stream status changes of a parse job as Server-Sent Events until it finishes
+    """
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def stream_events():
+        async for update in job_queue.events(job_id):
+            yield _sse_event("status", update)
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/health")
-async def ai_health():
+async def ai_health(gemini_service: GeminiService = Depends(get_gemini_service)):
     """Check if AI service is working"""
-    try:
-        gemini_service = GeminiService()
-        return {"status": "healthy", "service": "gemini"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+    return {"status": "healthy", "service": "gemini"}
@@ -0,0 +1,49 @@
+import asyncio
+from typing import Awaitable, Optional, TypeVar
+from fastapi import Request
+from app.core import config
+from app.services.resilience import Deadline
+
+T = TypeVar("T")
+
+# Non-standard status (popularised by nginx) for requests the client abandoned
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the client went away before its request was answered"""
+
+
+async def ensure_still_wanted(request: Optional[Request], deadline: Optional[Deadline]):
+    """
+    Last check before irreversible work such as database writes.
+
+    Raises:
+        DeadlineExceededError: If the deadline has passed
+        ClientDisconnectedError: If the client has disconnected
+    """
+    if deadline is not None:
+        deadline.check()
+    if request is not None and await request.is_disconnected():
+        raise ClientDisconnectedError("Client disconnected")
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[T]) -> T:
+    """
+    Await work while watching the client connection.
+    The work is cancelled as soon as the client disconnects.
+
+    Raises:
+        ClientDisconnectedError: If the client disconnected first
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=config.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnectedError("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
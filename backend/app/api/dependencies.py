@@ -0,0 +1,52 @@
+import math
+from fastapi import HTTPException, Request
+from app.core import config
+from app.core.database import DatabaseService
+from app.services.gemini_service import GeminiService
+from app.services.parse_jobs import ParseJobQueue
+from app.services.resilience import Deadline
+
+# Header clients can use to set their own request deadline in seconds
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+def get_gemini_service(request: Request) -> GeminiService:
+    """Return the process-wide GeminiService created at startup"""
+    service = getattr(request.app.state, "gemini_service", None)
+    if service is None:
+        error = getattr(request.app.state, "gemini_error", "not initialized")
+        raise HTTPException(status_code=500, detail=f"AI service error: {error}")
+    return service
+
+
+def get_db_service(request: Request) -> DatabaseService:
+    """Return the process-wide DatabaseService created at startup"""
+    service = getattr(request.app.state, "db_service", None)
+    if service is None:
+        error = getattr(request.app.state, "db_error", "not initialized")
+        raise HTTPException(status_code=500, detail=f"Database service error: {error}")
+    return service
+
+
+def get_job_queue(request: Request) -> ParseJobQueue:
+    """Return the background parse job queue started at startup"""
+    queue = getattr(request.app.state, "job_queue", None)
+    if queue is None:
+        raise HTTPException(status_code=503, detail="Parse jobs are not available")
+    return queue
+
+
+def get_deadline(request: Request) -> Deadline:
+    """Deadline for this request, from the X-Request-Timeout header or the configured default"""
+    timeout = config.REQUEST_TIMEOUT_DEFAULT
+    header = request.headers.get(REQUEST_TIMEOUT_HEADER)
+    if header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{REQUEST_TIMEOUT_HEADER} must be a number of seconds")
+        if not math.isfinite(timeout):
+            raise HTTPException(status_code=400, detail=f"{REQUEST_TIMEOUT_HEADER} must be a finite number of seconds")
+        if timeout <= 0:
+            raise HTTPException(status_code=400, detail=f"{REQUEST_TIMEOUT_HEADER} must be positive")
+    return Deadline(min(timeout, config.REQUEST_TIMEOUT_MAX))
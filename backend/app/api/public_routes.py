@@ -1,31 +1,28 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from typing import Dict, Any
-from app.core.database import DatabaseService
+from app.core.database import DatabaseService, ClaimRejectedError, CLAIM_BILL_NOT_FOUND, CLAIM_ITEM_NOT_FOUND
+from app.api.dependencies import get_db_service
+from app.services.quantities import compute_item_quantities, item_quantities
 from app.models.schemas import PublicClaimRequest, PublicSharedInitRequest, PublicSharedJoinRequest
 
 router = APIRouter()
 
 @router.get("/{token}")
-async def get_bill(token: str):
+async def get_bill(token: str, db_service: DatabaseService = Depends(get_db_service)):
     """
     Get bill details by public token (no authentication required)
     """
     try:
-        db_service = DatabaseService()
-        bill = db_service.get_bill_by_token(token)
-        
-        if not bill:
-            raise HTTPException(status_code=404, detail="Bill not found")
-        
-        # Get bill with items and participants
-        complete_bill = db_service.get_bill_with_items(bill["id"])
+        # Resolve the token to the bill with items, claims and participants in one call
+        complete_bill = await db_service.get_bill_with_items_by_token(token)
         
         if not complete_bill:
-            raise HTTPException(status_code=404, detail="Bill data not found")
+            raise HTTPException(status_code=404, detail="Bill not found")
         
         return {
             "success": True,
-            "bill": complete_bill
+            "bill": complete_bill,
+            "quantities": compute_item_quantities(complete_bill)
         }
         
     except HTTPException:
@@ -33,84 +30,85 @@ async def get_bill(token: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving bill: {str(e)}")
 
-@router.post("/{token}/claim-exclusive")
-async def claim_exclusive(token: str, request: PublicClaimRequest):
+@router.get("/{token}/results")
+async def get_results(token: str, db_service: DatabaseService = Depends(get_db_service)):
     """
-    Claim exclusive items (I had this)
+    Get what every participant owes (exclusive, shared and grand totals)
     """
     try:
-        db_service = DatabaseService()
-        
-        # Get bill by token
-        bill = db_service.get_bill_by_token(token)
-        if not bill:
+        results = await db_service.get_bill_results_by_token(token)
+        if not results:
             raise HTTPException(status_code=404, detail="Bill not found")
         
-        bill_id = bill["id"]
-        
-        # Check if item exists and has enough quantity
-        items = db_service.get_items(bill_id)
-        item = next((i for i in items if str(i["id"]) == str(request.item_id)), None)
-        
-        if not item:
-            raise HTTPException(status_code=404, detail="Item not found")
-        
-        # Check remaining quantity
-        remaining = db_service.get_remaining_quantity(request.item_id)
-        if remaining < request.quantity:
-            raise HTTPException(status_code=400, detail="Not enough quantity available")
+        return {
+            "success": True,
+            "results": results
+        }
         
-        # Create the claim
-        claim = db_service.create_claim(
-            bill_id=bill_id,
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error calculating results: {str(e)}")
+
+@router.post("/{token}/claim-exclusive")
+async def claim_exclusive(token: str, request: PublicClaimRequest, db_service: DatabaseService = Depends(get_db_service)):
+    """
+    Claim exclusive items (I had this)
+    """
+    try:
+        # Check the remaining quantity and create the claim atomically
+        outcome = await db_service.claim_item_exclusive(
+            token=token,
             item_id=str(request.item_id),
             participant_id=str(request.participant_id),
-            qty_claimed=request.quantity
+            quantity=request.quantity
         )
         
         return {
             "success": True,
-            "claim": claim,
-            "remaining_quantity": remaining - request.quantity
+            "claim": outcome["claim"],
+            "remaining_quantity": outcome["remaining_quantity"]
         }
         
+    except ClaimRejectedError as e:
+        if e.status == CLAIM_BILL_NOT_FOUND:
+            raise HTTPException(status_code=404, detail="Bill not found")
+        if e.status == CLAIM_ITEM_NOT_FOUND:
+            raise HTTPException(status_code=404, detail="Item not found")
+        raise HTTPException(status_code=400, detail="Not enough quantity available")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating claim: {str(e)}")
 
 @router.post("/{token}/shared-init")
-async def init_shared_pool(token: str, request: PublicSharedInitRequest):
+async def init_shared_pool(token: str, request: PublicSharedInitRequest, db_service: DatabaseService = Depends(get_db_service)):
     """
     Initialize a shared pool for an item
     """
     try:
-        db_service = DatabaseService()
-        
-        # Get bill by token
-        bill = db_service.get_bill_by_token(token)
+        # Get bill with its items by token
+        bill = await db_service.get_bill_with_items_by_token(token)
         if not bill:
             raise HTTPException(status_code=404, detail="Bill not found")
         
-        bill_id = bill["id"]
-        
         # Check if item exists
-        items = db_service.get_items(bill_id)
-        item = next((i for i in items if str(i["id"]) == str(request.item_id)), None)
+        item = next((i for i in bill["items"] if str(i["id"]) == str(request.item_id)), None)
         
         if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         
         # Check if pool size is valid
-        remaining = db_service.get_remaining_quantity(request.item_id)
+        remaining = item_quantities(item)["remaining"]
         if remaining < request.pool_size:
             raise HTTPException(status_code=400, detail="Pool size exceeds available quantity")
         
         # Initialize shared pool
-        shared_member = db_service.init_shared_pool(
+        shared_member = await db_service.init_shared_pool(
             item_id=str(request.item_id),
             participant_id=str(request.participant_id),
-            pool_size=request.pool_size
+            pool_size=request.pool_size,
+            bill_id=bill["id"]
         )
         
         return {
@@ -125,27 +123,27 @@ async def init_shared_pool(token: str, request: PublicSharedInitRequest):
         raise HTTPException(status_code=500, detail=f"Error initializing shared pool: {str(e)}")
 
 @router.post("/{token}/shared-join")
-async def join_shared_pool(token: str, request: PublicSharedJoinRequest):
+async def join_shared_pool(token: str, request: PublicSharedJoinRequest, db_service: DatabaseService = Depends(get_db_service)):
     """
     Join an existing shared pool
     """
     try:
-        db_service = DatabaseService()
-        
-        # Get bill by token
-        bill = db_service.get_bill_by_token(token)
+        # Get bill with its items and their shared members by token
+        bill = await db_service.get_bill_with_items_by_token(token)
         if not bill:
             raise HTTPException(status_code=404, detail="Bill not found")
         
         # Check if shared pool exists
-        shared_members = db_service.get_shared_members(str(request.item_id))
+        item = next((i for i in bill["items"] if str(i["id"]) == str(request.item_id)), None)
+        shared_members = item["shared_members"] if item else []
         if not shared_members:
             raise HTTPException(status_code=404, detail="Shared pool not found")
         
         # Join the shared pool
-        shared_member = db_service.join_shared_pool(
+        shared_member = await db_service.join_shared_pool(
             item_id=str(request.item_id),
-            participant_id=str(request.participant_id)
+            participant_id=str(request.participant_id),
+            bill_id=bill["id"]
         )
         
         return {
@@ -160,22 +158,21 @@ async def join_shared_pool(token: str, request: PublicSharedJoinRequest):
         raise HTTPException(status_code=500, detail=f"Error joining shared pool: {str(e)}")
 
 @router.post("/{token}/shared-leave")
-async def leave_shared_pool(token: str, request: PublicSharedJoinRequest):
+async def leave_shared_pool(token: str, request: PublicSharedJoinRequest, db_service: DatabaseService = Depends(get_db_service)):
     """
     Leave a shared pool
     """
     try:
-        db_service = DatabaseService()
-        
         # Get bill by token
-        bill = db_service.get_bill_by_token(token)
+        bill = await db_service.get_bill_by_token(token)
         if not bill:
             raise HTTPException(status_code=404, detail="Bill not found")
         
         # Leave the shared pool
-        success = db_service.leave_shared_pool(
+        success = await db_service.leave_shared_pool(
             item_id=str(request.item_id),
-            participant_id=str(request.participant_id)
+            participant_id=str(request.participant_id),
+            bill_id=bill["id"]
         )
         
         if not success:
@@ -192,20 +189,18 @@ async def leave_shared_pool(token: str, request: PublicSharedJoinRequest):
         raise HTTPException(status_code=500, detail=f"Error leaving shared pool: {str(e)}")
 
 @router.post("/{token}/participant")
-async def create_participant(token: str, name: str, is_payer: bool = False):
+async def create_participant(token: str, name: str, is_payer: bool = False, db_service: DatabaseService = Depends(get_db_service)):
     """
     Create a new participant for the bill
     """
     try:
-        db_service = DatabaseService()
-        
         # Get bill by token
-        bill = db_service.get_bill_by_token(token)
+        bill = await db_service.get_bill_by_token(token)
         if not bill:
             raise HTTPException(status_code=404, detail="Bill not found")
         
         # Create participant
-        participant = db_service.create_participant(
+        participant = await db_service.create_participant(
             bill_id=bill["id"],
             name=name,
             is_payer=is_payer
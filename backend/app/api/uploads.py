@@ -0,0 +1,157 @@
+import hashlib
+import io
+from typing import Optional, BinaryIO, Tuple
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core import config
+
+# Bytes needed to recognise every supported format
+SNIFF_BYTES = 16
+
+# Room for multipart boundaries and part headers on top of each file
+MULTIPART_OVERHEAD = 16 * 1024
+
+SUPPORTED_IMAGE_TYPES = "JPEG, PNG, WEBP, HEIC or HEIF"
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """
+    Detect the image format from its leading magic bytes.
+    Only formats Gemini accepts are recognised; returns None for anything else.
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand in (b"heic", b"heix", b"heim", b"heis"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    return None
+
+
+class UploadedImage:
+    """
+    An uploaded image whose size and type have been checked.
+    The content stays in the multipart parser's spooled temporary file: in
+    memory for small uploads, on disk for large ones.
+    """
+
+    def __init__(self, filename: str, mime_type: str, size: int, spool: BinaryIO):
+        self.filename = filename
+        self.mime_type = mime_type
+        self.size = size
+        self.spool = spool
+        # Set by read()
+        self.sha256: Optional[str] = None
+
+    def read(self) -> bytes:
+        """
+        The full image content; also sets sha256, used as the parse cache key.
+
+        An in-memory spool's buffer is returned without copying
+        (BytesIO.getvalue() shares it). A spool on disk has to be read into
+        bytes, since the Gemini SDK and the preprocessing pool both need bytes.
+        """
+        buffer = getattr(self.spool, "_file", self.spool)
+        if isinstance(buffer, io.BytesIO):
+            content = buffer.getvalue()
+        else:
+            self.spool.seek(0)
+            content = self.spool.read()
+        self.sha256 = hashlib.sha256(content).hexdigest()
+        return content
+
+    def close(self):
+        """Release the buffer (deletes the temporary file if one was created)"""
+        self.spool.close()
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):g} MB"
+
+
+async def read_image_upload(file: UploadFile) -> UploadedImage:
+    """
+    Validate an uploaded image.
+
+    The file type is sniffed from the first bytes rather than trusted from the
+    client's Content-Type. The request body was already bounded by
+    UploadSizeLimitMiddleware; this enforces UPLOAD_MAX_BYTES per file, which
+    matters for batches.
+
+    Raises:
+        HTTPException: 415 for unsupported files, 413 for files above UPLOAD_MAX_BYTES
+    """
+    try:
+        size = file.size
+        if size is None:
+            size = file.file.seek(0, io.SEEK_END)
+        if size > config.UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image must be at most {_megabytes(config.UPLOAD_MAX_BYTES)}")
+
+        await file.seek(0)
+        mime_type = sniff_image_type(await file.read(SNIFF_BYTES))
+        if mime_type is None:
+            raise HTTPException(status_code=415, detail=f"File must be a {SUPPORTED_IMAGE_TYPES} image")
+        await file.seek(0)
+    except BaseException:
+        await file.close()
+        raise
+
+    return UploadedImage(file.filename or "bill", mime_type, size, file.file)
+
+
+def upload_body_limit(path: str) -> Tuple[int, str]:
+    """Largest multipart request body accepted on a path (one image, or a full batch) and the 413 message"""
+    image_limit = config.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD
+    if path.rstrip("/").endswith("/parse-bills"):
+        return config.BATCH_MAX_FILES * image_limit, (
+            f"A batch may hold at most {config.BATCH_MAX_FILES} images of {_megabytes(config.UPLOAD_MAX_BYTES)}"
+        )
+    return image_limit, f"Image must be at most {_megabytes(config.UPLOAD_MAX_BYTES)}"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects oversized multipart uploads before they are parsed.
+
+    FastAPI spools the whole multipart body before the endpoint runs, so the
+    limit has to be applied here: a Content-Length above upload_body_limit()
+    is answered with 413 without reading the body, and a chunked body is cut
+    off with 413 as soon as it crosses the limit.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        headers = Headers(scope=scope) if scope["type"] == "http" else None
+        if headers is None or not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        limit, detail = upload_body_limit(scope["path"])
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
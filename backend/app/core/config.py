@@ -0,0 +1,123 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables once for the whole app
+load_dotenv("env/config.env")
+
+
+def _int_env(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _float_env(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# Credentials
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+# HTTP connection pools (shared by all requests in a worker)
+HTTP_MAX_CONNECTIONS = _int_env("HTTP_MAX_CONNECTIONS", 20)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = _int_env("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10)
+HTTP_KEEPALIVE_EXPIRY = _float_env("HTTP_KEEPALIVE_EXPIRY", 30.0)
+HTTP_TIMEOUT = _float_env("HTTP_TIMEOUT", 60.0)
+
+# Request deadlines
+# Clients may ask for a shorter or longer deadline (in seconds) with the X-Request-Timeout header
+REQUEST_TIMEOUT_DEFAULT = _float_env("REQUEST_TIMEOUT_DEFAULT", 60.0)
+REQUEST_TIMEOUT_MAX = _float_env("REQUEST_TIMEOUT_MAX", 120.0)
+# How often a running parse checks whether the client is still connected
+DISCONNECT_POLL_INTERVAL = _float_env("DISCONNECT_POLL_INTERVAL", 0.5)
+
+# Database
+# Rows sent per bulk insert request
+DB_INSERT_CHUNK_SIZE = _int_env("DB_INSERT_CHUNK_SIZE", 200)
+# In-process cache of bill snapshots, invalidated on every write made through this process
+SNAPSHOT_CACHE_ENABLED = os.getenv("SNAPSHOT_CACHE_ENABLED", "true").lower() == "true"
+# Bounds how stale a snapshot can be after writes made by other processes
+SNAPSHOT_CACHE_TTL_SECONDS = _float_env("SNAPSHOT_CACHE_TTL_SECONDS", 5.0)
+SNAPSHOT_CACHE_MAX_ENTRIES = _int_env("SNAPSHOT_CACHE_MAX_ENTRIES", 1000)
+# In-process cache of link token -> bill lookups; unknown tokens are cached for the shorter TTL
+TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "true").lower() == "true"
+TOKEN_CACHE_TTL_SECONDS = _float_env("TOKEN_CACHE_TTL_SECONDS", 300.0)
+TOKEN_CACHE_NEGATIVE_TTL_SECONDS = _float_env("TOKEN_CACHE_NEGATIVE_TTL_SECONDS", 10.0)
+TOKEN_CACHE_MAX_ENTRIES = _int_env("TOKEN_CACHE_MAX_ENTRIES", 10000)
+# Participant totals kept up to date in process as claims and shared pools change
+TOTALS_CACHE_ENABLED = os.getenv("TOTALS_CACHE_ENABLED", "true").lower() == "true"
+# Bounds drift from writes made by other processes; capped at SNAPSHOT_CACHE_TTL_SECONDS
+TOTALS_CACHE_TTL_SECONDS = _float_env("TOTALS_CACHE_TTL_SECONDS", 5.0)
+TOTALS_CACHE_MAX_BILLS = _int_env("TOTALS_CACHE_MAX_BILLS", 1000)
+
+# Uploads
+# Larger uploads are rejected with 413 before the request body is parsed
+UPLOAD_MAX_BYTES = _int_env("UPLOAD_MAX_BYTES", 20 * 1024 * 1024)
+
+# Gemini
+# Images up to this size are sent inline with the prompt; larger ones use the Files API
+GEMINI_INLINE_MAX_BYTES = _int_env("GEMINI_INLINE_MAX_BYTES", 15 * 1024 * 1024)
+
+# Parse result cache
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "true").lower() == "true"
+PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH", "cache/parse_cache.sqlite3")
+PARSE_CACHE_MEMORY_BYTES = _int_env("PARSE_CACHE_MEMORY_BYTES", 16 * 1024 * 1024)
+PARSE_CACHE_DISK_MAX_ENTRIES = _int_env("PARSE_CACHE_DISK_MAX_ENTRIES", 10000)
+
+# Near-duplicate detection (perceptual hashing on top of the parse cache)
+# Only matches re-sent copies of the same photo (e.g. forwarded through a chat app), not a second
+# photo of the same receipt. Off by default: receipts with the same layout that differ in a few
+# characters hash almost identically
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "false").lower() == "true"
+NEAR_DUPLICATE_HASH_SIZE = _int_env("NEAR_DUPLICATE_HASH_SIZE", 64)
+# Maximum Hamming distance (out of NEAR_DUPLICATE_HASH_SIZE ** 2 bits) for two photos to count as the same receipt
+NEAR_DUPLICATE_MAX_DISTANCE = _int_env("NEAR_DUPLICATE_MAX_DISTANCE", 16)
+# Only photos parsed this recently can be matched
+NEAR_DUPLICATE_WINDOW_SECONDS = _float_env("NEAR_DUPLICATE_WINDOW_SECONDS", 600.0)
+NEAR_DUPLICATE_MAX_ENTRIES = _int_env("NEAR_DUPLICATE_MAX_ENTRIES", 5000)
+
+# Image preprocessing before the Gemini call
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_WORKERS = _int_env("PREPROCESS_WORKERS", 2)
+PREPROCESS_MAX_EDGE = _int_env("PREPROCESS_MAX_EDGE", 1600)
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "WEBP")
+PREPROCESS_QUALITY = _int_env("PREPROCESS_QUALITY", 80)
+PREPROCESS_GRAYSCALE = os.getenv("PREPROCESS_GRAYSCALE", "true").lower() == "true"
+PREPROCESS_AUTO_CROP = os.getenv("PREPROCESS_AUTO_CROP", "true").lower() == "true"
+
+# Batch parsing
+BATCH_MAX_FILES = _int_env("BATCH_MAX_FILES", 50)
+BATCH_MAX_CONCURRENCY = _int_env("BATCH_MAX_CONCURRENCY", 4)
+
+# Background parse jobs
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "cache/parse_jobs.sqlite3")
+JOBS_WORKERS = _int_env("JOBS_WORKERS", 2)
+JOBS_RETENTION_SECONDS = _int_env("JOBS_RETENTION_SECONDS", 86400)
+# How often job event streams re-read the store to follow jobs run by other processes
+JOBS_EVENTS_POLL_INTERVAL = _float_env("JOBS_EVENTS_POLL_INTERVAL", 2.0)
+
+# Gemini resilience: adaptive rate limit, retries and circuit breaker
+GEMINI_RATE_LIMIT_RPS = _float_env("GEMINI_RATE_LIMIT_RPS", 5.0)
+GEMINI_RATE_LIMIT_BURST = _int_env("GEMINI_RATE_LIMIT_BURST", 10)
+GEMINI_RATE_LIMIT_MIN_RPS = _float_env("GEMINI_RATE_LIMIT_MIN_RPS", 0.2)
+GEMINI_RATE_LIMIT_MAX_RPS = _float_env("GEMINI_RATE_LIMIT_MAX_RPS", 20.0)
+GEMINI_RATE_LIMIT_MAX_WAIT = _float_env("GEMINI_RATE_LIMIT_MAX_WAIT", 10.0)
+GEMINI_MAX_ATTEMPTS = _int_env("GEMINI_MAX_ATTEMPTS", 3)
+GEMINI_RETRY_BASE_DELAY = _float_env("GEMINI_RETRY_BASE_DELAY", 0.5)
+GEMINI_RETRY_MAX_DELAY = _float_env("GEMINI_RETRY_MAX_DELAY", 8.0)
+GEMINI_BREAKER_FAILURE_THRESHOLD = _int_env("GEMINI_BREAKER_FAILURE_THRESHOLD", 5)
+GEMINI_BREAKER_RESET_SECONDS = _float_env("GEMINI_BREAKER_RESET_SECONDS", 30.0)
+
+# Hedged Gemini requests: fire a second identical call when the first is slower than recent calls
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_PERCENTILE = _float_env("GEMINI_HEDGE_PERCENTILE", 95.0)
+# Hedges allowed per request (0.05 = at most ~5% extra calls)
+GEMINI_HEDGE_BUDGET = _float_env("GEMINI_HEDGE_BUDGET", 0.05)
+GEMINI_HEDGE_MIN_SAMPLES = _int_env("GEMINI_HEDGE_MIN_SAMPLES", 20)
+GEMINI_HEDGE_MIN_DELAY = _float_env("GEMINI_HEDGE_MIN_DELAY", 0.5)
+GEMINI_HEDGE_WINDOW = _int_env("GEMINI_HEDGE_WINDOW", 500)
@@ -1,25 +1,126 @@
-import os
+import asyncio
 import hashlib
 import secrets
-from typing import Optional, List, Dict, Any
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from typing import Optional, List, Dict, Any, Callable
+import httpx
+from postgrest.exceptions import APIError
+from pydantic import ValidationError
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
 import uuid
+from app.core import config
+from app.models.schemas import ItemCreate
+from app.models.schemas import BillResults
+from app.services.bill_cache import BillSnapshotCache, BillTokenCache
+from app.services.bill_totals import BillTotalsAggregator
+from app.services.settlement import compute_bill_results
+from app.services.quantities import item_quantities
+
+# Defaults for fields a parsed item may omit
+ITEM_DEFAULTS = {"name": "", "category": "Food", "unit_price": 0, "quantity": 1}
+
+# PostgREST resource embedding equivalent of the get_bill_snapshot SQL function
+BILL_SNAPSHOT_SELECT = "*, items(*, claims(*), shared_members(*)), participants(*)"
+
+# PostgREST error code for a function that is not in the schema cache
+PGRST_FUNCTION_NOT_FOUND = "PGRST202"
+
+# Outcomes of claim_item_exclusive
+CLAIM_OK = "ok"
+CLAIM_BILL_NOT_FOUND = "bill_not_found"
+CLAIM_ITEM_NOT_FOUND = "item_not_found"
+CLAIM_INSUFFICIENT_QUANTITY = "insufficient_quantity"
+
+
+class ItemInsertError(Exception):
+    """
+    Raised by create_items when some rows could not be stored.
+    
+    Attributes:
+        created: Rows that were inserted, in input order
+        failures: One dict per rejected row with its input index, the item and the error
+    """
+    
+    def __init__(self, message: str, created: List[Dict[str, Any]], failures: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.created = created
+        self.failures = failures
+
+
+class ClaimRejectedError(Exception):
+    """
+    Raised by claim_item_exclusive when the claim was not stored.
+    
+    Attributes:
+        status: CLAIM_BILL_NOT_FOUND, CLAIM_ITEM_NOT_FOUND or CLAIM_INSUFFICIENT_QUANTITY
+        remaining: Remaining quantity of the item, for CLAIM_INSUFFICIENT_QUANTITY
+    """
+    
+    def __init__(self, status: str, remaining: Optional[int] = None):
+        super().__init__(status)
+        self.status = status
+        self.remaining = remaining
 
-# Load environment variables
-load_dotenv("env/config.env")
 
 class DatabaseService:
-    """Service for interacting with Supabase database"""
+    """
+    Service for interacting with Supabase database.
+    Create one instance per process, await connect() once and reuse it: the
+    underlying async HTTP client keeps a bounded pool of keep-alive
+    connections to PostgREST, and queries never block the event loop.
     
-    def __init__(self):
-        self.supabase_url = os.getenv("SUPABASE_URL")
-        self.supabase_service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    With a snapshot cache, bill snapshots are served from memory and every
+    write through this service invalidates the bill it touched. With a token
+    cache, link tokens are resolved to bills without a query (unknown tokens
+    included, for a short while). With a totals aggregator, claim and shared
+    pool writes update participant totals in place.
+    """
+    
+    def __init__(
+        self,
+        snapshot_cache: Optional[BillSnapshotCache] = None,
+        token_cache: Optional[BillTokenCache] = None,
+        totals: Optional[BillTotalsAggregator] = None,
+    ):
+        self.supabase_url = config.SUPABASE_URL
+        self.supabase_service_key = config.SUPABASE_SERVICE_ROLE_KEY
         
         if not self.supabase_url or not self.supabase_service_key:
             raise ValueError("Supabase credentials not found in environment variables")
         
-        self.client: Client = create_client(self.supabase_url, self.supabase_service_key)
+        # Pooled HTTP client shared by every query made through this service
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=config.HTTP_TIMEOUT,
+            follow_redirects=True,
+            http2=True,
+        )
+        
+        self.client: Optional[AsyncClient] = None
+        
+        # SQL functions PostgREST reported as not installed; their fallbacks are used instead
+        self._missing_rpcs = set()
+        
+        # Optional in-process caches of bill snapshots and link token lookups
+        self.snapshot_cache = snapshot_cache
+        self.token_cache = token_cache
+        # Optional incrementally maintained participant totals
+        self.totals = totals
+    
+    async def connect(self):
+        """Create the Supabase client; call once before the first query"""
+        self.client = await acreate_client(
+            self.supabase_url,
+            self.supabase_service_key,
+            options=AsyncClientOptions(httpx_client=self.http_client),
+        )
+    
+    async def close(self):
+        """Close pooled HTTP connections"""
+        await self.http_client.aclose()
     
     def generate_link_token(self) -> str:
         """Generate a secure random token for bill sharing"""
@@ -29,8 +130,32 @@ class DatabaseService:
         """Hash a token for secure storage"""
         return hashlib.sha256(token.encode()).hexdigest()
     
+    def _invalidate(
+        self,
+        bill_id: Optional[str] = None,
+        item_id: Optional[str] = None,
+        rows: Optional[List[Dict[str, Any]]] = None,
+        apply_to_totals: Optional[Callable[[BillTotalsAggregator, List[Dict[str, Any]]], None]] = None,
+    ):
+        """
+        Drop a written bill from the snapshot cache, looking it up by item id if needed.
+        If the write returned rows, apply_to_totals(totals, rows) updates the participant
+        totals in place; otherwise the bill's totals are dropped and rebuilt on the next read.
+        """
+        if self.totals is not None:
+            if rows and apply_to_totals is not None:
+                apply_to_totals(self.totals, rows)
+            else:
+                self.totals.drop(bill_id, item_id=item_id)
+        
+        if self.snapshot_cache is None:
+            return
+        if bill_id is None and item_id is not None:
+            bill_id = self.snapshot_cache.bill_for_item(item_id)
+        self.snapshot_cache.invalidate(bill_id)
+    
     # Bill operations
-    def create_bill(self, currency: str = "EUR") -> Dict[str, Any]:
+    async def create_bill(self, currency: str = "EUR") -> Dict[str, Any]:
         """Create a new bill and return it with the unhashed token"""
         token = self.generate_link_token()
         token_hash = self.hash_token(token)
@@ -41,47 +166,123 @@ class DatabaseService:
             "is_locked": False
         }
         
-        result = self.client.table("bills").insert(bill_data).execute()
+        result = await self.client.table("bills").insert(bill_data).execute()
         
         if result.data:
             bill = result.data[0]
+            if self.token_cache is not None:
+                self.token_cache.put(bill)
             bill["link_token"] = token  # Include unhashed token for response
             return bill
         else:
             raise Exception("Failed to create bill")
     
-    def get_bill_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+    async def get_bill_by_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Get bill by unhashed token"""
         token_hash = self.hash_token(token)
+        if self.token_cache is None:
+            result = await self.client.table("bills").select("*").eq("link_token_hash", token_hash).execute()
+            return result.data[0] if result.data else None
         
-        result = self.client.table("bills").select("*").eq("link_token_hash", token_hash).execute()
+        cached, bill = self.token_cache.get(token_hash)
+        if cached:
+            return bill
+        
+        started_at = self.token_cache.begin_load()
+        result = await self.client.table("bills").select("*").eq("link_token_hash", token_hash).execute()
         
         if result.data:
+            self.token_cache.put(result.data[0], started_at)
             return result.data[0]
+        self.token_cache.put_missing(token_hash)
         return None
     
-    def get_bill_with_items(self, bill_id: str) -> Optional[Dict[str, Any]]:
-        """Get bill with all related items and participants"""
-        # Get bill
-        bill_result = self.client.table("bills").select("*").eq("id", bill_id).execute()
-        if not bill_result.data:
-            return None
+    async def get_bill_with_items(self, bill_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get bill with all related items and participants in a single round trip.
+        Every item carries its "claims" and "shared_members".
+        """
+        if self.snapshot_cache is not None:
+            cached = self.snapshot_cache.get(bill_id)
+            if cached is not None:
+                return cached
+        return await self._get_bill_snapshot("get_bill_snapshot", {"bill_uuid": bill_id}, "id", bill_id)
+    
+    async def get_bill_with_items_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Like get_bill_with_items, but resolves the unhashed link token in the same round trip"""
+        token_hash = self.hash_token(token)
+        if self.snapshot_cache is not None:
+            cached = self.snapshot_cache.get_by_token_hash(token_hash)
+            if cached is not None:
+                return cached
+        if self.token_cache is None:
+            return await self._get_bill_snapshot("get_bill_snapshot_by_token", {"token_hash": token_hash}, "link_token_hash", token_hash)
         
-        bill = bill_result.data[0]
+        # A known token is loaded by bill id; an unknown one is answered without a query.
+        # The snapshot cache was already asked above, so go straight to the database
+        cached, bill = self.token_cache.get(token_hash)
+        if cached:
+            if bill is None:
+                return None
+            return await self._get_bill_snapshot("get_bill_snapshot", {"bill_uuid": bill["id"]}, "id", bill["id"])
+        
+        started_at = self.token_cache.begin_load()
+        snapshot = await self._get_bill_snapshot("get_bill_snapshot_by_token", {"token_hash": token_hash}, "link_token_hash", token_hash)
+        if snapshot is None:
+            self.token_cache.put_missing(token_hash)
+        else:
+            self.token_cache.put({key: value for key, value in snapshot.items() if key not in ("items", "participants")}, started_at)
+        return snapshot
+    
+    async def _get_bill_snapshot(self, rpc_name: str, rpc_params: Dict[str, Any], column: str, value: str) -> Optional[Dict[str, Any]]:
+        """Load a bill snapshot from the database and remember it in the snapshot cache"""
+        if self.snapshot_cache is None:
+            return await self._load_bill_snapshot(rpc_name, rpc_params, column, value)
         
-        # Get items
-        items_result = self.client.table("items").select("*").eq("bill_id", bill_id).execute()
-        bill["items"] = items_result.data or []
+        started_at = self.snapshot_cache.begin_load()
+        try:
+            snapshot = await self._load_bill_snapshot(rpc_name, rpc_params, column, value)
+        except BaseException:
+            self.snapshot_cache.end_load(started_at)
+            raise
         
-        # Get participants
-        participants_result = self.client.table("participants").select("*").eq("bill_id", bill_id).execute()
-        bill["participants"] = participants_result.data or []
+        if snapshot is None:
+            self.snapshot_cache.end_load(started_at)
+        else:
+            self.snapshot_cache.put(snapshot, started_at)
+        return snapshot
+    
+    async def _load_bill_snapshot(self, rpc_name: str, rpc_params: Dict[str, Any], column: str, value: str) -> Optional[Dict[str, Any]]:
+        """Load one bill snapshot through an SQL function, or through resource embedding if it is not installed"""
+        if rpc_name not in self._missing_rpcs:
+            try:
+                result = await self.client.rpc(rpc_name, rpc_params).execute()
+                return result.data or None
+            except Exception as e:
+                if isinstance(e, APIError) and e.code == PGRST_FUNCTION_NOT_FOUND:
+                    self._missing_rpcs.add(rpc_name)
         
-        return bill
+        # Fallback: the same nested document through resource embedding (still one request)
+        result = await (
+            self.client.table("bills")
+            .select(BILL_SNAPSHOT_SELECT)
+            .eq(column, value)
+            .order("created_at", foreign_table="items")
+            .order("created_at", foreign_table="items.claims")
+            .order("created_at", foreign_table="items.shared_members")
+            .order("created_at", foreign_table="participants")
+            .execute()
+        )
+        return result.data[0] if result.data else None
     
-    def update_bill(self, bill_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+    async def update_bill(self, bill_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
         """Update bill fields"""
-        result = self.client.table("bills").update(updates).eq("id", bill_id).execute()
+        try:
+            result = await self.client.table("bills").update(updates).eq("id", bill_id).execute()
+        finally:
+            self._invalidate(bill_id)
+            if self.token_cache is not None:
+                self.token_cache.invalidate_bill(bill_id)
         
         if result.data:
             return result.data[0]
@@ -89,45 +290,93 @@ class DatabaseService:
             raise Exception("Failed to update bill")
     
     # Item operations
-    def create_items(self, bill_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Create multiple items for a bill"""
-        try:
-            created_items = []
-            
-            # Create items one by one to avoid batch issues
-            for item in items:
-                db_item = {
-                    "bill_id": bill_id,
-                    "name": item.get("name", ""),
-                    "category": item.get("category", "Food"),
-                    "unit_price": float(item.get("unit_price", 0)),
-                    "qty_total": int(item.get("quantity", 1)),
-                    "type": item.get("type", "item"),
-                    "confidence": float(item.get("confidence", 1.0)),
-                    "notes": item.get("notes")
-                }
-                
-                result = self.client.table("items").insert(db_item).execute()
-                
-                if result.data:
-                    created_items.append(result.data[0])
-                else:
-                    print(f"Failed to create item: {db_item}")
+    def _item_row(self, bill_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate an item and convert it to an items table row"""
+        values = {**ITEM_DEFAULTS, **{key: value for key, value in item.items() if value is not None}}
+        validated = ItemCreate(**values)
+        return {
+            "bill_id": bill_id,
+            "name": validated.name,
+            "category": validated.category.value,
+            "unit_price": validated.unit_price,
+            "qty_total": validated.quantity,
+            "type": validated.type.value,
+            "confidence": validated.confidence,
+            "notes": validated.notes
+        }
+    
+    async def create_items(self, bill_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Create multiple items for a bill with bulk inserts.
+        
+        Every item is validated first; valid rows are then inserted in chunks of
+        DB_INSERT_CHUNK_SIZE, one request per chunk, with the chunks sent
+        concurrently. If PostgREST rejects a chunk its rows are retried one by
+        one so a single bad row only fails itself. Timeouts and connection
+        errors are raised instead: the chunk may have been stored anyway, and
+        retrying it could insert its rows twice.
+        
+        Raises:
+            ItemInsertError: If any item was invalid or rejected (carries the rows that were created)
+            httpx.HTTPError: If a request failed in transport
+        """
+        rows = []
+        failures = []
+        for index, item in enumerate(items):
+            try:
+                rows.append((index, self._item_row(bill_id, item)))
+            except (ValidationError, TypeError, ValueError) as e:
+                failures.append({"index": index, "item": item, "error": str(e)})
+        
+        async def insert_chunk(chunk):
+            try:
+                result = await self.client.table("items").insert([row for _, row in chunk]).execute()
+                return result.data or []
+            except APIError as e:
+                # PostgREST rejected the chunk as a whole, so none of its rows were stored
+                print(f"Bulk item insert failed, retrying rows individually: {e}")
             
-            return created_items
-        except Exception as e:
-            print(f"Error creating items: {e}")
-            print(f"Items data: {items}")
-            raise Exception(f"Failed to create items: {str(e)}")
+            chunk_created = []
+            for index, row in chunk:
+                try:
+                    result = await self.client.table("items").insert(row).execute()
+                    chunk_created.extend(result.data or [])
+                except APIError as row_error:
+                    failures.append({"index": index, "item": items[index], "error": str(row_error)})
+            return chunk_created
+        
+        chunk_size = config.DB_INSERT_CHUNK_SIZE
+        try:
+            chunk_results = await asyncio.gather(*[
+                insert_chunk(rows[start:start + chunk_size]) for start in range(0, len(rows), chunk_size)
+            ])
+        finally:
+            self._invalidate(bill_id)
+        created_items = [row for chunk_created in chunk_results for row in chunk_created]
+        
+        if failures:
+            failures.sort(key=lambda failure: failure["index"])
+            raise ItemInsertError(
+                f"Failed to create {len(failures)} of {len(items)} items",
+                created_items,
+                failures,
+            )
+        return created_items
     
-    def get_items(self, bill_id: str) -> List[Dict[str, Any]]:
+    async def get_items(self, bill_id: str) -> List[Dict[str, Any]]:
         """Get all items for a bill"""
-        result = self.client.table("items").select("*").eq("bill_id", bill_id).execute()
+        result = await self.client.table("items").select("*").eq("bill_id", bill_id).execute()
         return result.data or []
     
-    def update_item(self, item_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
-        """Update an item"""
-        result = self.client.table("items").update(updates).eq("id", item_id).execute()
+    async def update_item(self, item_id: str, updates: Dict[str, Any], bill_id: Optional[str] = None) -> Dict[str, Any]:
+        """Update an item (pass bill_id if known so the right cached snapshot is dropped)"""
+        result = None
+        try:
+            result = await self.client.table("items").update(updates).eq("id", item_id).execute()
+        finally:
+            if bill_id is None and result is not None and result.data:
+                bill_id = result.data[0]["bill_id"]
+            self._invalidate(bill_id, item_id=item_id)
         
         if result.data:
             return result.data[0]
@@ -135,24 +384,32 @@ class DatabaseService:
             raise Exception("Failed to update item")
     
     # Participant operations
-    def create_participants(self, bill_id: str, participants: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    async def create_participants(self, bill_id: str, participants: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Create multiple participants for a bill"""
         for participant in participants:
             participant["bill_id"] = bill_id
         
-        result = self.client.table("participants").insert(participants).execute()
+        result = None
+        try:
+            result = await self.client.table("participants").insert(participants).execute()
+        finally:
+            self._invalidate(
+                bill_id,
+                rows=result.data if result else None,
+                apply_to_totals=BillTotalsAggregator.add_participants
+            )
         
         if result.data:
             return result.data
         else:
             raise Exception("Failed to create participants")
     
-    def get_participants(self, bill_id: str) -> List[Dict[str, Any]]:
+    async def get_participants(self, bill_id: str) -> List[Dict[str, Any]]:
         """Get all participants for a bill"""
-        result = self.client.table("participants").select("*").eq("bill_id", bill_id).execute()
+        result = await self.client.table("participants").select("*").eq("bill_id", bill_id).execute()
         return result.data or []
     
-    def create_participant(self, bill_id: str, name: str, is_payer: bool = False) -> Dict[str, Any]:
+    async def create_participant(self, bill_id: str, name: str, is_payer: bool = False) -> Dict[str, Any]:
         """Create a single participant"""
         participant_data = {
             "bill_id": bill_id,
@@ -160,7 +417,15 @@ class DatabaseService:
             "is_payer": is_payer
         }
         
-        result = self.client.table("participants").insert(participant_data).execute()
+        result = None
+        try:
+            result = await self.client.table("participants").insert(participant_data).execute()
+        finally:
+            self._invalidate(
+                bill_id,
+                rows=result.data if result else None,
+                apply_to_totals=BillTotalsAggregator.add_participants
+            )
         
         if result.data:
             return result.data[0]
@@ -168,7 +433,7 @@ class DatabaseService:
             raise Exception("Failed to create participant")
     
     # Claim operations
-    def create_claim(self, bill_id: str, item_id: str, participant_id: str, qty_claimed: int) -> Dict[str, Any]:
+    async def create_claim(self, bill_id: str, item_id: str, participant_id: str, qty_claimed: int) -> Dict[str, Any]:
         """Create an exclusive claim"""
         claim_data = {
             "bill_id": bill_id,
@@ -177,97 +442,191 @@ class DatabaseService:
             "qty_claimed": qty_claimed
         }
         
-        result = self.client.table("claims").insert(claim_data).execute()
+        result = None
+        try:
+            result = await self.client.table("claims").insert(claim_data).execute()
+        finally:
+            self._invalidate(
+                bill_id,
+                rows=result.data if result else None,
+                apply_to_totals=lambda totals, rows: totals.add_claim(rows[0])
+            )
         
         if result.data:
             return result.data[0]
         else:
             raise Exception("Failed to create claim")
     
-    def get_claims(self, bill_id: str) -> List[Dict[str, Any]]:
+    async def claim_item_exclusive(self, token: str, item_id: str, participant_id: str, quantity: int) -> Dict[str, Any]:
+        """
+        Claim part of an item on the bill with this unhashed token, in one round trip.
+        
+        The claim_item_exclusive SQL function checks the remaining quantity and
+        inserts the claim under a row lock on the item, so concurrent claims
+        cannot over-claim. If the function is not installed, the check and the
+        insert are made separately (not safe under concurrency).
+        
+        Returns:
+            {"claim": the new claim row, "remaining_quantity": what is left of the item}
+        
+        Raises:
+            ClaimRejectedError: If the bill or item does not exist or not enough is left
+        """
+        token_hash = self.hash_token(token)
+        if self.token_cache is not None:
+            cached, bill = self.token_cache.get(token_hash)
+            if cached and bill is None:
+                raise ClaimRejectedError(CLAIM_BILL_NOT_FOUND)
+        
+        if "claim_item_exclusive" not in self._missing_rpcs:
+            try:
+                result = await self.client.rpc("claim_item_exclusive", {
+                    "token_hash": token_hash,
+                    "item_uuid": item_id,
+                    "participant_uuid": participant_id,
+                    "qty": quantity
+                }).execute()
+            except Exception as e:
+                if not (isinstance(e, APIError) and e.code == PGRST_FUNCTION_NOT_FOUND):
+                    # The claim may or may not have been stored
+                    self._invalidate(item_id=item_id)
+                    raise
+                self._missing_rpcs.add("claim_item_exclusive")
+            else:
+                outcome = result.data
+                if outcome["status"] != CLAIM_OK:
+                    raise ClaimRejectedError(outcome["status"], outcome.get("remaining"))
+                self._invalidate(
+                    outcome["claim"]["bill_id"],
+                    rows=[outcome["claim"]],
+                    apply_to_totals=lambda totals, rows: totals.add_claim(rows[0])
+                )
+                return {"claim": outcome["claim"], "remaining_quantity": outcome["remaining"]}
+        
+        # Fallback: check against the snapshot, then insert
+        bill = await self.get_bill_with_items_by_token(token)
+        if not bill:
+            raise ClaimRejectedError(CLAIM_BILL_NOT_FOUND)
+        item = next((i for i in bill["items"] if str(i["id"]) == str(item_id)), None)
+        if not item:
+            raise ClaimRejectedError(CLAIM_ITEM_NOT_FOUND)
+        
+        remaining = item_quantities(item)["remaining"]
+        if remaining < quantity:
+            raise ClaimRejectedError(CLAIM_INSUFFICIENT_QUANTITY, remaining)
+        
+        claim = await self.create_claim(bill["id"], item_id, participant_id, quantity)
+        return {"claim": claim, "remaining_quantity": remaining - quantity}
+    
+    async def get_claims(self, bill_id: str) -> List[Dict[str, Any]]:
         """Get all claims for a bill"""
-        result = self.client.table("claims").select("*").eq("bill_id", bill_id).execute()
+        result = await self.client.table("claims").select("*").eq("bill_id", bill_id).execute()
         return result.data or []
     
-    def delete_claim(self, claim_id: str) -> bool:
-        """Delete a claim"""
-        result = self.client.table("claims").delete().eq("id", claim_id).execute()
+    async def delete_claim(self, claim_id: str, bill_id: Optional[str] = None) -> bool:
+        """Delete a claim (pass bill_id if known so the right cached snapshot is dropped)"""
+        result = None
+        try:
+            result = await self.client.table("claims").delete().eq("id", claim_id).execute()
+        finally:
+            if bill_id is None and result is not None and result.data:
+                bill_id = result.data[0]["bill_id"]
+            self._invalidate(
+                bill_id,
+                rows=result.data if result else None,
+                apply_to_totals=lambda totals, rows: totals.remove_claim(rows[0])
+            )
         return True
     
     # Shared pool operations
-    def init_shared_pool(self, item_id: str, participant_id: str, pool_size: int) -> Dict[str, Any]:
+    async def init_shared_pool(self, item_id: str, participant_id: str, pool_size: int, bill_id: Optional[str] = None) -> Dict[str, Any]:
         """Initialize a shared pool for an item"""
-        # First, update the item with the pool size
-        self.client.table("items").update({"qty_shared_pool": pool_size}).eq("id", item_id).execute()
-        
-        # Then add the participant to the shared members
         member_data = {
             "item_id": item_id,
             "participant_id": participant_id
         }
         
-        result = self.client.table("shared_members").insert(member_data).execute()
+        # Set the item's pool size and add the participant to the shared members concurrently
+        result = None
+        try:
+            _, result = await asyncio.gather(
+                self.client.table("items").update({"qty_shared_pool": pool_size}).eq("id", item_id).execute(),
+                self.client.table("shared_members").insert(member_data).execute(),
+            )
+        finally:
+            self._invalidate(
+                bill_id,
+                item_id=item_id,
+                rows=result.data if result else None,
+                apply_to_totals=lambda totals, rows: totals.init_pool(bill_id, item_id, pool_size, rows[0])
+            )
         
         if result.data:
             return result.data[0]
         else:
             raise Exception("Failed to initialize shared pool")
     
-    def join_shared_pool(self, item_id: str, participant_id: str) -> Dict[str, Any]:
+    async def join_shared_pool(self, item_id: str, participant_id: str, bill_id: Optional[str] = None) -> Dict[str, Any]:
         """Join an existing shared pool"""
         member_data = {
             "item_id": item_id,
             "participant_id": participant_id
         }
         
-        result = self.client.table("shared_members").insert(member_data).execute()
+        result = None
+        try:
+            result = await self.client.table("shared_members").insert(member_data).execute()
+        finally:
+            self._invalidate(
+                bill_id,
+                item_id=item_id,
+                rows=result.data if result else None,
+                apply_to_totals=lambda totals, rows: totals.add_member(bill_id, item_id, rows[0])
+            )
         
         if result.data:
             return result.data[0]
         else:
             raise Exception("Failed to join shared pool")
     
-    def leave_shared_pool(self, item_id: str, participant_id: str) -> bool:
+    async def leave_shared_pool(self, item_id: str, participant_id: str, bill_id: Optional[str] = None) -> bool:
         """Leave a shared pool"""
-        result = self.client.table("shared_members").delete().eq("item_id", item_id).eq("participant_id", participant_id).execute()
+        result = None
+        try:
+            result = await self.client.table("shared_members").delete().eq("item_id", item_id).eq("participant_id", participant_id).execute()
+        finally:
+            self._invalidate(
+                bill_id,
+                item_id=item_id,
+                rows=result.data if result else None,
+                apply_to_totals=lambda totals, rows: totals.remove_member(bill_id, item_id, participant_id)
+            )
         return True
     
-    def get_shared_members(self, item_id: str) -> List[Dict[str, Any]]:
+    async def get_shared_members(self, item_id: str) -> List[Dict[str, Any]]:
         """Get all shared members for an item"""
-        result = self.client.table("shared_members").select("*").eq("item_id", item_id).execute()
+        result = await self.client.table("shared_members").select("*").eq("item_id", item_id).execute()
         return result.data or []
     
     # Results and calculations
-    def get_participant_totals(self, bill_id: str) -> List[Dict[str, Any]]:
-        """Get calculated totals for all participants"""
-        try:
-            result = self.client.rpc("get_participant_totals", {"bill_uuid": bill_id}).execute()
-            return result.data or []
-        except Exception:
-            # Fallback: return empty list for now
-            # This would need a more complex manual calculation
-            return []
-    
-    def get_remaining_quantity(self, item_id: str) -> int:
-        """Get remaining quantity for an item"""
-        try:
-            result = self.client.rpc("calculate_remaining_qty", {"item_uuid": item_id}).execute()
-            return result.data or 0
-        except Exception:
-            # Fallback: calculate manually
-            # Get item total quantity
-            item_result = self.client.table("items").select("qty_total").eq("id", item_id).execute()
-            if not item_result.data:
-                return 0
-            
-            total_qty = item_result.data[0]["qty_total"]
-            
-            # Get exclusive claims
-            claims_result = self.client.table("claims").select("qty_claimed").eq("item_id", item_id).execute()
-            exclusive_claimed = sum(claim["qty_claimed"] for claim in claims_result.data or [])
-            
-            # Get shared pool quantity
-            item_result = self.client.table("items").select("qty_shared_pool").eq("id", item_id).execute()
-            shared_pool = item_result.data[0]["qty_shared_pool"] if item_result.data else 0
-            
-            return total_qty - exclusive_claimed - shared_pool
+    async def get_bill_results_by_token(self, token: str) -> Optional[BillResults]:
+        """
+        Participant totals of the bill with this unhashed token.
+        Served from the totals aggregator when the bill is aggregated (O(participants)),
+        otherwise settled from the bill snapshot, which then seeds the aggregator.
+        """
+        token_hash = self.hash_token(token)
+        if self.totals is None:
+            bill = await self.get_bill_with_items_by_token(token)
+            return compute_bill_results(bill) if bill else None
+        
+        results = self.totals.results_by_token_hash(token_hash)
+        if results is not None:
+            return results
+        
+        started_at = self.totals.begin_load()
+        bill = await self.get_bill_with_items_by_token(token)
+        if not bill:
+            return None
+        self.totals.seed(bill, started_at)
+        return compute_bill_results(bill)
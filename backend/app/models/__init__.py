@@ -1,7 +1,7 @@
 # Data models
 from .schemas import (
     ItemCategory, ItemType, VendorInfo, BillMeta, ItemBase, ItemCreate, ItemResponse,
-    GeminiBillResponse, BillCreate, BillResponse, BillWithItems, ParticipantCreate,
+    GeminiBillResponse, GeminiCompactItem, GeminiCompactBill, BillCreate, BillResponse, BillWithItems, ParticipantCreate,
     ParticipantResponse, ClaimCreate, ClaimResponse, SharedPoolInit, SharedPoolJoin,
     SharedMemberResponse, PublicBillResponse, PublicClaimRequest, PublicSharedInitRequest,
     PublicSharedJoinRequest, ParticipantTotal, BillResults
@@ -9,7 +9,7 @@ from .schemas import (
 
 __all__ = [
     'ItemCategory', 'ItemType', 'VendorInfo', 'BillMeta', 'ItemBase', 'ItemCreate', 'ItemResponse',
-    'GeminiBillResponse', 'BillCreate', 'BillResponse', 'BillWithItems', 'ParticipantCreate',
+    'GeminiBillResponse', 'GeminiCompactItem', 'GeminiCompactBill', 'BillCreate', 'BillResponse', 'BillWithItems', 'ParticipantCreate',
     'ParticipantResponse', 'ClaimCreate', 'ClaimResponse', 'SharedPoolInit', 'SharedPoolJoin',
     'SharedMemberResponse', 'PublicBillResponse', 'PublicClaimRequest', 'PublicSharedInitRequest',
     'PublicSharedJoinRequest', 'ParticipantTotal', 'BillResults'
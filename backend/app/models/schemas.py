@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 from typing import List, Optional, Literal
 from decimal import Decimal
 from datetime import datetime
@@ -56,6 +56,25 @@ class GeminiBillResponse(BaseModel):
     items: List[ItemCreate]
     meta: BillMeta
 
+# Compact structured output requested from Gemini.
+# Short keys keep the number of generated tokens low; field types and
+# constraints are taken from ItemCreate and GeminiBillResponse.
+GEMINI_ITEM_KEYS = {"name": "n", "category": "c", "unit_price": "p", "quantity": "q"}
+
+GeminiCompactItem = create_model(
+    "GeminiCompactItem",
+    **{
+        short_key: (ItemCreate.model_fields[field].annotation, ItemCreate.model_fields[field])
+        for field, short_key in GEMINI_ITEM_KEYS.items()
+    }
+)
+
+GeminiCompactBill = create_model(
+    "GeminiCompactBill",
+    cur=(GeminiBillResponse.model_fields["currency"].annotation, GeminiBillResponse.model_fields["currency"]),
+    i=(List[GeminiCompactItem], ...)
+)
+
 # Bill models
 class BillCreate(BaseModel):
     currency: str = "EUR"
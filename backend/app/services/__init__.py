@@ -1,4 +1,23 @@
 # Services module
 from .gemini_service import GeminiService
+from .parse_cache import ParseCache
+from .image_hash import NearDuplicateIndex
+from .image_preprocessing import ImagePreprocessor
+from .resilience import (
+    AdaptiveRateLimiter, CircuitBreaker, ResilientCaller, UpstreamUnavailableError, Deadline, DeadlineExceededError
+)
+from .singleflight import SingleFlight
+from .bill_cache import BillSnapshotCache, BillTokenCache
+from .quantities import compute_item_quantities, item_quantities
+from .settlement import compute_bill_results
+from .bill_totals import BillTotalsAggregator
 
-__all__ = ['GeminiService']
+__all__ = [
+    'GeminiService', 'ParseCache', 'NearDuplicateIndex', 'ImagePreprocessor',
+    'AdaptiveRateLimiter', 'CircuitBreaker', 'ResilientCaller', 'UpstreamUnavailableError',
+    'Deadline', 'DeadlineExceededError',
+    'SingleFlight',
+    'BillSnapshotCache', 'BillTokenCache',
+    'compute_item_quantities', 'item_quantities',
+    'compute_bill_results', 'BillTotalsAggregator'
+]
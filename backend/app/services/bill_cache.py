@@ -0,0 +1,237 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+
+# Invalidation key for a write whose bill id is unknown
+ANY_BILL = "*"
+
+
+class BillSnapshotCache:
+    """
+    Read-through cache of bill snapshots (bill + items + claims + shared
+    members + participants) keyed by bill id, with a TTL and LRU eviction.
+
+    DatabaseService invalidates a bill after every write to it. To make sure
+    a load that raced with a write can never put the pre-write state back
+    into the cache, every load is bracketed by begin_load()/put(): a snapshot
+    is only stored if its bill was not invalidated after the load started.
+    The TTL bounds staleness for writes made by other processes.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, ttl_seconds: float = 5.0, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        # bill id -> (expires at, snapshot)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Secondary indexes over cached snapshots
+        self._bill_by_token_hash: Dict[str, str] = {}
+        self._bill_by_item: Dict[str, str] = {}
+
+        # Invalidation sequence numbers, kept only while loads that started earlier are in flight.
+        # ANY_BILL marks writes to a bill we could not identify, which spoil every in-flight load
+        self._sequence = 0
+        self._invalidated_at: Dict[str, int] = {}
+        self._active_loads: Dict[int, int] = {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_loads_discarded = 0
+
+    def get(self, bill_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached snapshot, or None if missing or expired"""
+        bill_id = str(bill_id)
+        entry = self._entries.get(bill_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(bill_id)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(bill_id)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def get_by_token_hash(self, token_hash: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached snapshot for a hashed link token"""
+        bill_id = self._bill_by_token_hash.get(token_hash)
+        if bill_id is None:
+            self.misses += 1
+            return None
+        return self.get(bill_id)
+
+    def bill_for_item(self, item_id: str) -> Optional[str]:
+        """Bill id of a cached item (items of uncached bills are unknown)"""
+        return self._bill_by_item.get(str(item_id))
+
+    def begin_load(self) -> int:
+        """Call before loading a snapshot; pass the result to put() or end_load()"""
+        started_at = self._sequence
+        self._active_loads[started_at] = self._active_loads.get(started_at, 0) + 1
+        return started_at
+
+    def end_load(self, started_at: int):
+        """Finish a load that produced nothing to cache"""
+        remaining = self._active_loads[started_at] - 1
+        if remaining:
+            self._active_loads[started_at] = remaining
+        else:
+            del self._active_loads[started_at]
+
+        # Invalidations only matter to loads that started before them
+        if not self._active_loads:
+            self._invalidated_at.clear()
+        else:
+            oldest = min(self._active_loads)
+            for bill_id in [bill_id for bill_id, sequence in self._invalidated_at.items() if sequence <= oldest]:
+                del self._invalidated_at[bill_id]
+
+    def put(self, snapshot: Dict[str, Any], started_at: int):
+        """Cache a snapshot loaded since begin_load(), unless its bill was written to meanwhile"""
+        bill_id = str(snapshot["id"])
+        invalidated_at = max(self._invalidated_at.get(bill_id, -1), self._invalidated_at.get(ANY_BILL, -1))
+        stale = invalidated_at > started_at
+        self.end_load(started_at)
+        if stale:
+            self.stale_loads_discarded += 1
+            return
+
+        self._remove(bill_id)
+        self._entries[bill_id] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(snapshot))
+        if snapshot.get("link_token_hash"):
+            self._bill_by_token_hash[snapshot["link_token_hash"]] = bill_id
+        for item in snapshot.get("items", []):
+            self._bill_by_item[str(item["id"])] = bill_id
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, bill_id: Optional[str]):
+        """
+        Drop a bill after a write; in-flight loads of it will not be cached.
+        With bill_id None (a write to a bill that is not cached, e.g. found by
+        item id only) every in-flight load is treated as stale.
+        """
+        bill_id = str(bill_id) if bill_id is not None else ANY_BILL
+        self.invalidations += 1
+        self._sequence += 1
+        if self._active_loads:
+            self._invalidated_at[bill_id] = self._sequence
+        self._remove(bill_id)
+
+    def _remove(self, bill_id: str):
+        entry = self._entries.pop(bill_id, None)
+        if entry is None:
+            return
+        snapshot = entry[1]
+        self._bill_by_token_hash.pop(snapshot.get("link_token_hash"), None)
+        for item in snapshot.get("items", []):
+            self._bill_by_item.pop(str(item["id"]), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "invalidations": self.invalidations,
+            "stale_loads_discarded": self.stale_loads_discarded,
+        }
+
+
+class BillTokenCache:
+    """
+    Bounded cache of link token hash -> bill row (id, lock state, ...), with
+    a TTL and LRU eviction. Link tokens never change for a bill, so the only
+    thing that can go stale is the row itself; DatabaseService drops it after
+    every update to the bill, and rows loaded while any bill was updated
+    (see begin_load()) are not cached. Bill updates are rare, so this is cheap.
+
+    Unknown tokens are cached too (for a shorter TTL) so that probing random
+    tokens costs one database query per token and window, not per request.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0, negative_ttl_seconds: float = 10.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+
+        # token hash -> (expires at, bill row or None for unknown tokens)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._token_hash_by_bill: Dict[str, str] = {}
+        # Bumped on every bill update
+        self._generation = 0
+
+        # Counters
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, token_hash: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Return (cached, bill); a cached bill of None means the token is known not to exist"""
+        entry = self._entries.get(token_hash)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(token_hash)
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(token_hash)
+        if entry[1] is None:
+            self.negative_hits += 1
+            return True, None
+        self.hits += 1
+        return True, dict(entry[1])
+
+    def begin_load(self) -> int:
+        """Call before loading a bill row; pass the result to put()"""
+        return self._generation
+
+    def put(self, bill: Dict[str, Any], started_at: Optional[int] = None):
+        """Cache a bill row under its link token hash, unless a bill was updated since begin_load()"""
+        if started_at is not None and started_at != self._generation:
+            return
+        token_hash = bill["link_token_hash"]
+        self._store(token_hash, time.monotonic() + self.ttl_seconds, dict(bill))
+        self._token_hash_by_bill[str(bill["id"])] = token_hash
+
+    def put_missing(self, token_hash: str):
+        """Remember for a short while that no bill has this token"""
+        self._store(token_hash, time.monotonic() + self.negative_ttl_seconds, None)
+
+    def invalidate_bill(self, bill_id: str):
+        """Drop a bill's row after it was updated"""
+        self._generation += 1
+        token_hash = self._token_hash_by_bill.get(str(bill_id))
+        if token_hash is not None:
+            self._remove(token_hash)
+
+    def _store(self, token_hash: str, expires: float, bill: Optional[Dict[str, Any]]):
+        self._remove(token_hash)
+        self._entries[token_hash] = (expires, bill)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, token_hash: str):
+        entry = self._entries.pop(token_hash, None)
+        if entry is not None and entry[1] is not None:
+            self._token_hash_by_bill.pop(str(entry[1]["id"]), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else None,
+        }
@@ -0,0 +1,228 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from app.models.schemas import BillResults
+from app.services.settlement import item_contributions, bill_total_cents, build_bill_results
+
+
+def _contains(rows: List[Dict[str, Any]], row: Dict[str, Any]) -> bool:
+    """True if a row with the same id is already in rows"""
+    return any(str(existing["id"]) == str(row["id"]) for existing in rows)
+
+
+class _BillState:
+    """Aggregated totals of one bill plus what is needed to update them item by item"""
+
+    def __init__(self, snapshot: Dict[str, Any], expires: float):
+        self.expires = expires
+        self.bill = {
+            "id": snapshot["id"],
+            "currency": snapshot["currency"],
+            "link_token_hash": snapshot.get("link_token_hash"),
+            "participants": [{"id": p["id"], "name": p["name"]} for p in snapshot.get("participants") or []],
+        }
+        self.total_bill = bill_total_cents(snapshot)
+
+        # item id -> item with its claims and shared members, and its contribution map
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.contributions: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        # participant id -> [exclusive cents, shared cents]
+        self.totals: Dict[str, List[int]] = {}
+
+        for item in snapshot.get("items") or []:
+            item_id = str(item["id"])
+            self.items[item_id] = {
+                "unit_price": item["unit_price"],
+                "qty_total": item["qty_total"],
+                "qty_shared_pool": item.get("qty_shared_pool") or 0,
+                "claims": copy.deepcopy(item.get("claims") or []),
+                "shared_members": copy.deepcopy(item.get("shared_members") or []),
+            }
+            self.contributions[item_id] = {}
+            self.apply_item(item_id)
+
+    def apply_item(self, item_id: str):
+        """Recompute one item's contributions and move only the differences into the totals"""
+        old = self.contributions[item_id]
+        new = item_contributions(self.items[item_id])
+        for participant_id in old.keys() | new.keys():
+            old_exclusive, old_shared = old.get(participant_id, (0, 0))
+            new_exclusive, new_shared = new.get(participant_id, (0, 0))
+            totals = self.totals.setdefault(participant_id, [0, 0])
+            totals[0] += new_exclusive - old_exclusive
+            totals[1] += new_shared - old_shared
+        self.contributions[item_id] = new
+
+    def results(self) -> BillResults:
+        return build_bill_results(self.bill, {pid: tuple(t) for pid, t in self.totals.items()}, self.total_bill)
+
+
+class BillTotalsAggregator:
+    """
+    Per-participant totals of recently used bills, kept up to date as claims
+    and shared pools change.
+
+    A bill is seeded from one snapshot by the settlement engine; after that,
+    each claim or pool change recomputes only the affected item and moves the
+    difference into the totals of the participants involved, and reading the
+    results costs O(participants). Writes that cannot be applied this way
+    (item or bill edits, failed writes) drop the bill, which is reseeded on
+    the next read. Seeds loaded while any write was applied are not kept,
+    and the TTL bounds drift from writes made by other processes.
+
+    A seed can still be loaded while a write is in flight and already
+    contain its row, so adding a claim, pool member or participant whose id
+    the bill already has is a no-op rather than counting it twice.
+
+    Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, ttl_seconds: float = 5.0, max_bills: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_bills = max_bills
+
+        self._bills: "OrderedDict[str, _BillState]" = OrderedDict()
+        self._bill_by_token_hash: Dict[str, str] = {}
+        self._bill_by_item: Dict[str, str] = {}
+        # Bumped on every write event
+        self._generation = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.seeds = 0
+        self.updates = 0
+        self.drops = 0
+
+    def begin_load(self) -> int:
+        """Call before loading the snapshot to seed from; pass the result to seed()"""
+        return self._generation
+
+    def seed(self, snapshot: Dict[str, Any], started_at: int):
+        """Aggregate a bill snapshot, unless a write was applied since begin_load()"""
+        if started_at != self._generation:
+            return
+        bill_id = str(snapshot["id"])
+        self._remove(bill_id)
+        state = _BillState(snapshot, time.monotonic() + self.ttl_seconds)
+        self._bills[bill_id] = state
+        if state.bill["link_token_hash"]:
+            self._bill_by_token_hash[state.bill["link_token_hash"]] = bill_id
+        for item_id in state.items:
+            self._bill_by_item[item_id] = bill_id
+        self.seeds += 1
+
+        while len(self._bills) > self.max_bills:
+            self._remove(next(iter(self._bills)))
+
+    def results(self, bill_id: str) -> Optional[BillResults]:
+        """Totals of an aggregated bill, or None if it has to be seeded first"""
+        state = self._live(str(bill_id))
+        if state is None:
+            self.misses += 1
+            return None
+        self._bills.move_to_end(str(bill_id))
+        self.hits += 1
+        return state.results()
+
+    def results_by_token_hash(self, token_hash: str) -> Optional[BillResults]:
+        bill_id = self._bill_by_token_hash.get(token_hash)
+        if bill_id is None:
+            self.misses += 1
+            return None
+        return self.results(bill_id)
+
+    def bill_for_item(self, item_id: str) -> Optional[str]:
+        return self._bill_by_item.get(str(item_id))
+
+    # Write events
+    def add_participants(self, participants: List[Dict[str, Any]]):
+        self._generation += 1
+        for participant in participants:
+            state = self._live(str(participant["bill_id"]))
+            if state is not None and not _contains(state.bill["participants"], participant):
+                state.bill["participants"].append({"id": participant["id"], "name": participant["name"]})
+                self.updates += 1
+
+    def add_claim(self, claim: Dict[str, Any]):
+        def change(item):
+            if not _contains(item["claims"], claim):
+                item["claims"].append(claim)
+        self._update_item(claim["bill_id"], claim["item_id"], change)
+
+    def remove_claim(self, claim: Dict[str, Any]):
+        def change(item):
+            remaining = [c for c in item["claims"] if str(c["id"]) != str(claim["id"])]
+            if len(remaining) == len(item["claims"]):
+                return False
+            item["claims"] = remaining
+        self._update_item(claim["bill_id"], claim["item_id"], change)
+
+    def init_pool(self, bill_id: Optional[str], item_id: str, pool_size: int, member: Dict[str, Any]):
+        def change(item):
+            item["qty_shared_pool"] = pool_size
+            if not _contains(item["shared_members"], member):
+                item["shared_members"].append(member)
+        self._update_item(bill_id, item_id, change)
+
+    def add_member(self, bill_id: Optional[str], item_id: str, member: Dict[str, Any]):
+        def change(item):
+            if not _contains(item["shared_members"], member):
+                item["shared_members"].append(member)
+        self._update_item(bill_id, item_id, change)
+
+    def remove_member(self, bill_id: Optional[str], item_id: str, participant_id: str):
+        def change(item):
+            item["shared_members"] = [m for m in item["shared_members"] if str(m["participant_id"]) != str(participant_id)]
+        self._update_item(bill_id, item_id, change)
+
+    def drop(self, bill_id: Optional[str] = None, item_id: Optional[str] = None):
+        """Forget a bill after a write that cannot be applied incrementally"""
+        self._generation += 1
+        if bill_id is None and item_id is not None:
+            bill_id = self.bill_for_item(item_id)
+        if bill_id is not None and str(bill_id) in self._bills:
+            self._remove(str(bill_id))
+            self.drops += 1
+
+    def _update_item(self, bill_id: Optional[str], item_id: str, change: Callable[[Dict[str, Any]], Optional[bool]]):
+        """Apply a change to one item of an aggregated bill; change returns False if it did not apply"""
+        self._generation += 1
+        item_id = str(item_id)
+        bill_id = str(bill_id) if bill_id is not None else self.bill_for_item(item_id)
+        state = self._live(bill_id) if bill_id is not None else None
+        if state is None:
+            return
+        if item_id not in state.items or change(state.items[item_id]) is False:
+            self.drop(bill_id)
+            return
+        state.apply_item(item_id)
+        self.updates += 1
+
+    def _live(self, bill_id: str) -> Optional[_BillState]:
+        state = self._bills.get(bill_id)
+        if state is not None and state.expires <= time.monotonic():
+            self._remove(bill_id)
+            return None
+        return state
+
+    def _remove(self, bill_id: str):
+        state = self._bills.pop(bill_id, None)
+        if state is None:
+            return
+        self._bill_by_token_hash.pop(state.bill["link_token_hash"], None)
+        for item_id in state.items:
+            self._bill_by_item.pop(item_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "bills": len(self._bills),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "seeds": self.seeds,
+            "updates": self.updates,
+            "drops": self.drops,
+        }
@@ -1,26 +1,99 @@
 from google import genai
+from google.genai import types
 import os
-from dotenv import load_dotenv
-from typing import Union, BinaryIO
-import json
+import io
+import asyncio
+import hashlib
+import mimetypes
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union, BinaryIO, AsyncIterator, Tuple
+from pydantic import ValidationError
+from app.core import config
+from app.models.schemas import GEMINI_ITEM_KEYS, GeminiCompactBill, GeminiCompactItem
+from app.services.parse_cache import ParseCache
+from app.services.image_hash import NearDuplicateIndex, ImageFingerprint, fingerprint
+from app.services.image_preprocessing import ImagePreprocessor
+from app.services.incremental_json import IncrementalArrayParser
+from app.services.resilience import ResilientCaller, Deadline
+from app.services.singleflight import SingleFlight
+
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+BILL_PROMPT = (
+    "List every ordered line on this receipt. "
+    "n: item name, c: Food or Drinks, p: unit price, q: quantity. "
+    "cur: ISO 4217 currency code of the prices."
+)
+# Bump whenever BILL_PROMPT or the response transformation changes so cached parses are not reused
+PROMPT_VERSION = "2"
+
+# Structured output: the model must answer with JSON matching the compact bill schema
+GENERATION_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=GeminiCompactBill,
+)
 
 class GeminiService:
     """
     Service for processing bill images using Google's Gemini AI.
     Takes an image as input and returns parsed bill data in JSON format.
+    Create one instance per process and reuse it across requests.
     """
     
-    def __init__(self):
-        # Load environment variables
-        load_dotenv("env/config.env")
+    def __init__(
+        self,
+        cache: Optional[ParseCache] = None,
+        near_duplicates: Optional[NearDuplicateIndex] = None,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        resilience: Optional[ResilientCaller] = None,
+        singleflight: Optional[SingleFlight] = None,
+    ):
+        # Optional cache of parse results keyed on image content
+        self.cache = cache
+        
+        # Optional perceptual-hash index that lets re-sent copies of recent photos reuse cached parses
+        self.near_duplicates = near_duplicates if cache is not None else None
+        
+        # Optional stage that shrinks images before they are sent to the model
+        self.preprocessor = preprocessor
+        
+        # Optional rate limiting, retries and circuit breaking around async model calls
+        self.resilience = resilience
+        
+        # Optional coalescing of concurrent async parses of the same image
+        self.singleflight = singleflight
         
         # Get API key from environment
-        self.api_key = os.getenv("GEMINI_API_KEY")
+        self.api_key = config.GEMINI_API_KEY
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
         
-        # Initialize client with API key
-        self.client = genai.Client(api_key=self.api_key)
+        # Initialize client with API key and pooled keep-alive connections
+        limits = httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        )
+        self.client = genai.Client(
+            api_key=self.api_key,
+            http_options=types.HttpOptions(
+                client_args={"limits": limits},
+                async_client_args={"limits": limits},
+            ),
+        )
+        
+        # Background worker for deleting files uploaded through the Files API
+        self._cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-cleanup")
+    
+    def close(self):
+        """Finish pending file deletions and close pooled HTTP connections"""
+        self._cleanup_executor.shutdown(wait=True)
+        self.client.close()
+    
+    async def aclose(self):
+        """Close pooled HTTP connections, including the async client"""
+        self.close()
+        await self.client.aio.aclose()
     
     def parse_bill_image(self, image_path: str) -> dict:
         """
@@ -32,89 +105,325 @@ class GeminiService:
         Returns:
             dict: Parsed bill data in JSON format
         """
-        # Upload the image file to Gemini
-        file_ref = self.client.files.upload(file=image_path)
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
         
-        # Generate content using the uploaded image
-        resp = self.client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=["what has been ordered on the bill? Group: Drinks, Food. Show unit prices in euros.Return in json format.", file_ref],
-        )
+        return self.parse_bill_from_bytes(image_bytes, os.path.basename(image_path))
+    
+    def parse_bill_from_bytes(self, image_bytes: bytes, filename: str = "bill.jpg", mime_type: Optional[str] = None) -> dict:
+        """
+        Parse a bill image from bytes and return structured JSON data.
         
-        # Parse the response text as JSON
-        try:
-            # Clean the response text (remove markdown code blocks)
-            cleaned_text = resp.text.strip()
-            if cleaned_text.startswith('```json'):
-                cleaned_text = cleaned_text[7:]  # Remove ```json
-            if cleaned_text.endswith('```'):
-                cleaned_text = cleaned_text[:-3]  # Remove ```
-            cleaned_text = cleaned_text.strip()
+        Cached parses are returned without calling the model. Otherwise the
+        image is preprocessed (if configured) and sent inline with the prompt in
+        a single generate_content call. Only images above GEMINI_INLINE_MAX_BYTES go through the Files API,
+        and those uploads are deleted again in the background.
+        
+        Args:
+            image_bytes (bytes): Image data as bytes
+            filename (str): Original file name, used to guess the MIME type
+            mime_type (str): MIME type of the image, if known
             
-            raw_data = json.loads(cleaned_text)
-            # Transform the response to match our expected format
-            return self._transform_gemini_response(raw_data)
-        except json.JSONDecodeError as e:
-            # If JSON parsing fails, return the raw text wrapped in a structure
-            return {"raw_response": resp.text, "error": f"Failed to parse JSON response: {str(e)}"}
+        Returns:
+            dict: Parsed bill data in JSON format
+        """
+        cached, cache_key, phash = self._lookup_cached(image_bytes)
+        if cached is not None:
+            return cached
+        
+        mime_type = mime_type or self._guess_mime_type(filename)
+        if self.preprocessor is not None:
+            image_bytes, mime_type = self.preprocessor.process(image_bytes, mime_type)
+        
+        image_part, file_ref = self._build_image_part(image_bytes, mime_type)
+        
+        try:
+            resp = self.client.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[BILL_PROMPT, image_part],
+                config=GENERATION_CONFIG,
+            )
+        finally:
+            if file_ref is not None:
+                self._delete_remote_file(file_ref)
+        
+        result = self._parse_response_text(resp.text)
+        self._store_result(cache_key, phash, result)
+        return result
     
-    def parse_bill_from_bytes(self, image_bytes: bytes, filename: str = "bill.jpg") -> dict:
+    async def aparse_bill_from_bytes(
+        self,
+        image_bytes: bytes,
+        filename: str = "bill.jpg",
+        mime_type: Optional[str] = None,
+        image_sha256: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> dict:
         """
-        Parse a bill image from bytes and return structured JSON data.
+        Async version of parse_bill_from_bytes for use inside request handlers.
+        
+        The model call goes through the SDK's async client, and cache lookups,
+        hashing and preprocessing run in worker threads/processes, so the event
+        loop keeps serving other requests while a parse is in flight.
+        Cancelling the awaiting task aborts the model call; any file uploaded
+        through the Files API is still deleted.
+        
+        With single-flight enabled, concurrent calls for the same image share
+        one parse and each receives its own copy of the result. The shared
+        parse is only aborted once every caller waiting on it is cancelled
+        or past its deadline.
         
         Args:
             image_bytes (bytes): Image data as bytes
-            filename (str): Name for the temporary file
+            filename (str): Original file name, used to guess the MIME type
+            mime_type (str): MIME type of the image, if known
+            image_sha256 (str): Hex SHA-256 of image_bytes, if already computed while reading the upload
+            deadline (Deadline): Raise DeadlineExceededError instead of working past this point
             
         Returns:
             dict: Parsed bill data in JSON format
         """
-        import tempfile
+        if self.singleflight is None:
+            parse = self._aparse(image_bytes, filename, mime_type, image_sha256, deadline)
+        else:
+            if image_sha256 is None:
+                image_sha256 = await asyncio.to_thread(self._hash_image, image_bytes)
+            # The shared parse runs without a deadline so a caller with a short one cannot fail
+            # the others; each caller stops waiting at its own, and once all have given up the
+            # shared parse is cancelled, so it never outlives the longest deadline among them
+            parse = self.singleflight.do(
+                self._cache_key(image_sha256),
+                lambda: self._aparse(image_bytes, filename, mime_type, image_sha256),
+            )
+        return await (parse if deadline is None else deadline.run(parse))
+    
+    async def _aparse(
+        self,
+        image_bytes: bytes,
+        filename: str,
+        mime_type: Optional[str],
+        image_sha256: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> dict:
+        """Body of aparse_bill_from_bytes: cache lookup, preprocessing and the model call"""
+        cached, cache_key, phash = await asyncio.to_thread(self._lookup_cached, image_bytes, image_sha256)
+        if cached is not None:
+            return cached
+        
+        mime_type = mime_type or self._guess_mime_type(filename)
+        if self.preprocessor is not None:
+            image_bytes, mime_type = await self.preprocessor.aprocess(image_bytes, mime_type)
         
-        # Create a temporary file to store the image bytes
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{filename.split('.')[-1]}") as temp_file:
-            temp_file.write(image_bytes)
-            temp_path = temp_file.name
+        image_part, file_ref = await self._abuild_image_part(image_bytes, mime_type, deadline)
         
         try:
-            # Parse the temporary file
-            result = self.parse_bill_image(temp_path)
-            return result
+            resp = await self._call_model(lambda: self.client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[BILL_PROMPT, image_part],
+                config=GENERATION_CONFIG,
+            ), hedge=True, deadline=deadline)
         finally:
-            # Clean up the temporary file
-            os.unlink(temp_path)
+            if file_ref is not None:
+                self._delete_remote_file(file_ref)
+        
+        result = self._parse_response_text(resp.text)
+        await asyncio.to_thread(self._store_result, cache_key, phash, result)
+        return result
     
-    def _transform_gemini_response(self, raw_data: dict) -> dict:
+    async def astream_bill_items(
+        self,
+        image_bytes: bytes,
+        filename: str = "bill.jpg",
+        mime_type: Optional[str] = None,
+        image_sha256: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Parse a bill image with a streaming model response.
+        
+        Yields ("item", item) for every line item as soon as the model has
+        finished generating it, then ("bill", result) with the complete parse
+        (the same dict aparse_bill_from_bytes returns). Cached parses are
+        replayed the same way.
+        
+        Args:
+            image_bytes (bytes): Image data as bytes
+            filename (str): Original file name, used to guess the MIME type
+            mime_type (str): MIME type of the image, if known
+            image_sha256 (str): Hex SHA-256 of image_bytes, if already computed
+            deadline (Deadline): Limits waiting for the model to open the stream
+        """
+        cached, cache_key, phash = await asyncio.to_thread(self._lookup_cached, image_bytes, image_sha256)
+        if cached is not None:
+            for item in cached["items"]:
+                yield "item", item
+            yield "bill", cached
+            return
+        
+        mime_type = mime_type or self._guess_mime_type(filename)
+        if self.preprocessor is not None:
+            image_bytes, mime_type = await self.preprocessor.aprocess(image_bytes, mime_type)
+        
+        image_part, file_ref = await self._abuild_image_part(image_bytes, mime_type, deadline)
+        
+        parser = IncrementalArrayParser()
+        try:
+            # Only opening the stream is retried; a stream that fails midway surfaces the error
+            stream = await self._call_model(lambda: self.client.aio.models.generate_content_stream(
+                model=GEMINI_MODEL,
+                contents=[BILL_PROMPT, image_part],
+                config=GENERATION_CONFIG,
+            ), deadline=deadline)
+            async for chunk in stream:
+                for key, raw_item in parser.feed(chunk.text or ""):
+                    if key != "i":
+                        continue
+                    try:
+                        compact_item = GeminiCompactItem.model_validate(raw_item)
+                    except ValidationError:
+                        continue
+                    yield "item", self._transform_item(compact_item)
+        finally:
+            if file_ref is not None:
+                self._delete_remote_file(file_ref)
+        
+        result = self._parse_response_text(parser.text)
+        await asyncio.to_thread(self._store_result, cache_key, phash, result)
+        yield "bill", result
+    
+    def _hash_image(self, image_bytes: bytes) -> str:
+        """SHA-256 of the image content"""
+        return hashlib.sha256(image_bytes).hexdigest()
+    
+    def _cache_key(self, image_sha256: str) -> str:
+        """Cache key for an image hash under the current model and prompt"""
+        return ParseCache.make_key(image_sha256, GEMINI_MODEL, PROMPT_VERSION)
+    
+    def _lookup_cached(self, image_bytes: bytes, image_sha256: Optional[str] = None):
+        """
+        Look for a stored parse of this image or a near-identical one.
+        Pass image_sha256 when the content hash is already known.
+        
+        Returns:
+            tuple: (cached result or None, cache key or None, perceptual hash or None)
+        """
+        if self.cache is None:
+            return None, None, None
+        
+        cache_key = self._cache_key(image_sha256 or self._hash_image(image_bytes))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached, cache_key, None
+        
+        phash = None
+        if self.near_duplicates is not None:
+            phash = fingerprint(image_bytes, config.NEAR_DUPLICATE_HASH_SIZE)
+            if phash is not None:
+                cached = self.near_duplicates.lookup(phash, lambda key: self.cache.get(key, count_stats=False))
+                if cached is not None:
+                    # Store under this image's own key so an exact re-upload hits directly
+                    self.cache.put(cache_key, cached, phash.hash)
+                    return cached, cache_key, phash
+        
+        return None, cache_key, phash
+    
+    def _store_result(self, cache_key: Optional[str], phash: Optional[ImageFingerprint], result: dict):
+        """Cache a parse result; failures are not cached so they can be retried"""
+        if cache_key is None or "error" in result:
+            return
+        
+        self.cache.put(cache_key, result, phash.hash if phash is not None else None)
+        if phash is not None and self.near_duplicates is not None:
+            self.near_duplicates.add(phash, cache_key)
+    
+    def _guess_mime_type(self, filename: str) -> str:
+        """Guess the image MIME type from the file name"""
+        mime_type, _ = mimetypes.guess_type(filename or "")
+        if mime_type and mime_type.startswith("image/"):
+            return mime_type
+        return "image/jpeg"
+    
+    def _build_image_part(self, image_bytes: bytes, mime_type: str):
+        """
+        Build the image content for a generate_content call.
+        
+        Returns:
+            tuple: (content part, uploaded file reference or None)
+        """
+        if len(image_bytes) <= config.GEMINI_INLINE_MAX_BYTES:
+            return types.Part.from_bytes(data=image_bytes, mime_type=mime_type), None
+        
+        # Too large for an inline request: fall back to the Files API
+        file_ref = self.client.files.upload(
+            file=io.BytesIO(image_bytes),
+            config=types.UploadFileConfig(mime_type=mime_type),
+        )
+        return file_ref, file_ref
+    
+    async def _abuild_image_part(self, image_bytes: bytes, mime_type: str, deadline: Optional[Deadline] = None):
+        """Async version of _build_image_part"""
+        if len(image_bytes) <= config.GEMINI_INLINE_MAX_BYTES:
+            return types.Part.from_bytes(data=image_bytes, mime_type=mime_type), None
+        
+        file_ref = await self._call_model(lambda: self.client.aio.files.upload(
+            file=io.BytesIO(image_bytes),
+            config=types.UploadFileConfig(mime_type=mime_type),
+        ), deadline=deadline)
+        return file_ref, file_ref
+    
+    async def _call_model(self, make_call, hedge: bool = False, deadline: Optional[Deadline] = None):
+        """
+        Await a Gemini API call, through the resilience layer when configured.
+        Only idempotent calls whose full response arrives at once should pass hedge=True.
+        """
+        if self.resilience is None:
+            return await (make_call() if deadline is None else deadline.run(make_call()))
+        return await self.resilience.call(make_call, hedge=hedge, deadline=deadline)
+    
+    def _delete_remote_file(self, file_ref: types.File):
+        """Delete an uploaded file from Gemini without blocking the caller"""
+        def delete():
+            try:
+                self.client.files.delete(name=file_ref.name)
+            except Exception as e:
+                print(f"Failed to delete uploaded file {file_ref.name}: {e}")
+        
+        self._cleanup_executor.submit(delete)
+    
+    def _parse_response_text(self, text: str) -> dict:
+        """Parse the model's structured output into our bill schema"""
+        try:
+            compact_bill = GeminiCompactBill.model_validate_json(text)
+        except ValidationError as e:
+            # If the output does not match the schema, return the raw text wrapped in a structure
+            return {"raw_response": text, "error": f"Failed to parse JSON response: {str(e)}"}
+        
+        # Transform the response to match our expected format
+        return self._transform_gemini_response(compact_bill)
+    
+    def _transform_item(self, compact_item: GeminiCompactItem) -> dict:
+        """
+        Expand a compact Gemini line item to our item schema
+        """
+        item = {field: getattr(compact_item, short_key) for field, short_key in GEMINI_ITEM_KEYS.items()}
+        item["category"] = item["category"].value
+        item.update({
+            "type": "item",
+            "confidence": 0.95,
+            "notes": None
+        })
+        return item
+    
+    def _transform_gemini_response(self, compact_bill: GeminiCompactBill) -> dict:
         """
         Transform Gemini response to match our expected schema
         """
-        items = []
-        
-        # Process Drinks
-        if "Drinks" in raw_data:
-            for drink in raw_data["Drinks"]:
-                items.append({
-                    "name": drink.get("item", ""),
-                    "category": "Drinks",
-                    "unit_price": float(drink.get("unit_price_eur", drink.get("unit_price_euros", 0))),
-                    "quantity": int(drink.get("quantity", 1)),
-                    "type": "item",
-                    "confidence": 0.95,
-                    "notes": None
-                })
-        
-        # Process Food
-        if "Food" in raw_data:
-            for food in raw_data["Food"]:
-                items.append({
-                    "name": food.get("item", ""),
-                    "category": "Food",
-                    "unit_price": float(food.get("unit_price_eur", food.get("unit_price_euros", 0))),
-                    "quantity": int(food.get("quantity", 1)),
-                    "type": "item",
-                    "confidence": 0.95,
-                    "notes": None
-                })
+        items = [self._transform_item(compact_item) for compact_item in compact_bill.i]
+        
+        # Bills store a 3-letter currency code; fall back to euros for anything else
+        currency = compact_bill.cur.strip().upper()
+        if len(currency) != 3 or not currency.isalpha():
+            currency = "EUR"
         
         # Calculate totals
         subtotal = sum(item["unit_price"] * item["quantity"] for item in items)
@@ -125,7 +434,7 @@ class GeminiService:
                 "address": None,
                 "datetime": None
             },
-            "currency": "EUR",
+            "currency": currency,
             "items": items,
             "meta": {
                 "subtotal": float(subtotal),
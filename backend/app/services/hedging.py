@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Callable, Awaitable, TypeVar, Dict, Any, Optional, List
+
+T = TypeVar("T")
+
+
+class LatencyHistogram:
+    """
+    Sliding-window latency histogram with exponentially growing buckets.
+
+    Keeps counts for the most recent window samples only, so percentiles
+    follow the upstream's current behaviour. Recording and percentile
+    lookups cost O(buckets) regardless of the window size.
+    """
+
+    def __init__(self, window: int = 500, min_latency: float = 0.01, growth: float = 1.15, buckets: int = 80):
+        # Upper bound of each bucket in seconds; the last bucket catches everything above
+        self.bounds: List[float] = [min_latency * growth ** i for i in range(buckets)]
+        self.counts = [0] * buckets
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _bucket(self, latency: float) -> int:
+        for index, bound in enumerate(self.bounds):
+            if latency <= bound:
+                return index
+        return len(self.bounds) - 1
+
+    def record(self, latency: float):
+        """Add a latency sample in seconds, evicting the oldest once the window is full"""
+        bucket = self._bucket(latency)
+        with self._lock:
+            if len(self._samples) == self._samples.maxlen:
+                self.counts[self._samples[0]] -= 1
+            self._samples.append(bucket)
+            self.counts[bucket] += 1
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given percentile (0-100), or None without samples"""
+        with self._lock:
+            total = len(self._samples)
+            if total == 0:
+                return None
+            rank = total * percentile / 100
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.bounds[index]
+            return self.bounds[-1]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class HedgeBudget:
+    """
+    Caps hedged requests to a fraction of all requests.
+    Every request earns `ratio` credit (up to `burst`); a hedge spends one.
+    """
+
+    def __init__(self, ratio: float = 0.05, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._credit = min(self.burst, self._credit + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credit < 1:
+                return False
+            self._credit -= 1
+            return True
+
+    def refund(self):
+        """Return the credit of a hedge that was spent but never started"""
+        with self._lock:
+            self._credit = min(self.burst, self._credit + 1)
+
+    @property
+    def credit(self) -> float:
+        return self._credit
+
+
+class Hedger:
+    """
+    Hedged requests for calls with a long latency tail.
+
+    The call is started once; if it has not answered after the configured
+    percentile of recent latencies, an identical second call is started.
+    Whichever succeeds first wins and the other is cancelled. Hedges are
+    limited by a HedgeBudget and only fire once enough samples exist.
+    """
+
+    def __init__(
+        self,
+        histogram: LatencyHistogram,
+        budget: HedgeBudget,
+        percentile: float = 95.0,
+        min_samples: int = 20,
+        min_delay: float = 0.5,
+    ):
+        self.histogram = histogram
+        self.budget = budget
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+
+        # Metrics
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """How long to wait before hedging, or None while there is too little data"""
+        if len(self.histogram) < self.min_samples:
+            return None
+        return max(self.min_delay, self.histogram.percentile(self.percentile))
+
+    async def run(self, make_call: Callable[[], Awaitable[T]], admit_hedge: Callable[[], bool] = lambda: True) -> T:
+        """
+        Await make_call(), hedging it with a second call if it is slow.
+        admit_hedge is asked right before the hedge fires (e.g. for a rate limit token).
+        """
+        self.calls += 1
+        self.budget.on_request()
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(make_call())
+        tasks = [primary]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                await asyncio.wait({primary}, timeout=delay)
+
+            if not primary.done() and delay is not None:
+                if not self.budget.try_spend():
+                    self.budget_exhausted += 1
+                elif admit_hedge():
+                    self.hedged += 1
+                    tasks.append(asyncio.ensure_future(make_call()))
+                else:
+                    self.budget.refund()
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        # Keep waiting for the other call; surface the first error if both fail
+                        error = error or task.exception()
+                        continue
+                    # The request's latency, not the winning call's: a hedge that wins
+                    # must not make the tail look shorter than callers experienced
+                    self.histogram.record(time.monotonic() - started)
+                    if task is not primary:
+                        self.hedge_wins += 1
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget_exhausted,
+            "budget_credit": round(self.budget.credit, 3),
+            "current_delay_seconds": self.hedge_delay(),
+            "latency_p50_seconds": self.histogram.percentile(50),
+            "latency_p99_seconds": self.histogram.percentile(99),
+        }
@@ -0,0 +1,235 @@
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Dict, Any, Callable, NamedTuple
+from PIL import Image, ImageOps
+from app.services.image_preprocessing import receipt_bbox
+
+# A candidate match must have nearly the same pixel dimensions and file size;
+# re-sending the same photo keeps both, a different receipt rarely does
+MAX_DIMENSION_DIFFERENCE = 0.02
+MAX_SIZE_DIFFERENCE = 0.25
+
+
+class ImageFingerprint(NamedTuple):
+    """Perceptual hash of a receipt photo plus what is needed to verify a match"""
+    hash: int
+    width: int
+    height: int
+    size: int
+
+
+def dhash(image_bytes: bytes, hash_size: int = 64) -> Optional[int]:
+    """
+    Compute a difference hash (dHash) of the receipt in a photo.
+
+    The photo is cropped to the receipt and contrast-normalised first, so the
+    hash describes the printed lines rather than the paper outline and the
+    table around it. The crop is reduced to a (hash_size + 1) x hash_size
+    grayscale thumbnail and each bit records whether a pixel is brighter than
+    its right neighbour; hash_size should be large enough to resolve text
+    lines (64 gives 4096 bits). Returns None if the bytes cannot be decoded.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # Let the JPEG decoder downscale while decoding, keeping enough detail for the text
+        image.draft("L", ((hash_size + 1) * 16, hash_size * 16))
+        image = ImageOps.exif_transpose(image).convert("L")
+        bbox = receipt_bbox(image)
+        if bbox is not None:
+            image = image.crop(bbox)
+        image = ImageOps.autocontrast(image)
+        image = image.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    except Exception:
+        return None
+
+    pixels = image.tobytes()
+    width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint(image_bytes: bytes, hash_size: int = 64) -> Optional[ImageFingerprint]:
+    """dHash of an image together with its pixel dimensions and byte size, or None if undecodable"""
+    hash_value = dhash(image_bytes, hash_size)
+    if hash_value is None:
+        return None
+    width, height = Image.open(io.BytesIO(image_bytes)).size
+    return ImageFingerprint(hash_value, width, height, len(image_bytes))
+
+
+def _close(a: int, b: int, tolerance: float) -> bool:
+    return abs(a - b) <= tolerance * max(a, b)
+
+
+def same_photo(a: ImageFingerprint, b: ImageFingerprint) -> bool:
+    """Whether two fingerprints plausibly come from the same photo (dimensions and size match)"""
+    return (
+        _close(a.width, b.width, MAX_DIMENSION_DIFFERENCE)
+        and _close(a.height, b.height, MAX_DIMENSION_DIFFERENCE)
+        and _close(a.size, b.size, MAX_SIZE_DIFFERENCE)
+    )
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance.
+
+    Range queries only descend into children whose edge distance lies within
+    the query radius of the node distance, which prunes most of the tree for
+    small radii.
+    """
+
+    def __init__(self):
+        # Each node is [hash, value, {distance: child_node}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, hash_value: int, value: Any):
+        """Insert a hash with an associated value"""
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, value, {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1] = value
+                self.size -= 1
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, value, {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, int, Any]]:
+        """Return (distance, hash, value) for every entry within max_distance, closest first"""
+        if self._root is None:
+            return []
+
+        matches = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[0], node[1]))
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class NearDuplicateIndex:
+    """
+    Index of perceptual hashes of recently parsed receipts.
+
+    Maps a receipt fingerprint to the parse cache key of the image it came
+    from, so a re-sent copy of the same photo (re-encoded, e.g. by a chat app)
+    can reuse the stored parse. Because receipts with the same layout that
+    differ in a few characters hash almost identically, matches are limited
+    to photos indexed within the last window_seconds and must also have
+    nearly the same dimensions and byte size.
+
+    Hashes older than the window are ignored and the tree is rebuilt once
+    they make up half of it; max_entries bounds the index in between.
+    """
+
+    def __init__(self, max_distance: int = 16, max_entries: int = 5000, window_seconds: float = 600.0):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.window_seconds = window_seconds
+        # hash -> (cache key, fingerprint, time added), oldest first
+        self._entries: "OrderedDict[int, Tuple[str, ImageFingerprint, float]]" = OrderedDict()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def add(self, image_fingerprint: ImageFingerprint, cache_key: str):
+        """Remember the cache key for an image fingerprint"""
+        now = time.monotonic()
+        with self._lock:
+            hash_value = image_fingerprint.hash
+            self._entries[hash_value] = (cache_key, image_fingerprint, now)
+            self._entries.move_to_end(hash_value)
+            self._tree.add(hash_value, cache_key)
+
+            expired = 0
+            for _, _, added_at in self._entries.values():
+                if added_at > now - self.window_seconds:
+                    break
+                expired += 1
+            if len(self._entries) > self.max_entries or expired > len(self._entries) // 2:
+                for _ in range(max(expired, len(self._entries) - self.max_entries)):
+                    self._entries.popitem(last=False)
+                self._tree = BKTree()
+                for entry_hash, (entry_key, _, _) in self._entries.items():
+                    self._tree.add(entry_hash, entry_key)
+
+    def find(self, image_fingerprint: ImageFingerprint) -> List[str]:
+        """
+        Return cache keys of images within the distance threshold that were added
+        within the window and look like the same photo, closest first
+        """
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            matches = self._tree.search(image_fingerprint.hash, self.max_distance)
+            keys = []
+            for _, hash_value, _ in matches:
+                entry = self._entries.get(hash_value)
+                if entry is None or entry[2] <= cutoff:
+                    continue
+                if not same_photo(image_fingerprint, entry[1]):
+                    self.rejected += 1
+                    continue
+                keys.append(entry[0])
+        return keys
+
+    def lookup(self, image_fingerprint: ImageFingerprint, resolve: Callable[[str], Optional[Any]]) -> Optional[Any]:
+        """
+        Resolve the closest stored match to a value.
+
+        Candidates are tried closest first; resolve may return None for keys
+        whose parse is no longer stored, in which case the next one is tried.
+        """
+        for cache_key in self.find(image_fingerprint):
+            value = resolve(cache_key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and index size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "entries": len(self._entries),
+                "max_distance": self.max_distance,
+                "window_seconds": self.window_seconds,
+            }
@@ -0,0 +1,237 @@
+import asyncio
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+from PIL import Image, ImageFilter, ImageOps
+
+FORMAT_MIME_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+# Only crop when the detected receipt covers a plausible share of the photo
+MIN_CROP_AREA = 0.15
+MAX_CROP_AREA = 0.95
+
+
+def _otsu_threshold(image: Image.Image) -> int:
+    """Brightness threshold that best separates a grayscale image into two classes"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+
+    background_count = 0
+    background_sum = 0
+    best_threshold = 0
+    best_variance = 0.0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        background_mean = background_sum / background_count
+        foreground_mean = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = level
+    return best_threshold
+
+
+def receipt_bbox(gray: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Locate the receipt in a grayscale photo.
+
+    Receipts are bright paper on a darker table, so the bounding box of the
+    bright class (after blurring away the printed text) is a good crop.
+    Returns None when no convincing region is found.
+    """
+    preview = gray.copy()
+    preview.thumbnail((256, 256))
+    preview = preview.filter(ImageFilter.GaussianBlur(3))
+
+    threshold = _otsu_threshold(preview)
+    mask = preview.point(lambda value: 255 if value > threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    left, top, right, bottom = bbox
+    area = (right - left) * (bottom - top) / (preview.width * preview.height)
+    if not MIN_CROP_AREA <= area <= MAX_CROP_AREA:
+        return None
+
+    # Scale back to full resolution with a small margin
+    scale_x = gray.width / preview.width
+    scale_y = gray.height / preview.height
+    margin = 2
+    return (
+        max(0, int((left - margin) * scale_x)),
+        max(0, int((top - margin) * scale_y)),
+        min(gray.width, int((right + margin) * scale_x)),
+        min(gray.height, int((bottom + margin) * scale_y)),
+    )
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    max_edge: int = 1600,
+    output_format: str = "WEBP",
+    quality: int = 80,
+    grayscale: bool = True,
+    auto_crop: bool = True,
+) -> Tuple[bytes, str, Dict[str, float]]:
+    """
+    Shrink a receipt photo before it is sent to Gemini.
+
+    Applies EXIF auto-rotation, crops to the receipt, converts to grayscale,
+    downscales so the longest edge is at most max_edge and re-encodes.
+    Runs in a worker process, so it only takes and returns picklable values.
+
+    Returns:
+        tuple: (encoded bytes, MIME type, per-stage timings in milliseconds)
+    """
+    timings = {}
+    started = time.perf_counter()
+    stage_started = started
+
+    def mark(stage: str):
+        nonlocal stage_started
+        now = time.perf_counter()
+        timings[stage] = (now - stage_started) * 1000
+        stage_started = now
+
+    image = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder skip detail we would throw away when downscaling
+    image.draft("L" if grayscale else "RGB", (max_edge * 2, max_edge * 2))
+    image.load()
+    mark("decode")
+
+    image = ImageOps.exif_transpose(image)
+    mark("rotate")
+
+    gray = image.convert("L")
+    if grayscale:
+        image = gray
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    mark("grayscale")
+
+    if auto_crop:
+        bbox = receipt_bbox(gray)
+        if bbox is not None:
+            image = image.crop(bbox)
+    mark("crop")
+
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    mark("resize")
+
+    output = io.BytesIO()
+    image.save(output, format=output_format, quality=quality)
+    mark("encode")
+
+    timings["total"] = (time.perf_counter() - started) * 1000
+    return output.getvalue(), FORMAT_MIME_TYPES[output_format], timings
+
+
+class ImagePreprocessor:
+    """
+    Runs preprocess_image in a process pool so the CPU-heavy decode and
+    resize work stays off the event loop and out of the GIL.
+    Keeps running totals of per-stage timings and payload sizes.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_edge: int = 1600,
+        output_format: str = "WEBP",
+        quality: int = 80,
+        grayscale: bool = True,
+        auto_crop: bool = True,
+    ):
+        output_format = output_format.upper()
+        if output_format not in FORMAT_MIME_TYPES:
+            raise ValueError(f"Unsupported preprocessing format: {output_format}")
+
+        self.options = {
+            "max_edge": max_edge,
+            "output_format": output_format,
+            "quality": quality,
+            "grayscale": grayscale,
+            "auto_crop": auto_crop,
+        }
+        # Spawn rather than fork: the parent holds threads and open connections
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.processed = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_totals_ms: Dict[str, float] = {}
+
+    def process(self, image_bytes: bytes, mime_type: str) -> Tuple[bytes, str]:
+        """Preprocess an image, blocking until the worker finishes"""
+        future = self._pool.submit(preprocess_image, image_bytes, **self.options)
+        return self._finish(image_bytes, mime_type, future)
+
+    async def aprocess(self, image_bytes: bytes, mime_type: str) -> Tuple[bytes, str]:
+        """Preprocess an image without blocking the event loop"""
+        future = self._pool.submit(preprocess_image, image_bytes, **self.options)
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            # _finish records the failure and falls back to the original image
+            pass
+        return self._finish(image_bytes, mime_type, future)
+
+    def _finish(self, image_bytes: bytes, mime_type: str, future) -> Tuple[bytes, str]:
+        """Record metrics; fall back to the original image if preprocessing failed"""
+        try:
+            processed_bytes, processed_mime_type, timings = future.result()
+        except Exception as e:
+            print(f"Image preprocessing failed, sending original: {e}")
+            with self._lock:
+                self.failures += 1
+            return image_bytes, mime_type
+
+        # Never send something larger than what we received
+        if len(processed_bytes) >= len(image_bytes):
+            processed_bytes, processed_mime_type = image_bytes, mime_type
+
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += len(image_bytes)
+            self.bytes_out += len(processed_bytes)
+            for stage, elapsed in timings.items():
+                self.stage_totals_ms[stage] = self.stage_totals_ms.get(stage, 0.0) + elapsed
+
+        return processed_bytes, processed_mime_type
+
+    def stats(self) -> Dict[str, Any]:
+        """Average per-stage timings and compression ratio"""
+        with self._lock:
+            return {
+                "processed": self.processed,
+                "failures": self.failures,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "compression_ratio": self.bytes_out / self.bytes_in if self.bytes_in else None,
+                "avg_stage_ms": {
+                    stage: total / self.processed for stage, total in self.stage_totals_ms.items()
+                } if self.processed else {},
+            }
+
+    def close(self):
+        """Shut down the worker processes"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
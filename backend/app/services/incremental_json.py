@@ -0,0 +1,81 @@
+import json
+from typing import List, Optional, Tuple, Any
+
+
+class IncrementalArrayParser:
+    """
+    Incremental JSON scanner that reports array elements as soon as they close.
+
+    Text is fed in arbitrary chunks (e.g. from a streaming model response).
+    Whenever an object or array that sits directly inside an array is
+    complete, feed() returns it together with the key the enclosing array
+    has in its parent object, e.g. ("i", {"n": "Cola", "p": 3.5, ...}).
+    Anything before the first "{" or "[" (such as a markdown fence) is skipped.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._length = 0
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        # Each open container is [kind, key, start offset] with kind "{" or "["
+        self._stack: List[list] = []
+
+    def feed(self, chunk: str) -> List[Tuple[Optional[str], Any]]:
+        """Consume a chunk of text and return the array elements it completed"""
+        completed = []
+        for char in chunk:
+            offset = self._length
+            self._buffer.append(char)
+            self._length += 1
+
+            if not self._started:
+                if char not in "{[":
+                    continue
+                self._started = True
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = json.loads(self._text(self._string_start, offset + 1))
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = offset
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char in "{[":
+                key = self._pending_key if self._stack and self._stack[-1][0] == "{" else None
+                self._stack.append([char, key, offset])
+                self._pending_key = None
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                _, _, start = self._stack.pop()
+                if self._stack and self._stack[-1][0] == "[":
+                    parent_key = self._stack[-1][1]
+                    try:
+                        completed.append((parent_key, json.loads(self._text(start, offset + 1))))
+                    except json.JSONDecodeError:
+                        pass
+            elif char == ",":
+                self._pending_key = None
+
+        return completed
+
+    def _text(self, start: int, end: int) -> str:
+        return "".join(self._buffer[start:end])
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return "".join(self._buffer)
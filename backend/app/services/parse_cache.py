@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+
+class ParseCache:
+    """
+    Content-addressed cache of parsed bills.
+
+    Entries are keyed on the SHA-256 of the image bytes together with the model
+    name and prompt version, so a prompt or model change never serves stale
+    parses. Lookups go through an in-memory LRU tier bounded by total size and
+    then a SQLite tier that survives restarts.
+    """
+
+    def __init__(self, db_path: str, max_memory_bytes: int = 16 * 1024 * 1024, max_disk_entries: int = 10000):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_entries = max_disk_entries
+
+        # key -> serialized result; values are stored as JSON so callers always get a fresh copy
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS parse_cache ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL, phash TEXT)"
+        )
+        # Databases created before perceptual hashes were stored lack the column
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(parse_cache)")]
+        if "phash" not in columns:
+            self._db.execute("ALTER TABLE parse_cache ADD COLUMN phash TEXT")
+        self._db.commit()
+
+        # Counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_sha256: str, model: str, prompt_version: str) -> str:
+        """Build the cache key for an image hash, model and prompt version"""
+        return f"{image_sha256}:{model}:{prompt_version}"
+
+    def get(self, key: str, count_stats: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached parse for a key, or None on a miss.
+        
+        count_stats=False is used for secondary lookups (e.g. near-duplicate
+        matches) that should not skew the exact-match hit rate.
+        """
+        with self._lock:
+            serialized = self._memory.get(key)
+            if serialized is not None:
+                self._memory.move_to_end(key)
+                if count_stats:
+                    self.memory_hits += 1
+                return json.loads(serialized)
+
+            row = self._db.execute("SELECT result FROM parse_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                if count_stats:
+                    self.misses += 1
+                return None
+
+            if count_stats:
+                self.disk_hits += 1
+            self._remember(key, row[0])
+            return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any], phash: Optional[int] = None):
+        """Store a parse result in both tiers, optionally with the image's perceptual hash"""
+        serialized = json.dumps(result)
+        with self._lock:
+            self._remember(key, serialized)
+            self._db.execute(
+                "INSERT OR REPLACE INTO parse_cache (key, result, created_at, phash) VALUES (?, ?, ?, ?)",
+                (key, serialized, time.time(), format(phash, "x") if phash is not None else None),
+            )
+            self._prune_disk()
+            self._db.commit()
+
+    def _remember(self, key: str, serialized: str):
+        """Insert into the memory tier and evict least recently used entries"""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+
+        if len(serialized) > self.max_memory_bytes:
+            return
+
+        self._memory[key] = serialized
+        self._memory_bytes += len(serialized)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _prune_disk(self):
+        """Drop the oldest rows once the disk tier grows past its limit"""
+        count = self._db.execute("SELECT COUNT(*) FROM parse_cache").fetchone()[0]
+        if count > self.max_disk_entries:
+            self._db.execute(
+                "DELETE FROM parse_cache WHERE key IN "
+                "(SELECT key FROM parse_cache ORDER BY created_at LIMIT ?)",
+                (count - self.max_disk_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and memory tier occupancy"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def close(self):
+        """Close the SQLite connection"""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any, List, Callable, Awaitable, AsyncIterator, BinaryIO
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_PARSING = "parsing"
+JOB_SAVING = "saving"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED)
+
+# handler(image_bytes, filename, mime_type, set_status) -> result dict with a "success" flag
+JobHandler = Callable[[bytes, str, str, Callable[[str], Awaitable[None]]], Awaitable[Dict[str, Any]]]
+
+
+class ParseJobStore:
+    """
+    SQLite-backed store for parse jobs.
+    Uploaded images are spooled to files next to the database until their job
+    finishes, so queued work survives a worker restart.
+    """
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        self.spool_dir = os.path.join(directory, "job_images") if directory else "job_images"
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS parse_jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT, mime_type TEXT, "
+            "result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_parse_jobs_status ON parse_jobs(status)")
+        self._db.commit()
+
+    def _image_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, job_id)
+
+    def create(self, filename: str, mime_type: str, image: BinaryIO) -> Dict[str, Any]:
+        """Persist a new queued job, streaming its image from a file object"""
+        job_id = str(uuid.uuid4())
+        image.seek(0)
+        with open(self._image_path(job_id), "wb") as f:
+            shutil.copyfileobj(image, f)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO parse_jobs (id, status, filename, mime_type, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, filename, mime_type, now, now),
+            )
+            self._db.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job as a dict, or None if it does not exist"""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM parse_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def update(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """Move a job to a new status, recording its result or error"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE parse_jobs SET status = ?, result = COALESCE(?, result), error = COALESCE(?, error), "
+                "updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, default=str) if result is not None else None, error, time.time(), job_id),
+            )
+            self._db.commit()
+
+    def load_image(self, job_id: str) -> Optional[bytes]:
+        """Read a job's spooled image"""
+        try:
+            with open(self._image_path(job_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete_image(self, job_id: str):
+        """Remove a job's spooled image once it is no longer needed"""
+        try:
+            os.unlink(self._image_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """Id and status of jobs that were queued or running, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, status FROM parse_jobs WHERE status NOT IN (?, ?) ORDER BY created_at",
+                FINISHED_STATES,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def prune(self, max_age_seconds: float):
+        """Delete finished jobs older than max_age_seconds"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM parse_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED_STATES, cutoff),
+            ).fetchall()
+            self._db.execute(
+                "DELETE FROM parse_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*FINISHED_STATES, cutoff),
+            )
+            self._db.commit()
+        for row in rows:
+            self.delete_image(row["id"])
+
+    def close(self):
+        """Close the SQLite connection"""
+        with self._lock:
+            self._db.close()
+
+
+class ParseJobQueue:
+    """
+    Background parse job runner.
+
+    Uploads are persisted and acknowledged immediately; a fixed pool of
+    asyncio workers runs the handler for each job. Subscribers receive every
+    status change, which backs the polling and Server-Sent Events endpoints;
+    they also re-read the store every poll_interval seconds, so they follow
+    jobs run by another process sharing the store.
+
+    Jobs left queued or parsing by a previous process are re-queued on start.
+    Jobs interrupted while saving are marked failed instead of being rerun,
+    since the bill may already have been written. Recovery assumes a single
+    process runs the queue: every process re-queues all unfinished jobs,
+    including ones another live process is running.
+    """
+
+    def __init__(
+        self,
+        store: ParseJobStore,
+        handler: JobHandler,
+        workers: int = 2,
+        retention_seconds: float = 86400,
+        poll_interval: float = 2.0,
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    async def start(self):
+        """Re-queue unfinished jobs and start the workers"""
+        await asyncio.to_thread(self.store.prune, self.retention_seconds)
+        for job in await asyncio.to_thread(self.store.unfinished):
+            if job["status"] == JOB_SAVING:
+                # Rerunning could create a second bill next to one that was already written
+                await asyncio.to_thread(
+                    self.store.update, job["id"], JOB_FAILED, None,
+                    "Interrupted while saving the bill; it may or may not have been created",
+                )
+                await asyncio.to_thread(self.store.delete_image, job["id"])
+                continue
+            await asyncio.to_thread(self.store.update, job["id"], JOB_QUEUED)
+            self._queue.put_nowait(job["id"])
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; running jobs are picked up again on the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, filename: str, mime_type: str, image: BinaryIO) -> Dict[str, Any]:
+        """Persist and enqueue a new job; the image is copied from the given file object"""
+        job = await asyncio.to_thread(self.store.create, filename, mime_type, image)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a job"""
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the job's state now and after every change until it finishes"""
+        updates: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(updates)
+        try:
+            job = await self.get(job_id)
+            while job is not None:
+                yield job
+                if job["status"] in FINISHED_STATES:
+                    return
+                
+                # Changes made by this process arrive on the queue; poll the store for other processes
+                previous_update = job["updated_at"]
+                while job is not None and job["updated_at"] == previous_update:
+                    try:
+                        job = await asyncio.wait_for(updates.get(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        job = await self.get(job_id)
+        finally:
+            subscribers = self._subscribers.get(job_id, [])
+            if updates in subscribers:
+                subscribers.remove(updates)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    async def _set_status(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """Persist a status change and notify subscribers"""
+        await asyncio.to_thread(self.store.update, job_id, status, result, error)
+        if job_id in self._subscribers:
+            job = await self.get(job_id)
+            for updates in self._subscribers.get(job_id, []):
+                updates.put_nowait(job)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Parse job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATES:
+            return
+
+        image_bytes = await asyncio.to_thread(self.store.load_image, job_id)
+        if image_bytes is None:
+            await self._set_status(job_id, JOB_FAILED, error="Uploaded image is no longer available")
+            return
+
+        await self._set_status(job_id, JOB_PARSING)
+        try:
+            result = await self.handler(
+                image_bytes,
+                job["filename"],
+                job["mime_type"],
+                lambda status: self._set_status(job_id, status),
+            )
+        except Exception as e:
+            await self._set_status(job_id, JOB_FAILED, error=f"Error parsing bill: {str(e)}")
+        else:
+            if result.get("success"):
+                await self._set_status(job_id, JOB_COMPLETED, result=result)
+            else:
+                await self._set_status(job_id, JOB_FAILED, result=result, error=result.get("error"))
+
+        await asyncio.to_thread(self.store.delete_image, job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and worker count"""
+        return {
+            "queued": self._queue.qsize(),
+            "workers": len(self._tasks),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+        }
@@ -0,0 +1,26 @@
+from typing import Dict, Any
+
+
+def item_quantities(item: Dict[str, Any]) -> Dict[str, int]:
+    """Quantities of one snapshot item (as loaded by get_bill_with_items, with its claims)"""
+    total = item["qty_total"]
+    claimed = sum(claim["qty_claimed"] for claim in item.get("claims") or [])
+    pooled = item.get("qty_shared_pool") or 0
+    return {
+        "total": total,
+        "claimed": claimed,
+        "pooled": pooled,
+        "remaining": total - claimed - pooled,
+    }
+
+
+def compute_item_quantities(bill: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Remaining, exclusively claimed and pooled quantity of every item on a bill,
+    keyed by item id.
+
+    Computed in one pass over a bill snapshot, so it costs no queries beyond
+    the snapshot itself (which is usually cached). Matches the
+    calculate_remaining_qty SQL function: remaining = total - claimed - pooled.
+    """
+    return {str(item["id"]): item_quantities(item) for item in bill.get("items") or []}
@@ -0,0 +1,326 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Awaitable, TypeVar, Dict, Any, Optional
+import httpx
+from google.genai import errors
+from app.services.hedging import Hedger
+
+T = TypeVar("T")
+
+# HTTP status codes worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised instead of calling Gemini when the upstream is known to be unhealthy or throttled"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before its work has finished"""
+
+
+class Deadline:
+    """
+    Absolute point in time by which a request must be answered.
+    Passed down so every stage only waits for the time that is left.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        """Raise DeadlineExceededError if the deadline has passed"""
+        if self.expired:
+            raise DeadlineExceededError(f"Request deadline of {self.timeout:g}s exceeded")
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """Await something, cancelling it when the deadline passes"""
+        self.check()
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError(f"Request deadline of {self.timeout:g}s exceeded")
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """True for quota/rate limit errors (429 / RESOURCE_EXHAUSTED)"""
+    return isinstance(error, errors.APIError) and (error.code == 429 or error.status == "RESOURCE_EXHAUSTED")
+
+
+def is_transient_error(error: Exception) -> bool:
+    """True for errors where retrying the same request may succeed"""
+    if isinstance(error, errors.APIError):
+        return error.code in TRANSIENT_STATUS_CODES or is_throttle_error(error)
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side token bucket whose refill rate adapts to upstream throttling.
+
+    The rate is halved on every 429/RESOURCE_EXHAUSTED signal and grows back
+    additively on success (AIMD), so we settle just under the real quota
+    instead of repeatedly hitting it.
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 10, min_rate: float = 0.2, max_rate: float = 20.0, increase: float = 0.1):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.waiting = 0
+        self.throttle_signals = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self) -> float:
+        """Take a token, returning how long the caller must wait before it is available"""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def _release(self):
+        """Give back a reserved token that will not be used"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    async def acquire(self, max_wait: float):
+        """Wait for a token; fail fast if the wait would exceed max_wait seconds"""
+        wait = self._reserve()
+        if wait > max_wait:
+            self._release()
+            raise UpstreamUnavailableError("Gemini request rate limit reached", retry_after=wait)
+        if wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting -= 1
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right now"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def on_throttle(self):
+        """Multiplicative decrease after the upstream rejected us for quota"""
+        with self._lock:
+            self.throttle_signals += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        """Additive increase after a successful call"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            return {
+                "rate_per_second": round(self.rate, 3),
+                "tokens_available": round(max(self._tokens, 0.0), 3),
+                "burst": self.burst,
+                "waiting": self.waiting,
+                "throttle_signals": self.throttle_signals,
+            }
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for the Gemini upstream.
+
+    Opens after failure_threshold consecutive transient failures; while open
+    every call fails immediately with a Retry-After hint. After reset_timeout
+    a single probe call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """Raise UpstreamUnavailableError if calls are not currently allowed"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+
+            self.rejected += 1
+            raise UpstreamUnavailableError("Gemini is temporarily unavailable", retry_after=max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_ignored(self):
+        """The call finished without telling us anything about upstream health"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class ResilientCaller:
+    """
+    Wraps Gemini calls with the rate limiter, jittered exponential retries
+    for transient errors, and the circuit breaker. Calls marked as hedgeable
+    are additionally hedged when a Hedger is configured; a hedge only fires
+    while the circuit is closed and a rate limit token is free.
+    """
+
+    def __init__(
+        self,
+        limiter: AdaptiveRateLimiter,
+        breaker: CircuitBreaker,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_limiter_wait: float = 10.0,
+        hedger: Optional[Hedger] = None,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_limiter_wait = max_limiter_wait
+        self.hedger = hedger
+
+        # Metrics
+        self.calls = 0
+        self.retries = 0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (0-based) attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _admit_hedge(self) -> bool:
+        """A hedge must not probe a half-open circuit or wait for the rate limiter"""
+        return self.breaker.state == CircuitBreaker.CLOSED and self.limiter.try_acquire()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], hedge: bool = False, deadline: Optional[Deadline] = None) -> T:
+        """
+        Run fn under the limiter and breaker, retrying transient failures.
+        With hedge=True each attempt may be hedged (fn must be safe to run twice).
+        With a deadline, limiter waits, attempts and backoff sleeps never run past it.
+        """
+        self.calls += 1
+        for attempt in range(self.max_attempts):
+            if deadline is not None:
+                deadline.check()
+            self.breaker.before_call()
+            try:
+                max_wait = self.max_limiter_wait if deadline is None else min(self.max_limiter_wait, deadline.remaining())
+                await self.limiter.acquire(max_wait)
+                if hedge and self.hedger is not None:
+                    attempt_call = self.hedger.run(fn, self._admit_hedge)
+                else:
+                    attempt_call = fn()
+                result = await (attempt_call if deadline is None else deadline.run(attempt_call))
+            except (asyncio.CancelledError, DeadlineExceededError):
+                self.breaker.record_ignored()
+                raise
+            except Exception as e:
+                if is_throttle_error(e):
+                    self.limiter.on_throttle()
+                if not is_transient_error(e):
+                    # Bad request, rate limit wait or similar: not an upstream health signal
+                    self.breaker.record_ignored()
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = self.backoff_delay(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    # No time left for another attempt
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+            else:
+                self.limiter.on_success()
+                self.breaker.record_success()
+                return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limiter": self.limiter.stats(),
+            "circuit_breaker": self.breaker.stats(),
+            "hedging": self.hedger.stats() if self.hedger else None,
+        }
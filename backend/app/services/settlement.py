@@ -0,0 +1,97 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Any, List, Tuple
+from app.models.schemas import BillResults, ParticipantTotal
+
+CENT = Decimal("0.01")
+
+
+def to_cents(amount: Any) -> int:
+    """Convert a money amount (number or numeric string from PostgREST) to integer cents"""
+    return int((Decimal(str(amount)) / CENT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents) * CENT
+
+
+def split_cents(amount: int, parts: int) -> List[int]:
+    """
+    Split an amount of cents into parts that sum to exactly the amount
+    (largest remainder method with equal shares): every part gets the
+    truncated share and the leftover cents go one each to the first parts.
+    """
+    sign = -1 if amount < 0 else 1
+    share, leftover = divmod(abs(amount), parts)
+    return [sign * (share + 1 if index < leftover else share) for index in range(parts)]
+
+
+def item_contributions(item: Dict[str, Any]) -> Dict[str, Tuple[int, int]]:
+    """
+    What each participant owes for one snapshot item, as participant id ->
+    (exclusive cents, shared cents).
+
+    Exclusive claims cost unit price x claimed quantity. The shared pool
+    (unit price x pool size) is split evenly over the pool's members in the
+    order they joined, so the shares add up to the pool cost to the cent.
+    """
+    unit_price = to_cents(item["unit_price"])
+    contributions: Dict[str, Tuple[int, int]] = {}
+
+    for claim in item.get("claims") or []:
+        participant_id = str(claim["participant_id"])
+        exclusive, shared = contributions.get(participant_id, (0, 0))
+        contributions[participant_id] = (exclusive + unit_price * claim["qty_claimed"], shared)
+
+    members = item.get("shared_members") or []
+    pool_size = item.get("qty_shared_pool") or 0
+    if members and pool_size:
+        for member, share in zip(members, split_cents(unit_price * pool_size, len(members))):
+            participant_id = str(member["participant_id"])
+            exclusive, shared = contributions.get(participant_id, (0, 0))
+            contributions[participant_id] = (exclusive, shared + share)
+
+    return contributions
+
+
+def bill_total_cents(bill: Dict[str, Any]) -> int:
+    """Full value of the bill: unit price x total quantity over all items"""
+    return sum(to_cents(item["unit_price"]) * item["qty_total"] for item in bill.get("items") or [])
+
+
+def build_bill_results(bill: Dict[str, Any], totals: Dict[str, Tuple[int, int]], total_bill: int) -> BillResults:
+    """Turn per-participant (exclusive, shared) cents into BillResults, one entry per participant of the bill"""
+    participants = []
+    for participant in bill.get("participants") or []:
+        exclusive, shared = totals.get(str(participant["id"]), (0, 0))
+        participants.append(ParticipantTotal(
+            participant_id=participant["id"],
+            participant_name=participant["name"],
+            exclusive_total=from_cents(exclusive),
+            shared_total=from_cents(shared),
+            grand_total=from_cents(exclusive + shared),
+        ))
+
+    return BillResults(
+        bill_id=bill["id"],
+        participants=participants,
+        total_bill=from_cents(total_bill),
+        currency=bill["currency"],
+    )
+
+
+def compute_bill_results(bill: Dict[str, Any]) -> BillResults:
+    """
+    Exclusive, shared and grand totals of every participant from one bill
+    snapshot (as loaded by get_bill_with_items).
+
+    All arithmetic is in integer cents, so per-participant totals add up to
+    exactly what was claimed and pooled. It runs in one pass over the items
+    with their claims and pool members, without any queries.
+    """
+    totals: Dict[str, Tuple[int, int]] = {}
+    for item in bill.get("items") or []:
+        for participant_id, (exclusive, shared) in item_contributions(item).items():
+            previous_exclusive, previous_shared = totals.get(participant_id, (0, 0))
+            totals[participant_id] = (previous_exclusive + exclusive, previous_shared + shared)
+
+    return build_bill_results(bill, totals, bill_total_cents(bill))
@@ -0,0 +1,61 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key.
+
+    The first caller for a key starts the work; callers arriving while it is
+    in flight wait for the same result instead of starting their own. Each
+    caller gets its own deep copy of the result. The shared call is only
+    cancelled once every waiting caller has been cancelled.
+    """
+
+    def __init__(self):
+        # key -> [task, number of callers waiting on it]
+        self._calls: Dict[str, list] = {}
+
+        # Metrics
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Return fn()'s result, sharing one execution among concurrent callers with the same key"""
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = [task, 0]
+            self._calls[key] = call
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self.executed += 1
+            leader = True
+        else:
+            self.coalesced += 1
+            leader = False
+
+        task = call[0]
+        call[1] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                task.cancel()
+            raise
+        call[1] -= 1
+
+        return result if leader else copy.deepcopy(result)
+
+    def _forget(self, key: str, task: asyncio.Future):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
@@ -1,13 +1,162 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import router as api_router
+from app.api.bill_parsing import make_parse_job_handler
+from app.api.uploads import UploadSizeLimitMiddleware
+from app.core import config
+from app.core.database import DatabaseService
+from app.services.gemini_service import GeminiService
+from app.services.parse_cache import ParseCache
+from app.services.image_hash import NearDuplicateIndex
+from app.services.image_preprocessing import ImagePreprocessor
+from app.services.parse_jobs import ParseJobStore, ParseJobQueue
+from app.services.resilience import AdaptiveRateLimiter, CircuitBreaker, ResilientCaller
+from app.services.singleflight import SingleFlight
+from app.services.hedging import Hedger, HedgeBudget, LatencyHistogram
+from app.services.bill_cache import BillSnapshotCache, BillTokenCache
+from app.services.bill_totals import BillTotalsAggregator
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared services at startup and close their connection pools at shutdown"""
+    app.state.gemini_service = None
+    app.state.db_service = None
+    app.state.parse_cache = None
+    app.state.near_duplicates = None
+    app.state.preprocessor = None
+    app.state.job_queue = None
+    app.state.snapshot_cache = None
+    app.state.token_cache = None
+    app.state.bill_totals = None
+    
+    if config.PARSE_CACHE_ENABLED:
+        app.state.parse_cache = ParseCache(
+            config.PARSE_CACHE_PATH,
+            max_memory_bytes=config.PARSE_CACHE_MEMORY_BYTES,
+            max_disk_entries=config.PARSE_CACHE_DISK_MAX_ENTRIES,
+        )
+        if config.NEAR_DUPLICATE_ENABLED:
+            app.state.near_duplicates = NearDuplicateIndex(
+                max_distance=config.NEAR_DUPLICATE_MAX_DISTANCE,
+                max_entries=config.NEAR_DUPLICATE_MAX_ENTRIES,
+                window_seconds=config.NEAR_DUPLICATE_WINDOW_SECONDS,
+            )
+    
+    if config.PREPROCESS_ENABLED:
+        app.state.preprocessor = ImagePreprocessor(
+            max_workers=config.PREPROCESS_WORKERS,
+            max_edge=config.PREPROCESS_MAX_EDGE,
+            output_format=config.PREPROCESS_FORMAT,
+            quality=config.PREPROCESS_QUALITY,
+            grayscale=config.PREPROCESS_GRAYSCALE,
+            auto_crop=config.PREPROCESS_AUTO_CROP,
+        )
+    
+    hedger = None
+    if config.GEMINI_HEDGE_ENABLED:
+        hedger = Hedger(
+            LatencyHistogram(window=config.GEMINI_HEDGE_WINDOW),
+            HedgeBudget(ratio=config.GEMINI_HEDGE_BUDGET),
+            percentile=config.GEMINI_HEDGE_PERCENTILE,
+            min_samples=config.GEMINI_HEDGE_MIN_SAMPLES,
+            min_delay=config.GEMINI_HEDGE_MIN_DELAY,
+        )
+    
+    app.state.gemini_resilience = ResilientCaller(
+        AdaptiveRateLimiter(
+            rate=config.GEMINI_RATE_LIMIT_RPS,
+            burst=config.GEMINI_RATE_LIMIT_BURST,
+            min_rate=config.GEMINI_RATE_LIMIT_MIN_RPS,
+            max_rate=config.GEMINI_RATE_LIMIT_MAX_RPS,
+        ),
+        CircuitBreaker(
+            failure_threshold=config.GEMINI_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=config.GEMINI_BREAKER_RESET_SECONDS,
+        ),
+        max_attempts=config.GEMINI_MAX_ATTEMPTS,
+        base_delay=config.GEMINI_RETRY_BASE_DELAY,
+        max_delay=config.GEMINI_RETRY_MAX_DELAY,
+        max_limiter_wait=config.GEMINI_RATE_LIMIT_MAX_WAIT,
+        hedger=hedger,
+    )
+    app.state.parse_singleflight = SingleFlight()
+    
+    try:
+        app.state.gemini_service = GeminiService(
+            cache=app.state.parse_cache,
+            near_duplicates=app.state.near_duplicates,
+            preprocessor=app.state.preprocessor,
+            resilience=app.state.gemini_resilience,
+            singleflight=app.state.parse_singleflight,
+        )
+    except Exception as e:
+        print(f"Gemini service unavailable: {e}")
+        app.state.gemini_error = str(e)
+    
+    if config.SNAPSHOT_CACHE_ENABLED:
+        app.state.snapshot_cache = BillSnapshotCache(
+            ttl_seconds=config.SNAPSHOT_CACHE_TTL_SECONDS,
+            max_entries=config.SNAPSHOT_CACHE_MAX_ENTRIES,
+        )
+    if config.TOKEN_CACHE_ENABLED:
+        app.state.token_cache = BillTokenCache(
+            ttl_seconds=config.TOKEN_CACHE_TTL_SECONDS,
+            negative_ttl_seconds=config.TOKEN_CACHE_NEGATIVE_TTL_SECONDS,
+            max_entries=config.TOKEN_CACHE_MAX_ENTRIES,
+        )
+    if config.TOTALS_CACHE_ENABLED:
+        app.state.bill_totals = BillTotalsAggregator(
+            # Totals must not be staler than the snapshots served next to them
+            ttl_seconds=min(config.TOTALS_CACHE_TTL_SECONDS, config.SNAPSHOT_CACHE_TTL_SECONDS),
+            max_bills=config.TOTALS_CACHE_MAX_BILLS,
+        )
+    
+    try:
+        app.state.db_service = DatabaseService(
+            snapshot_cache=app.state.snapshot_cache,
+            token_cache=app.state.token_cache,
+            totals=app.state.bill_totals,
+        )
+        await app.state.db_service.connect()
+    except Exception as e:
+        print(f"Database service unavailable: {e}")
+        app.state.db_error = str(e)
+    
+    if config.JOBS_ENABLED and app.state.gemini_service and app.state.db_service:
+        app.state.job_queue = ParseJobQueue(
+            ParseJobStore(config.JOBS_DB_PATH),
+            make_parse_job_handler(app.state.gemini_service, app.state.db_service),
+            workers=config.JOBS_WORKERS,
+            retention_seconds=config.JOBS_RETENTION_SECONDS,
+            poll_interval=config.JOBS_EVENTS_POLL_INTERVAL,
+        )
+        await app.state.job_queue.start()
+    
+    yield
+    
+    if app.state.job_queue:
+        await app.state.job_queue.stop()
+        app.state.job_queue.store.close()
+    if app.state.gemini_service:
+        await app.state.gemini_service.aclose()
+    if app.state.db_service:
+        await app.state.db_service.close()
+    if app.state.parse_cache:
+        app.state.parse_cache.close()
+    if app.state.preprocessor:
+        app.state.preprocessor.close()
 
 app = FastAPI(
     title="At The Table API",
     description="Bill splitting app with AI-powered receipt parsing",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Reject oversized uploads before their body is parsed
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Add CORS middleware for frontend communication
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +177,28 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Counters for caches and upstream clients"""
+    parse_cache = app.state.parse_cache
+    near_duplicates = app.state.near_duplicates
+    preprocessor = app.state.preprocessor
+    job_queue = app.state.job_queue
+    snapshot_cache = app.state.snapshot_cache
+    token_cache = app.state.token_cache
+    bill_totals = app.state.bill_totals
+    return {
+        "gemini": app.state.gemini_resilience.stats(),
+        "parse_singleflight": app.state.parse_singleflight.stats(),
+        "parse_cache": parse_cache.stats() if parse_cache else None,
+        "near_duplicates": near_duplicates.stats() if near_duplicates else None,
+        "preprocessing": preprocessor.stats() if preprocessor else None,
+        "parse_jobs": job_queue.stats() if job_queue else None,
+        "bill_snapshots": snapshot_cache.stats() if snapshot_cache else None,
+        "bill_tokens": token_cache.stats() if token_cache else None,
+        "bill_totals": bill_totals.stats() if bill_totals else None
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
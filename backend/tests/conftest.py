@@ -0,0 +1,39 @@
+from typing import Optional
+import pytest
+from app.core import config
+from app.core.database import DatabaseService
+from app.services.gemini_service import GeminiService
+from tests.fakes import FakeModels, FakeSupabase
+
+
+@pytest.fixture
+def make_gemini_service(monkeypatch):
+    """Build GeminiService instances whose model calls go to a FakeModels (service.fake_models)"""
+    monkeypatch.setattr(config, "GEMINI_API_KEY", "test-key")
+    services = []
+
+    def make(models: Optional[FakeModels] = None, **kwargs) -> GeminiService:
+        service = GeminiService(**kwargs)
+        service.fake_models = models or FakeModels()
+        service.client.aio.models.generate_content = service.fake_models.generate_content
+        service.client.aio.models.generate_content_stream = service.fake_models.generate_content_stream
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        service.close()
+
+
+@pytest.fixture
+def make_db_service(monkeypatch):
+    """Build DatabaseService instances whose queries go to a FakeSupabase (service.client) instead of the network"""
+    monkeypatch.setattr(config, "SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setattr(config, "SUPABASE_SERVICE_ROLE_KEY", "test-key")
+
+    def make(handler=lambda query: [], **kwargs) -> DatabaseService:
+        service = DatabaseService(**kwargs)
+        service.client = FakeSupabase(handler)
+        return service
+
+    return make
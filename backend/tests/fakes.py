@@ -0,0 +1,79 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+RECEIPT_JSON = json.dumps({"i": [{"n": "Cola", "c": "Drinks", "p": 3.5, "q": 2}], "cur": "EUR"})
+
+
+class FakeModels:
+    """Stands in for client.aio.models: answers every call with a fixed receipt after a delay"""
+
+    def __init__(self, text: str = RECEIPT_JSON, delay: float = 0.0, chunk_size: int = 7):
+        self.text = text
+        self.delay = delay
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_content(self, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SimpleNamespace(text=self.text)
+
+    async def generate_content_stream(self, **kwargs):
+        await self.generate_content(**kwargs)
+
+        async def chunks():
+            for start in range(0, len(self.text), self.chunk_size):
+                yield SimpleNamespace(text=self.text[start:start + self.chunk_size])
+
+        return chunks()
+
+
+class FakeQuery:
+    """A PostgREST query builder that records its calls and asks the client's handler for the result"""
+
+    def __init__(self, client, kind: str, name: str, params=None):
+        self.client = client
+        self.kind = kind
+        self.name = name
+        self.params = params
+        self.calls = []
+
+    def __getattr__(self, method):
+        def record(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+        return record
+
+    def called(self, method):
+        """Arguments of every call to a builder method"""
+        return [(args, kwargs) for name, args, kwargs in self.calls if name == method]
+
+    async def execute(self):
+        self.client.queries.append(self)
+        result = self.client.handler(self)
+        if isinstance(result, BaseException):
+            raise result
+        return SimpleNamespace(data=result)
+
+
+class FakeSupabase:
+    """
+    Stands in for the Supabase client: handler(query) returns the rows of each
+    executed query, or an exception to raise. Executed queries are kept in order.
+    """
+
+    def __init__(self, handler=lambda query: []):
+        self.handler = handler
+        self.queries = []
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, "table", name)
+
+    def rpc(self, name: str, params=None) -> FakeQuery:
+        return FakeQuery(self, "rpc", name, params)
@@ -0,0 +1,239 @@
+import pytest
+from app.services.bill_cache import BillSnapshotCache, BillTokenCache
+
+
+def snapshot(bill_id="bill-1", version=1):
+    return {"id": bill_id, "link_token_hash": f"hash-{bill_id}", "version": version,
+            "items": [{"id": f"item-{bill_id}"}]}
+
+
+def test_put_and_get():
+    cache = BillSnapshotCache()
+    cache.put(snapshot(), cache.begin_load())
+
+    assert cache.get("bill-1")["version"] == 1
+    assert cache.get_by_token_hash("hash-bill-1")["version"] == 1
+    assert cache.bill_for_item("item-bill-1") == "bill-1"
+
+
+def test_get_returns_a_copy():
+    cache = BillSnapshotCache()
+    cache.put(snapshot(), cache.begin_load())
+
+    cache.get("bill-1")["items"].clear()
+
+    assert cache.get("bill-1")["items"] == [{"id": "item-bill-1"}]
+
+
+def test_load_that_raced_with_a_write_is_not_cached():
+    cache = BillSnapshotCache()
+    started_at = cache.begin_load()
+    loaded = snapshot(version=1)
+    cache.invalidate("bill-1")
+    cache.put(loaded, started_at)
+
+    assert cache.get("bill-1") is None
+    assert cache.stats()["stale_loads_discarded"] == 1
+
+
+def test_load_started_after_the_write_is_cached():
+    cache = BillSnapshotCache()
+    cache.invalidate("bill-1")
+    cache.put(snapshot(version=2), cache.begin_load())
+
+    assert cache.get("bill-1")["version"] == 2
+
+
+def test_write_to_another_bill_does_not_spoil_the_load():
+    cache = BillSnapshotCache()
+    started_at = cache.begin_load()
+    cache.invalidate("bill-2")
+    cache.put(snapshot(), started_at)
+
+    assert cache.get("bill-1") is not None
+
+
+def test_write_to_an_unknown_bill_spoils_every_load():
+    cache = BillSnapshotCache()
+    first = cache.begin_load()
+    second = cache.begin_load()
+    cache.invalidate(None)
+    cache.put(snapshot("bill-1"), first)
+    cache.put(snapshot("bill-2"), second)
+
+    assert cache.get("bill-1") is None
+    assert cache.get("bill-2") is None
+
+
+def test_overlapping_loads_only_keep_the_one_after_the_write():
+    cache = BillSnapshotCache()
+    before = cache.begin_load()
+    cache.invalidate("bill-1")
+    after = cache.begin_load()
+
+    cache.put(snapshot(version=2), after)
+    cache.put(snapshot(version=1), before)
+
+    assert cache.get("bill-1")["version"] == 2
+
+
+def test_invalidation_records_are_dropped_when_loads_finish():
+    cache = BillSnapshotCache()
+    started_at = cache.begin_load()
+    cache.invalidate("bill-1")
+    cache.end_load(started_at)
+
+    assert cache._invalidated_at == {}
+    assert cache._active_loads == {}
+
+
+def test_invalidate_removes_the_entry_and_its_indexes():
+    cache = BillSnapshotCache()
+    cache.put(snapshot(), cache.begin_load())
+    cache.invalidate("bill-1")
+
+    assert cache.get("bill-1") is None
+    assert cache.get_by_token_hash("hash-bill-1") is None
+    assert cache.bill_for_item("item-bill-1") is None
+
+
+def test_least_recently_used_bill_is_evicted():
+    cache = BillSnapshotCache(max_entries=2)
+    for bill_id in ("a", "b"):
+        cache.put(snapshot(bill_id), cache.begin_load())
+    cache.get("a")
+    cache.put(snapshot("c"), cache.begin_load())
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_expired_entry_is_a_miss():
+    cache = BillSnapshotCache(ttl_seconds=0)
+    cache.put(snapshot(), cache.begin_load())
+
+    assert cache.get("bill-1") is None
+
+
+@pytest.mark.asyncio
+async def test_database_reads_through_the_cache(make_db_service):
+    db = make_db_service(lambda query: snapshot(), snapshot_cache=BillSnapshotCache())
+
+    assert await db.get_bill_with_items("bill-1") == snapshot()
+    assert await db.get_bill_with_items("bill-1") == snapshot()
+
+    assert len(db.client.queries) == 1
+    assert db.snapshot_cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_item_write_drops_the_bill_it_belongs_to(make_db_service):
+    def handler(query):
+        if query.kind == "rpc":
+            return snapshot()
+        return [{"id": "item-bill-1", "bill_id": "bill-1"}]
+
+    db = make_db_service(handler, snapshot_cache=BillSnapshotCache())
+    await db.get_bill_with_items("bill-1")
+
+    await db.update_item("item-bill-1", {"name": "Soup"})
+
+    assert db.snapshot_cache.get("bill-1") is None
+    await db.get_bill_with_items("bill-1")
+    assert [query.kind for query in db.client.queries] == ["rpc", "table", "rpc"]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_still_drops_the_bill(make_db_service):
+    def handler(query):
+        if query.kind == "rpc":
+            return snapshot()
+        return RuntimeError("connection reset")
+
+    db = make_db_service(handler, snapshot_cache=BillSnapshotCache())
+    await db.get_bill_with_items("bill-1")
+
+    with pytest.raises(RuntimeError):
+        await db.update_bill("bill-1", {"currency": "USD"})
+
+    assert db.snapshot_cache.get("bill-1") is None
+
+
+def test_token_cache_hits_and_unknown_tokens():
+    cache = BillTokenCache()
+    cache.put({"id": "bill-1", "link_token_hash": "hash-1"})
+    cache.put_missing("hash-unknown")
+
+    assert cache.get("hash-1") == (True, {"id": "bill-1", "link_token_hash": "hash-1"})
+    assert cache.get("hash-unknown") == (True, None)
+    assert cache.get("hash-other") == (False, None)
+    assert (cache.hits, cache.negative_hits, cache.misses) == (1, 1, 1)
+
+
+def test_token_cache_update_drops_the_row_and_spoils_loads():
+    cache = BillTokenCache()
+    cache.put({"id": "bill-1", "link_token_hash": "hash-1"})
+    started_at = cache.begin_load()
+
+    cache.invalidate_bill("bill-1")
+    cache.put({"id": "bill-2", "link_token_hash": "hash-2"}, started_at)
+
+    assert cache.get("hash-1") == (False, None)
+    assert cache.get("hash-2") == (False, None)
+
+
+def test_unknown_token_expires_sooner():
+    cache = BillTokenCache(negative_ttl_seconds=0)
+    cache.put_missing("hash-unknown")
+
+    assert cache.get("hash-unknown") == (False, None)
+
+
+def token_snapshot_db(make_db_service):
+    """A database holding bill-1 under the link token "token"; snapshots record which query loaded them"""
+    def handler(query):
+        token_hash = db.hash_token("token")
+        if query.name == "get_bill_snapshot_by_token" and query.params["token_hash"] != token_hash:
+            return None
+        return {**snapshot(version=query.name), "link_token_hash": token_hash}
+
+    db = make_db_service(handler, snapshot_cache=BillSnapshotCache(), token_cache=BillTokenCache())
+    return db
+
+
+@pytest.mark.asyncio
+async def test_known_token_is_loaded_by_id_with_one_lookup_per_cache(make_db_service):
+    db = token_snapshot_db(make_db_service)
+
+    await db.get_bill_with_items_by_token("token")
+    db.snapshot_cache.invalidate("bill-1")
+    loaded = await db.get_bill_with_items_by_token("token")
+
+    assert loaded["version"] == "get_bill_snapshot"
+    assert [query.name for query in db.client.queries] == ["get_bill_snapshot_by_token", "get_bill_snapshot"]
+    # Every call looked each cache up exactly once
+    assert db.snapshot_cache.stats()["misses"] == 2
+    assert (db.token_cache.misses, db.token_cache.hits) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_cached_snapshot_is_served_by_token(make_db_service):
+    db = token_snapshot_db(make_db_service)
+
+    await db.get_bill_with_items_by_token("token")
+    await db.get_bill_with_items_by_token("token")
+
+    assert len(db.client.queries) == 1
+    assert db.snapshot_cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_token_is_answered_without_a_query(make_db_service):
+    db = token_snapshot_db(make_db_service)
+
+    assert await db.get_bill_with_items_by_token("guess") is None
+    assert await db.get_bill_with_items_by_token("guess") is None
+
+    assert len(db.client.queries) == 1
+    assert db.token_cache.negative_hits == 1
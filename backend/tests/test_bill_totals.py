@@ -0,0 +1,156 @@
+import copy
+import uuid
+from app.services.bill_totals import BillTotalsAggregator
+from app.services.settlement import compute_bill_results
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+class FakeBill:
+    """Bill snapshot that write helpers change the way the database would, mirrored into the aggregator"""
+
+    def __init__(self, aggregator: BillTotalsAggregator):
+        self.aggregator = aggregator
+        self.participants = [new_id(), new_id(), new_id()]
+        self.items = [new_id(), new_id()]
+        self.snapshot = {
+            "id": new_id(),
+            "currency": "EUR",
+            "link_token_hash": "token-hash",
+            "participants": [{"id": pid, "name": f"P{index}"} for index, pid in enumerate(self.participants)],
+            "items": [
+                {"id": self.items[0], "unit_price": "10.00", "qty_total": 5, "qty_shared_pool": 0,
+                 "claims": [], "shared_members": []},
+                {"id": self.items[1], "unit_price": "3.33", "qty_total": 2, "qty_shared_pool": 0,
+                 "claims": [], "shared_members": []},
+            ],
+        }
+
+    def item(self, item_id):
+        return next(item for item in self.snapshot["items"] if item["id"] == item_id)
+
+    def seed(self):
+        self.aggregator.seed(copy.deepcopy(self.snapshot), self.aggregator.begin_load())
+
+    def add_claim(self, item_id, participant_id, qty):
+        claim = {"id": new_id(), "bill_id": self.snapshot["id"], "item_id": item_id,
+                 "participant_id": participant_id, "qty_claimed": qty}
+        self.item(item_id)["claims"].append(claim)
+        self.aggregator.add_claim(dict(claim))
+        return claim
+
+    def remove_claim(self, claim):
+        item = self.item(claim["item_id"])
+        item["claims"] = [c for c in item["claims"] if c["id"] != claim["id"]]
+        self.aggregator.remove_claim(dict(claim))
+
+    def join_pool(self, item_id, participant_id, pool_size=None):
+        member = {"id": new_id(), "item_id": item_id, "participant_id": participant_id}
+        item = self.item(item_id)
+        item["shared_members"].append(member)
+        if pool_size is not None:
+            item["qty_shared_pool"] = pool_size
+            self.aggregator.init_pool(self.snapshot["id"], item_id, pool_size, dict(member))
+        else:
+            self.aggregator.add_member(None, item_id, dict(member))
+
+    def leave_pool(self, item_id, participant_id):
+        item = self.item(item_id)
+        item["shared_members"] = [m for m in item["shared_members"] if m["participant_id"] != participant_id]
+        self.aggregator.remove_member(self.snapshot["id"], item_id, participant_id)
+
+    def add_participant(self):
+        participant = {"id": new_id(), "bill_id": self.snapshot["id"], "name": "Late"}
+        self.snapshot["participants"].append({"id": participant["id"], "name": participant["name"]})
+        self.aggregator.add_participants([participant])
+        return participant["id"]
+
+    def assert_in_sync(self):
+        assert self.aggregator.results(self.snapshot["id"]) == compute_bill_results(self.snapshot)
+
+
+def test_totals_match_full_recompute_after_every_write():
+    bill = FakeBill(BillTotalsAggregator())
+    a, b, c = bill.participants
+    first, second = bill.items
+    bill.seed()
+    bill.assert_in_sync()
+
+    claim = bill.add_claim(first, a, 2)
+    bill.assert_in_sync()
+    bill.add_claim(first, b, 1)
+    bill.assert_in_sync()
+    bill.join_pool(second, a, pool_size=2)
+    bill.assert_in_sync()
+    bill.join_pool(second, b)
+    bill.assert_in_sync()
+    bill.join_pool(second, c)
+    bill.assert_in_sync()
+    bill.remove_claim(claim)
+    bill.assert_in_sync()
+    bill.leave_pool(second, a)
+    bill.assert_in_sync()
+    late = bill.add_participant()
+    bill.assert_in_sync()
+    bill.add_claim(first, late, 1)
+    bill.assert_in_sync()
+
+    assert bill.aggregator.stats()["drops"] == 0
+
+
+def test_write_in_flight_during_seed_is_not_counted_twice():
+    aggregator = BillTotalsAggregator()
+    bill = FakeBill(aggregator)
+    a, b, _ = bill.participants
+    first, second = bill.items
+
+    # The rows are in the database (and so in the seed) before their write events arrive
+    claim = {"id": new_id(), "bill_id": bill.snapshot["id"], "item_id": first, "participant_id": a, "qty_claimed": 1}
+    member = {"id": new_id(), "item_id": second, "participant_id": b}
+    bill.item(first)["claims"].append(claim)
+    bill.item(second)["shared_members"].append(member)
+    bill.item(second)["qty_shared_pool"] = 1
+    bill.seed()
+
+    aggregator.add_claim(dict(claim))
+    aggregator.init_pool(bill.snapshot["id"], second, 1, dict(member))
+    aggregator.add_member(bill.snapshot["id"], second, dict(member))
+
+    bill.assert_in_sync()
+    totals = {str(p.participant_id): p.grand_total for p in aggregator.results(bill.snapshot["id"]).participants}
+    assert str(totals[a]) == "10.00"
+    assert str(totals[b]) == "3.33"
+
+
+def test_seed_started_before_a_write_is_not_kept():
+    aggregator = BillTotalsAggregator()
+    bill = FakeBill(aggregator)
+
+    started_at = aggregator.begin_load()
+    stale = copy.deepcopy(bill.snapshot)
+    bill.add_claim(bill.items[0], bill.participants[0], 1)
+    aggregator.seed(stale, started_at)
+
+    assert aggregator.results(bill.snapshot["id"]) is None
+
+
+def test_unappliable_write_drops_the_bill():
+    aggregator = BillTotalsAggregator()
+    bill = FakeBill(aggregator)
+    bill.seed()
+
+    aggregator.remove_claim({"id": new_id(), "bill_id": bill.snapshot["id"], "item_id": bill.items[0]})
+
+    assert aggregator.results(bill.snapshot["id"]) is None
+    assert aggregator.stats()["drops"] == 1
+
+
+def test_expired_bill_needs_a_new_seed():
+    aggregator = BillTotalsAggregator(ttl_seconds=0)
+    bill = FakeBill(aggregator)
+    bill.seed()
+
+    assert aggregator.results(bill.snapshot["id"]) is None
+    assert aggregator.results_by_token_hash("token-hash") is None
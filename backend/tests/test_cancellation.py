@@ -0,0 +1,148 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+from app.api.cancellation import ClientDisconnectedError, ensure_still_wanted, run_until_disconnected
+from app.api.dependencies import get_db_service, get_gemini_service
+from app.core import config
+from app.services.resilience import Deadline, DeadlineExceededError
+from app.services.singleflight import SingleFlight
+from main import app
+from tests.fakes import FakeModels
+
+JPEG = b"\xff\xd8\xff\xe0" + bytes(64)
+
+
+class SlowGemini:
+    """Takes `delay` seconds per parse (bounded by the deadline) and finds no receipt"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def aparse_bill_from_bytes(self, image_bytes, filename, mime_type, image_sha256=None, deadline=None):
+        await deadline.run(asyncio.sleep(self.delay))
+        return {"error": "not a receipt", "raw_response": ""}
+
+
+class FakeRequest:
+    """Reports a disconnect once `connected_for` polls have passed"""
+
+    def __init__(self, connected_for=0):
+        self.connected_for = connected_for
+
+    async def is_disconnected(self):
+        self.connected_for -= 1
+        return self.connected_for < 0
+
+
+@pytest.fixture
+def use_gemini():
+    def use(gemini):
+        app.dependency_overrides[get_gemini_service] = lambda: gemini
+        app.dependency_overrides[get_db_service] = lambda: None
+
+    yield use
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def test_deadline_answers_504(client, use_gemini):
+    use_gemini(SlowGemini(delay=1))
+
+    response = client.post(
+        "/api/ai/parse-bill",
+        files={"file": ("bill.jpg", JPEG, "image/jpeg")},
+        headers={"X-Request-Timeout": "0.05"},
+    )
+
+    assert response.status_code == 504
+
+
+@pytest.mark.parametrize("timeout", ["abc", "0", "inf"])
+def test_invalid_timeout_header_is_rejected(client, use_gemini, timeout):
+    use_gemini(SlowGemini(delay=0))
+
+    response = client.post(
+        "/api/ai/parse-bill",
+        files={"file": ("bill.jpg", JPEG, "image/jpeg")},
+        headers={"X-Request-Timeout": timeout},
+    )
+
+    assert response.status_code == 400
+
+
+def test_batch_files_each_get_the_full_timeout(client, use_gemini, monkeypatch):
+    monkeypatch.setattr(config, "BATCH_MAX_CONCURRENCY", 1)
+    use_gemini(SlowGemini(delay=0.1))
+
+    # Run one after another the three files take 0.3s, longer than the 0.25s timeout
+    response = client.post(
+        "/api/ai/parse-bills",
+        files=[("files", (f"bill{index}.jpg", JPEG, "image/jpeg")) for index in range(3)],
+        headers={"X-Request-Timeout": "0.25"},
+    )
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 3
+    assert all("not a receipt" in result["error"] for result in results)
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_work(monkeypatch):
+    monkeypatch.setattr(config, "DISCONNECT_POLL_INTERVAL", 0.01)
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(ClientDisconnectedError):
+        await run_until_disconnected(FakeRequest(connected_for=2), work())
+
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_work_finishing_first_is_returned(monkeypatch):
+    monkeypatch.setattr(config, "DISCONNECT_POLL_INTERVAL", 0.01)
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    assert await run_until_disconnected(FakeRequest(connected_for=100), work()) == "done"
+
+
+@pytest.mark.asyncio
+async def test_ensure_still_wanted():
+    await ensure_still_wanted(FakeRequest(connected_for=1), Deadline(5))
+
+    with pytest.raises(ClientDisconnectedError):
+        await ensure_still_wanted(FakeRequest(), Deadline(5))
+
+    expired = Deadline(0.01)
+    await asyncio.sleep(0.02)
+    with pytest.raises(DeadlineExceededError):
+        await ensure_still_wanted(None, expired)
+
+
+@pytest.mark.asyncio
+async def test_short_deadline_of_one_caller_does_not_fail_the_others(make_gemini_service):
+    service = make_gemini_service(FakeModels(delay=0.2), singleflight=SingleFlight())
+
+    impatient, patient = await asyncio.gather(
+        service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg", deadline=Deadline(0.05)),
+        service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg", deadline=Deadline(2)),
+        return_exceptions=True,
+    )
+
+    assert isinstance(impatient, DeadlineExceededError)
+    assert patient["items"][0]["name"] == "Cola"
+    assert service.fake_models.calls == 1
@@ -0,0 +1,160 @@
+import uuid
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from postgrest.exceptions import APIError
+from app.api.dependencies import get_db_service
+from app.core.database import (
+    CLAIM_BILL_NOT_FOUND, CLAIM_INSUFFICIENT_QUANTITY, CLAIM_ITEM_NOT_FOUND, ClaimRejectedError
+)
+from app.services.bill_cache import BillSnapshotCache, BillTokenCache
+from main import app
+
+BILL_ID = str(uuid.uuid4())
+ITEM_ID = str(uuid.uuid4())
+PARTICIPANT_ID = str(uuid.uuid4())
+
+MISSING_FUNCTION = APIError({"message": "function not found", "code": "PGRST202", "hint": None, "details": None})
+
+
+def claim_row(quantity=1):
+    return {"id": str(uuid.uuid4()), "bill_id": BILL_ID, "item_id": ITEM_ID,
+            "participant_id": PARTICIPANT_ID, "qty_claimed": quantity}
+
+
+def bill_snapshot(qty_total=3, claimed=1):
+    return {
+        "id": BILL_ID,
+        "link_token_hash": "hash",
+        "items": [{"id": ITEM_ID, "qty_total": qty_total, "qty_shared_pool": 0,
+                   "claims": [{"qty_claimed": claimed}] if claimed else []}],
+        "participants": [],
+    }
+
+
+def rpc_answering(outcome):
+    return lambda query: outcome if query.kind == "rpc" else []
+
+
+@pytest.mark.asyncio
+async def test_rpc_claim_is_stored(make_db_service):
+    claim = claim_row(2)
+    db = make_db_service(rpc_answering({"status": "ok", "claim": claim, "remaining": 1}))
+
+    outcome = await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 2)
+
+    assert outcome == {"claim": claim, "remaining_quantity": 1}
+    (query,) = db.client.queries
+    assert query.name == "claim_item_exclusive"
+    assert query.params == {"token_hash": db.hash_token("token"), "item_uuid": ITEM_ID,
+                            "participant_uuid": PARTICIPANT_ID, "qty": 2}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("outcome, remaining", [
+    ({"status": CLAIM_BILL_NOT_FOUND}, None),
+    ({"status": CLAIM_ITEM_NOT_FOUND}, None),
+    ({"status": CLAIM_INSUFFICIENT_QUANTITY, "remaining": 1}, 1),
+])
+async def test_rpc_rejections(make_db_service, outcome, remaining):
+    db = make_db_service(rpc_answering(outcome))
+
+    with pytest.raises(ClaimRejectedError) as raised:
+        await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 2)
+
+    assert raised.value.status == outcome["status"]
+    assert raised.value.remaining == remaining
+
+
+@pytest.mark.asyncio
+async def test_unknown_token_is_rejected_without_a_query(make_db_service):
+    db = make_db_service(token_cache=BillTokenCache())
+    db.token_cache.put_missing(db.hash_token("token"))
+
+    with pytest.raises(ClaimRejectedError) as raised:
+        await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 1)
+
+    assert raised.value.status == CLAIM_BILL_NOT_FOUND
+    assert db.client.queries == []
+
+
+@pytest.mark.asyncio
+async def test_rpc_transport_error_drops_the_cached_bill(make_db_service):
+    cache = BillSnapshotCache()
+    cache.put(bill_snapshot(), cache.begin_load())
+    db = make_db_service(rpc_answering(httpx.ReadTimeout("timed out")), snapshot_cache=cache)
+
+    with pytest.raises(httpx.ReadTimeout):
+        await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 1)
+
+    assert cache.get(BILL_ID) is None
+
+
+def fallback_db(make_db_service, snapshot):
+    def handler(query):
+        if query.kind == "rpc" and query.name == "claim_item_exclusive":
+            return MISSING_FUNCTION
+        if query.kind == "rpc":
+            return snapshot
+        (claim,), _ = query.called("insert")[0]
+        return [{"id": str(uuid.uuid4()), **claim}]
+
+    return make_db_service(handler)
+
+
+@pytest.mark.asyncio
+async def test_fallback_claims_from_the_snapshot(make_db_service):
+    db = fallback_db(make_db_service, bill_snapshot(qty_total=3, claimed=1))
+
+    outcome = await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 2)
+    assert outcome["remaining_quantity"] == 0
+    assert outcome["claim"]["qty_claimed"] == 2
+
+    # The missing function is not asked for again
+    await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 1)
+    names = [query.name for query in db.client.queries]
+    assert names.count("claim_item_exclusive") == 1
+
+
+@pytest.mark.asyncio
+async def test_fallback_rejects_insufficient_quantity(make_db_service):
+    db = fallback_db(make_db_service, bill_snapshot(qty_total=3, claimed=2))
+
+    with pytest.raises(ClaimRejectedError) as raised:
+        await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 2)
+
+    assert raised.value.status == CLAIM_INSUFFICIENT_QUANTITY
+    assert raised.value.remaining == 1
+    assert not any(query.name == "claims" for query in db.client.queries)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("snapshot, status", [
+    (None, CLAIM_BILL_NOT_FOUND),
+    ({**bill_snapshot(), "items": []}, CLAIM_ITEM_NOT_FOUND),
+])
+async def test_fallback_rejects_unknown_bill_or_item(make_db_service, snapshot, status):
+    db = fallback_db(make_db_service, snapshot)
+
+    with pytest.raises(ClaimRejectedError) as raised:
+        await db.claim_item_exclusive("token", ITEM_ID, PARTICIPANT_ID, 1)
+
+    assert raised.value.status == status
+
+
+@pytest.mark.parametrize("outcome, status_code", [
+    ({"status": CLAIM_BILL_NOT_FOUND}, 404),
+    ({"status": CLAIM_ITEM_NOT_FOUND}, 404),
+    ({"status": CLAIM_INSUFFICIENT_QUANTITY, "remaining": 0}, 400),
+    ({"status": "ok", "claim": claim_row(), "remaining": 2}, 200),
+])
+def test_claim_endpoint_statuses(make_db_service, outcome, status_code):
+    app.dependency_overrides[get_db_service] = lambda: make_db_service(rpc_answering(outcome))
+    try:
+        response = TestClient(app).post("/api/public/token/claim-exclusive", json={
+            "item_id": ITEM_ID, "participant_id": PARTICIPANT_ID, "quantity": 1
+        })
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == status_code
@@ -0,0 +1,116 @@
+import uuid
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+from app.core import config
+from app.core.database import ItemInsertError
+from app.services.bill_cache import BillSnapshotCache
+
+BILL_ID = str(uuid.uuid4())
+
+CHECK_VIOLATION = APIError({"message": "violates check constraint", "code": "23514", "hint": None, "details": None})
+
+
+def item(name, price=2.5):
+    return {"name": name, "category": "Food", "unit_price": price, "quantity": 1}
+
+
+class ItemTable:
+    """Stores inserted item rows; reject(rows) may return an exception to raise for an insert"""
+
+    def __init__(self, reject=lambda rows: None):
+        self.reject = reject
+        self.stored = []
+
+    def __call__(self, query):
+        (rows,), _ = query.called("insert")[0]
+        rows = rows if isinstance(rows, list) else [rows]
+        error = self.reject(rows)
+        if error is not None:
+            return error
+        created = [{"id": str(uuid.uuid4()), **row} for row in rows]
+        self.stored.extend(created)
+        return created
+
+
+@pytest.mark.asyncio
+async def test_items_are_inserted_in_chunks(make_db_service, monkeypatch):
+    monkeypatch.setattr(config, "DB_INSERT_CHUNK_SIZE", 2)
+    table = ItemTable()
+    db = make_db_service(table)
+
+    created = await db.create_items(BILL_ID, [item(f"Item {index}") for index in range(5)])
+
+    assert [row["name"] for row in created] == [f"Item {index}" for index in range(5)]
+    assert len(db.client.queries) == 3
+    assert all(row["bill_id"] == BILL_ID for row in table.stored)
+
+
+@pytest.mark.asyncio
+async def test_rejected_chunk_is_retried_row_by_row(make_db_service):
+    table = ItemTable(reject=lambda rows: CHECK_VIOLATION if any(row["name"] == "Bad" for row in rows) else None)
+    db = make_db_service(table)
+
+    with pytest.raises(ItemInsertError) as raised:
+        await db.create_items(BILL_ID, [item("Soup"), item("Bad"), item("Bread")])
+
+    assert [row["name"] for row in raised.value.created] == ["Soup", "Bread"]
+    assert [(failure["index"], failure["item"]["name"]) for failure in raised.value.failures] == [(1, "Bad")]
+    assert sorted(row["name"] for row in table.stored) == ["Bread", "Soup"]
+
+
+@pytest.mark.asyncio
+async def test_invalid_item_only_fails_itself(make_db_service):
+    table = ItemTable()
+    db = make_db_service(table)
+
+    with pytest.raises(ItemInsertError) as raised:
+        await db.create_items(BILL_ID, [item("Soup"), item("Free lunch", price=-1)])
+
+    assert [row["name"] for row in raised.value.created] == ["Soup"]
+    assert raised.value.failures[0]["index"] == 1
+    assert len(db.client.queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_timeout_is_raised_without_retrying_rows(make_db_service):
+    def store_then_time_out(rows):
+        # The chunk reaches the database, but the answer never arrives
+        table.stored.extend(rows)
+        return httpx.ReadTimeout("timed out")
+
+    table = ItemTable(reject=store_then_time_out)
+    db = make_db_service(table)
+
+    with pytest.raises(httpx.ReadTimeout):
+        await db.create_items(BILL_ID, [item("Soup"), item("Bread")])
+
+    assert len(db.client.queries) == 1
+    assert sorted(row["name"] for row in table.stored) == ["Bread", "Soup"]
+
+
+@pytest.mark.asyncio
+async def test_failed_insert_still_invalidates_the_bill(make_db_service):
+    cache = BillSnapshotCache()
+    cache.put({"id": BILL_ID, "link_token_hash": "hash", "items": [], "participants": []}, cache.begin_load())
+    db = make_db_service(ItemTable(reject=lambda rows: httpx.ConnectError("refused")), snapshot_cache=cache)
+
+    with pytest.raises(httpx.ConnectError):
+        await db.create_items(BILL_ID, [item("Soup")])
+
+    assert cache.get(BILL_ID) is None
+
+
+@pytest.mark.asyncio
+async def test_snapshot_fallback_orders_nested_rows(make_db_service):
+    missing = APIError({"message": "function not found", "code": "PGRST202", "hint": None, "details": None})
+    snapshot = {"id": BILL_ID, "items": [], "participants": []}
+    db = make_db_service(lambda query: missing if query.kind == "rpc" else [snapshot])
+
+    assert await db.get_bill_with_items(BILL_ID) == snapshot
+    assert await db.get_bill_with_items(BILL_ID) == snapshot
+
+    # The missing function is only asked for once
+    assert [query.kind for query in db.client.queries] == ["rpc", "table", "table"]
+    ordered = [kwargs["foreign_table"] for _, kwargs in db.client.queries[-1].called("order")]
+    assert ordered == ["items", "items.claims", "items.shared_members", "participants"]
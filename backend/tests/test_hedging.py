@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+from app.services.hedging import HedgeBudget, Hedger, LatencyHistogram
+
+
+def make_hedger(samples=20, latency=0.05, credit=5, **kwargs):
+    histogram = LatencyHistogram()
+    for _ in range(samples):
+        histogram.record(latency)
+    budget = HedgeBudget(ratio=1.0, burst=10)
+    budget._credit = credit
+    return Hedger(histogram, budget, min_delay=0.05, **kwargs)
+
+
+class SlowThenFast:
+    """The first call hangs; any later call answers right away"""
+
+    def __init__(self, first_delay=5.0):
+        self.first_delay = first_delay
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        try:
+            await asyncio.sleep(self.first_delay if call == 1 else 0)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return call
+
+
+def test_histogram_percentile_follows_window():
+    histogram = LatencyHistogram(window=10)
+    assert histogram.percentile(50) is None
+
+    for _ in range(10):
+        histogram.record(0.02)
+    for _ in range(10):
+        histogram.record(1.0)
+
+    assert len(histogram) == 10
+    assert histogram.percentile(50) >= 1.0
+
+
+def test_budget_caps_hedges_and_refund_is_bounded():
+    budget = HedgeBudget(ratio=0.5, burst=1.0)
+    assert not budget.try_spend()
+
+    budget.on_request()
+    budget.on_request()
+    budget.on_request()
+    assert budget.credit == 1.0
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+    budget.refund()
+    budget.refund()
+    assert budget.credit == 1.0
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_without_enough_samples():
+    hedger = make_hedger(samples=5)
+    call = SlowThenFast(first_delay=0.2)
+
+    assert await hedger.run(call) == 1
+    assert call.calls == 1
+    assert hedger.hedged == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged_and_loser_cancelled():
+    hedger = make_hedger()
+    call = SlowThenFast()
+
+    assert await hedger.run(call) == 2
+    assert call.calls == 2
+    await asyncio.sleep(0)
+    assert call.cancelled == 1
+    assert hedger.hedged == 1
+    assert hedger.hedge_wins == 1
+
+
+@pytest.mark.asyncio
+async def test_fast_call_is_not_hedged():
+    hedger = make_hedger(latency=0.5)
+    call = SlowThenFast(first_delay=0)
+
+    assert await hedger.run(call) == 1
+    assert hedger.hedged == 0
+
+
+@pytest.mark.asyncio
+async def test_winning_hedge_records_request_latency():
+    # A one-sample window: the histogram holds only the latency of the last request
+    histogram = LatencyHistogram(window=1)
+    histogram.record(0.2)
+    hedger = Hedger(histogram, HedgeBudget(ratio=1.0), min_samples=1, min_delay=0.2)
+    call = SlowThenFast()
+
+    await hedger.run(call)
+
+    # The hedge answered instantly, but the caller waited for the hedge delay
+    assert hedger.hedge_wins == 1
+    assert histogram.percentile(100) >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_refused_hedge_does_not_spend_budget():
+    hedger = make_hedger(credit=1)
+    call = SlowThenFast(first_delay=0.2)
+
+    assert await hedger.run(call, admit_hedge=lambda: False) == 1
+    assert call.calls == 1
+    assert hedger.hedged == 0
+    # One credit left plus the one earned by this request
+    assert hedger.budget.credit == 2
+
+
+@pytest.mark.asyncio
+async def test_exhausted_budget_skips_hedge():
+    hedger = make_hedger(credit=0)
+    hedger.budget.ratio = 0
+    call = SlowThenFast(first_delay=0.2)
+
+    assert await hedger.run(call) == 1
+    assert call.calls == 1
+    assert hedger.budget_exhausted == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_call_waits_for_the_other():
+    hedger = make_hedger()
+    calls = 0
+
+    async def fail_slowly_then_succeed():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(0.2)
+            raise RuntimeError("primary failed")
+        await asyncio.sleep(0.3)
+        return "hedge"
+
+    assert await hedger.run(fail_slowly_then_succeed) == "hedge"
@@ -0,0 +1,180 @@
+import io
+import random
+import pytest
+from PIL import Image, ImageDraw, ImageFont, PngImagePlugin
+from app.services import image_hash
+from app.services.image_hash import (
+    BKTree, ImageFingerprint, NearDuplicateIndex, dhash, fingerprint, hamming_distance, same_photo
+)
+from app.services.parse_cache import ParseCache
+
+
+def receipt_photo(lines, note: str = "") -> bytes:
+    """PNG of a light receipt with text lines on a dark table; note only changes the file's metadata"""
+    image = Image.new("RGB", (900, 1200), (60, 45, 40))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((200, 100, 700, 1100), fill=(245, 245, 240))
+    font = ImageFont.load_default(size=32)
+    for index, line in enumerate(lines):
+        draw.text((230, 130 + index * 48), line, fill=(20, 20, 20), font=font)
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", note)
+    output = io.BytesIO()
+    image.save(output, "PNG", pnginfo=info)
+    return output.getvalue()
+
+
+RECEIPT = [f"Item {index}  {index * 1.5:.2f}" for index in range(20)]
+OTHER_RECEIPT = [f"Other {index}  {index * 2.25:.2f}" for index in range(20)]
+
+
+def brute_force(entries, query, max_distance):
+    return sorted(
+        (hamming_distance(query, hash_value), hash_value, value)
+        for hash_value, value in entries.items()
+        if hamming_distance(query, hash_value) <= max_distance
+    )
+
+
+def test_empty_tree():
+    assert BKTree().search(0, 10) == []
+
+
+def test_search_matches_brute_force():
+    rng = random.Random(1)
+    tree = BKTree()
+    entries = {}
+    for index in range(500):
+        hash_value = rng.getrandbits(64)
+        entries[hash_value] = index
+        tree.add(hash_value, index)
+
+    for _ in range(50):
+        base = rng.choice(list(entries))
+        query = base ^ rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+        for max_distance in (0, 4, 12, 24):
+            assert sorted(tree.search(query, max_distance)) == brute_force(entries, query, max_distance)
+
+
+def test_results_are_closest_first():
+    tree = BKTree()
+    for hash_value in (0b0000, 0b0001, 0b0011, 0b0111, 0b1111):
+        tree.add(hash_value, hash_value)
+
+    distances = [distance for distance, _, _ in tree.search(0, 4)]
+
+    assert distances == [0, 1, 2, 3, 4]
+
+
+def test_adding_the_same_hash_replaces_its_value():
+    tree = BKTree()
+    tree.add(0b1010, "first")
+    tree.add(0b1010, "second")
+
+    assert tree.size == 1
+    assert tree.search(0b1010, 0) == [(0, 0b1010, "second")]
+
+
+def test_dhash_of_undecodable_bytes_is_none():
+    assert dhash(b"not an image") is None
+    assert fingerprint(b"not an image") is None
+
+
+def test_copy_of_the_same_photo_hashes_alike_and_another_receipt_does_not():
+    original = fingerprint(receipt_photo(RECEIPT))
+    copy = fingerprint(receipt_photo(RECEIPT, note="forwarded"))
+    other = fingerprint(receipt_photo(OTHER_RECEIPT))
+
+    assert hamming_distance(original.hash, copy.hash) == 0
+    assert same_photo(original, copy)
+    assert hamming_distance(original.hash, other.hash) > 16
+
+
+def test_same_photo_needs_matching_dimensions_and_size():
+    photo = ImageFingerprint(0, 1000, 2000, 100_000)
+
+    assert same_photo(photo, ImageFingerprint(0, 1010, 2010, 120_000))
+    assert not same_photo(photo, ImageFingerprint(0, 1100, 2000, 100_000))
+    assert not same_photo(photo, ImageFingerprint(0, 1000, 2000, 200_000))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(image_hash.time, "monotonic", clock)
+    return clock
+
+
+def test_index_matches_within_distance_only(clock):
+    index = NearDuplicateIndex(max_distance=4)
+    index.add(ImageFingerprint(0b0000, 100, 100, 1000), "original")
+
+    assert index.find(ImageFingerprint(0b0111, 100, 100, 1000)) == ["original"]
+    assert index.find(ImageFingerprint(0b11111, 100, 100, 1000)) == []
+
+
+def test_index_rejects_candidates_that_are_not_the_same_photo(clock):
+    index = NearDuplicateIndex(max_distance=4)
+    index.add(ImageFingerprint(0, 100, 100, 1000), "original")
+
+    assert index.find(ImageFingerprint(0, 100, 100, 5000)) == []
+    assert index.stats()["rejected"] == 1
+
+
+def test_index_forgets_photos_outside_the_window(clock):
+    index = NearDuplicateIndex(max_distance=4, window_seconds=60)
+    index.add(ImageFingerprint(0b00, 100, 100, 1000), "original")
+    index.add(ImageFingerprint(0b10, 100, 100, 1000), "another")
+    clock.now += 61
+
+    assert index.find(ImageFingerprint(0, 100, 100, 1000)) == []
+
+    # Expired entries are pruned once they make up more than half of the index
+    index.add(ImageFingerprint(0b1, 100, 100, 1000), "new")
+    assert index.stats()["entries"] == 1
+    assert index.find(ImageFingerprint(0, 100, 100, 1000)) == ["new"]
+
+
+def test_index_is_bounded(clock):
+    index = NearDuplicateIndex(max_distance=0, max_entries=3)
+    for value in range(5):
+        index.add(ImageFingerprint(value, 100, 100, 1000), f"key-{value}")
+
+    assert index.stats()["entries"] == 3
+    assert index.find(ImageFingerprint(0, 100, 100, 1000)) == []
+    assert index.find(ImageFingerprint(4, 100, 100, 1000)) == ["key-4"]
+
+
+def test_lookup_skips_keys_that_no_longer_resolve(clock):
+    index = NearDuplicateIndex(max_distance=4)
+    index.add(ImageFingerprint(0b0, 100, 100, 1000), "evicted")
+    index.add(ImageFingerprint(0b1, 100, 100, 1000), "stored")
+
+    value = index.lookup(ImageFingerprint(0b0, 100, 100, 1000), {"stored": "parse"}.get)
+
+    assert value == "parse"
+    assert index.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_resent_copy_reuses_the_parse(make_gemini_service, tmp_path):
+    cache = ParseCache(str(tmp_path / "parse_cache.db"))
+    service = make_gemini_service(cache=cache, near_duplicates=NearDuplicateIndex())
+    try:
+        first = await service.aparse_bill_from_bytes(receipt_photo(RECEIPT), "bill.png", "image/png")
+        copy = await service.aparse_bill_from_bytes(receipt_photo(RECEIPT, note="forwarded"), "bill.png", "image/png")
+        assert service.fake_models.calls == 1
+        assert copy == first
+
+        await service.aparse_bill_from_bytes(receipt_photo(OTHER_RECEIPT), "bill.png", "image/png")
+        assert service.fake_models.calls == 2
+    finally:
+        cache.close()
@@ -0,0 +1,99 @@
+import json
+import pytest
+from app.services.incremental_json import IncrementalArrayParser
+from tests.fakes import FakeModels
+
+DOCUMENT = json.dumps({
+    "m": "Café \"Zur Ecke\" [Mitte]",
+    "i": [
+        {"n": "Cola {light}", "p": 3.5, "q": 2},
+        {"n": "Back\\slash \"quoted\" ]", "p": 1.25, "q": 1},
+        {"n": "Fries, large", "p": 4, "q": 1, "tags": ["a", "b"]},
+    ],
+    "t": 12.25,
+})
+
+
+def parse(chunks):
+    parser = IncrementalArrayParser()
+    elements = []
+    for chunk in chunks:
+        elements.extend(parser.feed(chunk))
+    return parser, elements
+
+
+def items(elements):
+    return [element for key, element in elements if key == "i"]
+
+
+def test_whole_document():
+    _, elements = parse([DOCUMENT])
+
+    assert items(elements) == json.loads(DOCUMENT)["i"]
+
+
+def test_nested_array_elements_carry_their_own_key():
+    _, elements = parse([DOCUMENT])
+
+    assert [element for key, element in elements if key == "tags"] == []
+    assert len(elements) == 3
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_any_chunking_gives_the_same_elements(size):
+    chunks = [DOCUMENT[start:start + size] for start in range(0, len(DOCUMENT), size)]
+
+    parser, elements = parse(chunks)
+
+    assert items(elements) == json.loads(DOCUMENT)["i"]
+    assert parser.text == DOCUMENT
+
+
+def test_split_inside_an_escape_sequence():
+    text = '{"i": [{"n": "a\\"b"}]}'
+    split = text.index("\\") + 1
+
+    _, elements = parse([text[:split], text[split:]])
+
+    assert elements == [("i", {"n": 'a"b'})]
+
+
+def test_elements_are_reported_as_soon_as_they_close():
+    parser = IncrementalArrayParser()
+
+    assert parser.feed('{"i": [{"n": "A"}, {"n"') == [("i", {"n": "A"})]
+    assert parser.feed(': "B"}') == [("i", {"n": "B"})]
+    assert parser.feed("]}") == []
+
+
+def test_leading_markdown_fence_is_skipped():
+    _, elements = parse(["```json\n", '{"i": [{"n": "A"}]}', "\n```"])
+
+    assert elements == [("i", {"n": "A"})]
+
+
+def test_top_level_array_elements_have_no_key():
+    _, elements = parse(['[{"n": "A"}, {"n": "B"}]'])
+
+    assert elements == [(None, {"n": "A"}), (None, {"n": "B"})]
+
+
+def test_unbalanced_closing_brackets_are_ignored():
+    _, elements = parse(['{"i": [{"n": "A"}]}]}'])
+
+    assert elements == [("i", {"n": "A"})]
+
+
+@pytest.mark.asyncio
+async def test_model_stream_yields_items_then_the_bill(make_gemini_service):
+    text = json.dumps({"i": [
+        {"n": "Cola", "c": "Drinks", "p": 3.5, "q": 2},
+        {"n": "Soup [of the day]", "c": "Food", "p": 6, "q": 1},
+    ], "cur": "usd"})
+    service = make_gemini_service(FakeModels(text=text, chunk_size=5))
+
+    events = [event async for event in service.astream_bill_items(b"image", "bill.jpg", "image/jpeg")]
+
+    assert [kind for kind, _ in events] == ["item", "item", "bill"]
+    assert [payload["name"] for _, payload in events[:2]] == ["Cola", "Soup [of the day]"]
+    assert events[-1][1]["currency"] == "USD"
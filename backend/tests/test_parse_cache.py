@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from app.services.parse_cache import ParseCache
+from tests.fakes import FakeModels
+
+RESULT = {"currency": "EUR", "items": [{"name": "Cola", "unit_price": 3.5, "quantity": 2}]}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ParseCache(str(tmp_path / "parse_cache.db"))
+    yield cache
+    cache.close()
+
+
+def test_miss_then_hit(cache):
+    key = ParseCache.make_key("abc", "model", "1")
+
+    assert cache.get(key) is None
+    cache.put(key, RESULT)
+
+    assert cache.get(key) == RESULT
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_results_are_copies(cache):
+    cache.put("key", RESULT)
+    cache.get("key")["items"].clear()
+
+    assert cache.get("key") == RESULT
+
+
+def test_model_and_prompt_version_are_part_of_the_key():
+    assert ParseCache.make_key("abc", "model", "1") != ParseCache.make_key("abc", "model", "2")
+    assert ParseCache.make_key("abc", "model", "1") != ParseCache.make_key("abc", "other", "1")
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "parse_cache.db")
+    first = ParseCache(path)
+    first.put("key", RESULT)
+    first.close()
+
+    second = ParseCache(path)
+    try:
+        assert second.get("key") == RESULT
+        assert second.stats()["disk_hits"] == 1
+        # Promoted to memory on the disk hit
+        assert second.get("key") == RESULT
+        assert second.stats()["memory_hits"] == 1
+    finally:
+        second.close()
+
+
+def test_memory_tier_is_bounded_by_size(tmp_path):
+    cache = ParseCache(str(tmp_path / "parse_cache.db"), max_memory_bytes=300)
+    try:
+        for index in range(5):
+            cache.put(f"key-{index}", RESULT)
+
+        assert cache.stats()["memory_bytes"] <= 300
+        assert cache.stats()["memory_entries"] < 5
+        assert cache.get("key-0") == RESULT
+        assert cache.stats()["disk_hits"] == 1
+    finally:
+        cache.close()
+
+
+def test_disk_tier_keeps_the_newest_entries(tmp_path):
+    cache = ParseCache(str(tmp_path / "parse_cache.db"), max_memory_bytes=0, max_disk_entries=3)
+    try:
+        for index in range(5):
+            cache.put(f"key-{index}", RESULT)
+
+        assert cache.get("key-0") is None
+        assert cache.get("key-1") is None
+        assert all(cache.get(f"key-{index}") == RESULT for index in range(2, 5))
+    finally:
+        cache.close()
+
+
+@pytest.mark.asyncio
+async def test_repeated_image_is_parsed_once(make_gemini_service, cache):
+    service = make_gemini_service(cache=cache)
+
+    first = await service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg")
+    second = await service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg")
+    await service.aparse_bill_from_bytes(b"other image", "bill.jpg", "image/jpeg")
+
+    assert first == second
+    assert first["items"][0]["name"] == "Cola"
+    assert service.fake_models.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_parses_are_not_cached(make_gemini_service, cache):
+    service = make_gemini_service(FakeModels(text="not json"), cache=cache)
+
+    first = await service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg")
+    await service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg")
+
+    assert "error" in first
+    assert service.fake_models.calls == 2
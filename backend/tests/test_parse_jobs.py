@@ -0,0 +1,161 @@
+import asyncio
+import io
+import os
+import pytest
+from app.services.parse_jobs import (
+    ParseJobStore, ParseJobQueue, JOB_QUEUED, JOB_PARSING, JOB_SAVING, JOB_COMPLETED, JOB_FAILED
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ParseJobStore(str(tmp_path / "jobs.db"))
+    yield store
+    store.close()
+
+
+class Handler:
+    """Records the images it is run on and answers like the bill parsing handler"""
+
+    def __init__(self, result=None, error=None, release: asyncio.Event = None):
+        self.result = result if result is not None else {"success": True, "bill": {"id": "bill-1"}}
+        self.error = error
+        self.release = release
+        self.images = []
+
+    async def __call__(self, image_bytes, filename, mime_type, set_status):
+        self.images.append(image_bytes)
+        if self.release is not None:
+            await self.release.wait()
+        await set_status(JOB_SAVING)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def wait_until_finished(queue, job_id):
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["status"] in (JOB_COMPLETED, JOB_FAILED):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+@pytest.mark.asyncio
+async def test_submitted_job_completes(store):
+    handler = Handler()
+    queue = ParseJobQueue(store, handler, workers=1)
+    await queue.start()
+    try:
+        job = await queue.submit("bill.jpg", "image/jpeg", io.BytesIO(b"image"))
+        assert job["status"] == JOB_QUEUED
+
+        job = await wait_until_finished(queue, job["id"])
+    finally:
+        await queue.stop()
+
+    assert job["status"] == JOB_COMPLETED
+    assert job["result"] == {"success": True, "bill": {"id": "bill-1"}}
+    assert handler.images == [b"image"]
+    assert store.load_image(job["id"]) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("handler, error", [
+    (Handler(error=RuntimeError("boom")), "Error parsing bill: boom"),
+    (Handler(result={"success": False, "error": "unreadable"}), "unreadable"),
+])
+async def test_failed_job(store, handler, error):
+    queue = ParseJobQueue(store, handler, workers=1)
+    await queue.start()
+    try:
+        job = await queue.submit("bill.jpg", "image/jpeg", io.BytesIO(b"image"))
+        job = await wait_until_finished(queue, job["id"])
+    finally:
+        await queue.stop()
+
+    assert job["status"] == JOB_FAILED
+    assert job["error"] == error
+
+
+@pytest.mark.asyncio
+async def test_restart_reruns_parsing_jobs_but_not_saving_ones(store):
+    parsing = store.create("a.jpg", "image/jpeg", io.BytesIO(b"parsing"))
+    saving = store.create("b.jpg", "image/jpeg", io.BytesIO(b"saving"))
+    store.update(parsing["id"], JOB_PARSING)
+    store.update(saving["id"], JOB_SAVING)
+
+    handler = Handler()
+    queue = ParseJobQueue(store, handler, workers=1)
+    await queue.start()
+    try:
+        parsing = await wait_until_finished(queue, parsing["id"])
+    finally:
+        await queue.stop()
+    saving = store.get(saving["id"])
+
+    assert parsing["status"] == JOB_COMPLETED
+    assert saving["status"] == JOB_FAILED
+    assert "Interrupted while saving" in saving["error"]
+    assert handler.images == [b"parsing"]
+    assert store.load_image(saving["id"]) is None
+
+
+@pytest.mark.asyncio
+async def test_events_follow_the_job_until_it_finishes(store):
+    release = asyncio.Event()
+    queue = ParseJobQueue(store, Handler(release=release), workers=1, poll_interval=5)
+    await queue.start()
+    try:
+        job = await queue.submit("bill.jpg", "image/jpeg", io.BytesIO(b"image"))
+        statuses = []
+
+        async def follow():
+            async for update in queue.events(job["id"]):
+                statuses.append(update["status"])
+                if update["status"] == JOB_PARSING:
+                    release.set()
+
+        await asyncio.wait_for(follow(), timeout=2)
+    finally:
+        await queue.stop()
+
+    assert statuses[-3:] == [JOB_PARSING, JOB_SAVING, JOB_COMPLETED]
+    assert queue.stats()["subscribers"] == 0
+
+
+@pytest.mark.asyncio
+async def test_events_pick_up_changes_made_by_another_process(store, tmp_path):
+    queue = ParseJobQueue(store, Handler(), workers=0, poll_interval=0.05)
+    job = await queue.submit("bill.jpg", "image/jpeg", io.BytesIO(b"image"))
+    other_process = ParseJobStore(str(tmp_path / "jobs.db"))
+    statuses = []
+
+    async def follow():
+        async for update in queue.events(job["id"]):
+            statuses.append(update["status"])
+
+    async def run_elsewhere():
+        for status in (JOB_PARSING, JOB_COMPLETED):
+            await asyncio.sleep(0.1)
+            other_process.update(job["id"], status, {"success": True})
+
+    try:
+        await asyncio.wait_for(asyncio.gather(follow(), run_elsewhere()), timeout=2)
+    finally:
+        other_process.close()
+
+    assert statuses == [JOB_QUEUED, JOB_PARSING, JOB_COMPLETED]
+
+
+def test_prune_removes_old_finished_jobs(store):
+    finished = store.create("a.jpg", "image/jpeg", io.BytesIO(b"a"))
+    queued = store.create("b.jpg", "image/jpeg", io.BytesIO(b"b"))
+    store.update(finished["id"], JOB_COMPLETED, {"success": True})
+
+    store.prune(max_age_seconds=-1)
+
+    assert store.get(finished["id"]) is None
+    assert not os.path.exists(os.path.join(store.spool_dir, finished["id"]))
+    assert store.get(queued["id"])["status"] == JOB_QUEUED
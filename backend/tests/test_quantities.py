@@ -0,0 +1,26 @@
+from app.services.quantities import compute_item_quantities, item_quantities
+
+
+def test_item_quantities():
+    item = {"id": "item-1", "qty_total": 6, "qty_shared_pool": 2, "claims": [{"qty_claimed": 1}, {"qty_claimed": 2}]}
+
+    assert item_quantities(item) == {"total": 6, "claimed": 3, "pooled": 2, "remaining": 1}
+
+
+def test_item_without_claims_or_pool():
+    assert item_quantities({"qty_total": 2, "claims": None, "qty_shared_pool": None}) == {
+        "total": 2, "claimed": 0, "pooled": 0, "remaining": 2
+    }
+
+
+def test_compute_item_quantities_keys_by_item_id():
+    bill = {"items": [
+        {"id": 1, "qty_total": 1, "claims": [{"qty_claimed": 1}]},
+        {"id": 2, "qty_total": 3},
+    ]}
+
+    quantities = compute_item_quantities(bill)
+
+    assert quantities["1"]["remaining"] == 0
+    assert quantities["2"]["remaining"] == 3
+    assert compute_item_quantities({"items": None}) == {}
@@ -0,0 +1,263 @@
+import asyncio
+import httpx
+import pytest
+from google.genai import errors
+from app.services import resilience
+from app.services.resilience import (
+    AdaptiveRateLimiter, CircuitBreaker, Deadline, DeadlineExceededError, ResilientCaller, UpstreamUnavailableError
+)
+
+UNAVAILABLE = errors.ServerError(503, {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}})
+THROTTLED = errors.ClientError(429, {"error": {"code": 429, "message": "quota", "status": "RESOURCE_EXHAUSTED"}})
+BAD_REQUEST = errors.ClientError(400, {"error": {"code": 400, "message": "bad image", "status": "INVALID_ARGUMENT"}})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_rejects_with_retry_after(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 10
+
+    with pytest.raises(UpstreamUnavailableError) as error:
+        breaker.before_call()
+
+    assert error.value.retry_after == pytest.approx(20)
+    assert breaker.rejected == 1
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(UpstreamUnavailableError) as error:
+        breaker.before_call()
+    assert error.value.retry_after == 1.0
+
+
+def test_successful_probe_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    breaker.before_call()
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_for_a_full_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+    clock.now += 29
+    with pytest.raises(UpstreamUnavailableError):
+        breaker.before_call()
+
+
+def test_ignored_probe_lets_the_next_call_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    breaker.before_call()
+    breaker.record_ignored()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+
+
+def test_limiter_allows_a_burst_then_makes_callers_wait(clock):
+    limiter = AdaptiveRateLimiter(rate=2, burst=3)
+
+    assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5
+    assert limiter.try_acquire()
+
+
+@pytest.mark.asyncio
+async def test_limiter_fails_fast_instead_of_waiting_too_long(clock):
+    limiter = AdaptiveRateLimiter(rate=1, burst=1)
+    await limiter.acquire(max_wait=0)
+
+    with pytest.raises(UpstreamUnavailableError) as error:
+        await limiter.acquire(max_wait=0.5)
+
+    assert error.value.retry_after == pytest.approx(1)
+    # The refused caller gave its token back
+    clock.now += 1
+    assert limiter.try_acquire()
+
+
+def test_limiter_halves_on_throttle_and_grows_back(clock):
+    limiter = AdaptiveRateLimiter(rate=4, min_rate=1, max_rate=4.2, increase=0.1)
+
+    limiter.on_throttle()
+    assert limiter.rate == 2
+    for _ in range(3):
+        limiter.on_throttle()
+    assert limiter.rate == 1
+
+    for _ in range(50):
+        limiter.on_success()
+    assert limiter.rate == pytest.approx(4.2)
+
+
+class Flaky:
+    """Call that fails with the given errors before succeeding"""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return "ok"
+
+
+def make_caller(**kwargs):
+    options = {"max_attempts": 3, "base_delay": 0, "max_delay": 0}
+    options.update(kwargs)
+    return ResilientCaller(AdaptiveRateLimiter(rate=100, burst=100), CircuitBreaker(failure_threshold=5), **options)
+
+
+def test_max_attempts_must_be_positive():
+    with pytest.raises(ValueError):
+        make_caller(max_attempts=0)
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried():
+    caller = make_caller()
+    fn = Flaky(UNAVAILABLE, httpx.ReadTimeout("slow"))
+
+    assert await caller.call(fn) == "ok"
+    assert fn.calls == 3
+    assert caller.retries == 2
+    assert caller.breaker.consecutive_failures == 0
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_attempts():
+    caller = make_caller()
+    fn = Flaky(UNAVAILABLE, UNAVAILABLE, UNAVAILABLE, UNAVAILABLE)
+
+    with pytest.raises(errors.ServerError):
+        await caller.call(fn)
+
+    assert fn.calls == 3
+    assert caller.breaker.consecutive_failures == 3
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried_or_held_against_upstream():
+    caller = make_caller()
+    fn = Flaky(BAD_REQUEST)
+
+    with pytest.raises(errors.ClientError):
+        await caller.call(fn)
+
+    assert fn.calls == 1
+    assert caller.breaker.consecutive_failures == 0
+
+
+@pytest.mark.asyncio
+async def test_throttling_slows_the_limiter_and_is_retried():
+    caller = make_caller()
+    fn = Flaky(THROTTLED)
+
+    assert await caller.call(fn) == "ok"
+    assert caller.limiter.throttle_signals == 1
+    assert caller.limiter.rate < 100
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_without_calling():
+    caller = make_caller(max_attempts=1)
+    for _ in range(caller.breaker.failure_threshold):
+        with pytest.raises(errors.ServerError):
+            await caller.call(Flaky(UNAVAILABLE))
+
+    fn = Flaky()
+    with pytest.raises(UpstreamUnavailableError):
+        await caller.call(fn)
+    assert fn.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_no_retry_when_the_backoff_would_pass_the_deadline():
+    caller = make_caller(base_delay=10, max_delay=10)
+    caller.backoff_delay = lambda attempt: 10
+    fn = Flaky(UNAVAILABLE)
+
+    with pytest.raises(errors.ServerError):
+        await caller.call(fn, deadline=Deadline(1))
+    assert fn.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_a_slow_attempt():
+    caller = make_caller()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    with pytest.raises(DeadlineExceededError):
+        await caller.call(slow, deadline=Deadline(0.05))
+    assert caller.breaker.consecutive_failures == 0
@@ -0,0 +1,112 @@
+import uuid
+from decimal import Decimal
+import pytest
+from app.services.settlement import split_cents, to_cents, compute_bill_results
+
+
+def make_bill(items, participants):
+    return {
+        "id": str(uuid.uuid4()),
+        "currency": "EUR",
+        "participants": [{"id": pid, "name": f"P{index}"} for index, pid in enumerate(participants)],
+        "items": items,
+    }
+
+
+def make_item(unit_price, qty_total, claims=(), members=(), pool=0):
+    return {
+        "id": str(uuid.uuid4()),
+        "unit_price": unit_price,
+        "qty_total": qty_total,
+        "qty_shared_pool": pool,
+        "claims": [{"id": str(uuid.uuid4()), "participant_id": pid, "qty_claimed": qty} for pid, qty in claims],
+        "shared_members": [{"id": str(uuid.uuid4()), "participant_id": pid} for pid in members],
+    }
+
+
+@pytest.mark.parametrize("amount, parts, expected", [
+    (1000, 3, [334, 333, 333]),
+    (1001, 3, [334, 334, 333]),
+    (999, 3, [333, 333, 333]),
+    (2, 3, [1, 1, 0]),
+    (0, 4, [0, 0, 0, 0]),
+    (-1000, 3, [-334, -333, -333]),
+    (-1, 2, [-1, 0]),
+    (500, 1, [500]),
+])
+def test_split_cents(amount, parts, expected):
+    assert split_cents(amount, parts) == expected
+    assert sum(split_cents(amount, parts)) == amount
+
+
+@pytest.mark.parametrize("amount, expected", [
+    (3.5, 350),
+    ("12.34", 1234),
+    ("0.005", 1),
+    (-2.5, -250),
+    (0, 0),
+])
+def test_to_cents(amount, expected):
+    assert to_cents(amount) == expected
+
+
+def test_shared_pool_splits_to_the_cent():
+    a, b, c = (str(uuid.uuid4()) for _ in range(3))
+    bill = make_bill([make_item("10.00", 1, members=[a, b, c], pool=1)], [a, b, c])
+
+    results = compute_bill_results(bill)
+
+    shares = [p.shared_total for p in results.participants]
+    assert shares == [Decimal("3.34"), Decimal("3.33"), Decimal("3.33")]
+    assert sum(shares) == results.total_bill == Decimal("10.00")
+
+
+def test_exclusive_and_shared_totals():
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    bill = make_bill([
+        make_item("3.50", 4, claims=[(a, 2), (b, 1)], members=[a, b], pool=1),
+        make_item("0.99", 3, claims=[(b, 3)]),
+    ], [a, b])
+
+    totals = {str(p.participant_id): p for p in compute_bill_results(bill).participants}
+
+    assert totals[a].exclusive_total == Decimal("7.00")
+    assert totals[a].shared_total == Decimal("1.75")
+    assert totals[a].grand_total == Decimal("8.75")
+    assert totals[b].exclusive_total == Decimal("6.47")
+    assert totals[b].shared_total == Decimal("1.75")
+    assert totals[b].grand_total == Decimal("8.22")
+
+
+def test_negative_pool_is_split_to_the_cent():
+    a, b, c = (str(uuid.uuid4()) for _ in range(3))
+    bill = make_bill([make_item("-5.00", 1, members=[a, b, c], pool=1)], [a, b, c])
+
+    results = compute_bill_results(bill)
+
+    shares = [p.shared_total for p in results.participants]
+    assert shares == [Decimal("-1.67"), Decimal("-1.67"), Decimal("-1.66")]
+    assert sum(shares) == results.total_bill == Decimal("-5.00")
+
+
+def test_empty_pool_and_pool_without_members_cost_nothing():
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    bill = make_bill([
+        make_item("4.00", 2, members=[a, b], pool=0),
+        make_item("6.00", 1, pool=1),
+    ], [a, b])
+
+    results = compute_bill_results(bill)
+
+    assert all(p.grand_total == 0 for p in results.participants)
+    assert results.total_bill == Decimal("14.00")
+
+
+def test_participants_without_claims_are_listed():
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    bill = make_bill([make_item("2.00", 1, claims=[(a, 1)])], [a, b])
+
+    results = compute_bill_results(bill)
+
+    assert [str(p.participant_id) for p in results.participants] == [a, b]
+    assert results.participants[1].grand_total == 0
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from app.services.singleflight import SingleFlight
+from tests.fakes import FakeModels
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"items": [1]}
+
+    results = await asyncio.gather(*[flight.do("key", work) for _ in range(5)])
+
+    assert calls == 1
+    assert results == [{"items": [1]}] * 5
+    # Each caller gets its own copy
+    results[1]["items"].append(2)
+    assert results[0] == {"items": [1]}
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_different_keys_and_later_calls_run_separately():
+    flight = SingleFlight()
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    await asyncio.gather(flight.do("a", lambda: work("a")), flight.do("b", lambda: work("b")))
+    await flight.do("a", lambda: work("a"))
+
+    assert calls == ["a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+
+    assert [str(result) for result in results] == ["boom", "boom"]
+
+
+@pytest.mark.asyncio
+async def test_shared_call_survives_until_the_last_caller_leaves():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    cancelled = False
+
+    async def work():
+        nonlocal cancelled
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    first = asyncio.create_task(flight.do("key", work))
+    second = asyncio.create_task(flight.do("key", work))
+    await started.wait()
+
+    first.cancel()
+    await asyncio.sleep(0.01)
+    assert not cancelled and not second.done()
+
+    second.cancel()
+    await asyncio.gather(first, second, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert cancelled
+    assert flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_identical_uploads_make_one_model_call(make_gemini_service):
+    service = make_gemini_service(FakeModels(delay=0.05), singleflight=SingleFlight())
+
+    results = await asyncio.gather(*[
+        service.aparse_bill_from_bytes(b"image", "bill.jpg", "image/jpeg") for _ in range(3)
+    ])
+
+    assert service.fake_models.calls == 1
+    assert results[0] == results[1] == results[2]
+
@@ -0,0 +1,172 @@
+import hashlib
+import io
+import pytest
+from fastapi.testclient import TestClient
+from app.api.dependencies import get_db_service, get_gemini_service, get_job_queue
+from app.api.uploads import UploadedImage, sniff_image_type
+from app.core import config
+from main import app
+
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 8
+
+
+class RecordingGemini:
+    """Answers every parse with an error so no bill is saved, and records what it was given"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def aparse_bill_from_bytes(self, image_bytes, filename, mime_type, image_sha256=None, deadline=None):
+        self.calls.append((image_bytes, mime_type, image_sha256))
+        return {"error": "not a receipt", "raw_response": ""}
+
+
+@pytest.fixture
+def gemini():
+    gemini = RecordingGemini()
+    app.dependency_overrides[get_gemini_service] = lambda: gemini
+    app.dependency_overrides[get_db_service] = lambda: None
+    yield gemini
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("header, mime_type", [
+    (b"\xff\xd8\xff\xdb" + bytes(12), "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n" + bytes(8), "image/png"),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"\x00\x00\x00\x18ftypheic\x00\x00\x00\x00", "image/heic"),
+    (b"\x00\x00\x00\x18ftypmif1\x00\x00\x00\x00", "image/heif"),
+    (b"%PDF-1.7\n" + bytes(7), None),
+    (b"", None),
+])
+def test_sniff_image_type(header, mime_type):
+    assert sniff_image_type(header) == mime_type
+
+
+def test_image_is_passed_on_with_its_hash(client, gemini):
+    response = client.post("/api/ai/parse-bill", files={"file": ("bill.png", JPEG, "image/png")})
+
+    assert response.status_code == 200
+    assert gemini.calls == [(JPEG, "image/jpeg", hashlib.sha256(JPEG).hexdigest())]
+
+
+def test_unsupported_file_is_rejected(client, gemini):
+    response = client.post("/api/ai/parse-bill", files={"file": ("bill.jpg", b"hello world", "image/jpeg")})
+
+    assert response.status_code == 415
+    assert gemini.calls == []
+
+
+def test_oversized_file_is_rejected(client, gemini, monkeypatch):
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 1024)
+
+    response = client.post("/api/ai/parse-bill", files={"file": ("bill.jpg", JPEG, "image/jpeg")})
+
+    assert response.status_code == 413
+    assert gemini.calls == []
+
+
+def test_oversized_batch_entry_only_fails_itself(client, gemini, monkeypatch):
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 1024)
+    small = JPEG[:512]
+
+    response = client.post("/api/ai/parse-bills", files=[
+        ("files", ("small.jpg", small, "image/jpeg")),
+        ("files", ("large.jpg", JPEG, "image/jpeg")),
+    ])
+
+    assert response.status_code == 200
+    assert "at most" in response.text
+    assert [image for image, _, _ in gemini.calls] == [small]
+
+
+def test_oversized_body_is_rejected_before_it_is_read(client, gemini, monkeypatch):
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 1024)
+    sent = []
+
+    def body():
+        for _ in range(100):
+            sent.append(1)
+            yield b"x" * 1024
+
+    response = client.post(
+        "/api/ai/parse-bill",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=x", "Content-Length": str(100 * 1024)},
+    )
+
+    assert response.status_code == 413
+    assert sent == []
+
+
+@pytest.mark.asyncio
+async def test_oversized_chunked_body_is_cut_off(gemini, monkeypatch):
+    # TestClient buffers request bodies, so drive the app directly
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 1024)
+    chunks_read = 0
+    statuses = []
+
+    part_header = b'--x\r\nContent-Disposition: form-data; name="file"; filename="bill.jpg"\r\n\r\n'
+
+    async def receive():
+        nonlocal chunks_read
+        chunks_read += 1
+        body = part_header if chunks_read == 1 else b"x" * 1024
+        return {"type": "http.request", "body": body, "more_body": chunks_read < 1000}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/ai/parse-bill", "raw_path": b"/api/ai/parse-bill", "root_path": "",
+        "query_string": b"", "headers": [(b"content-type", b"multipart/form-data; boundary=x")],
+        "client": ("test", 1), "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+
+    assert statuses == [413]
+    assert chunks_read < 1000
+
+
+def test_job_upload_is_queued_from_the_spool(client, tmp_path):
+    queued = []
+
+    class Queue:
+        async def submit(self, filename, mime_type, image):
+            image.seek(0)
+            queued.append((filename, mime_type, image.read()))
+            return {"id": "job-1", "status": "queued"}
+
+    app.dependency_overrides[get_job_queue] = lambda: Queue()
+    try:
+        response = client.post("/api/ai/parse-jobs", files={"file": ("bill.jpg", JPEG, "image/jpeg")})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 202
+    assert queued == [("bill.jpg", "image/jpeg", JPEG)]
+
+
+def test_in_memory_upload_is_read_without_copying():
+    spool = io.BytesIO(JPEG)
+    image = UploadedImage("bill.jpg", "image/jpeg", len(JPEG), spool)
+
+    assert image.read() is spool.getvalue()
+    assert image.sha256 == hashlib.sha256(JPEG).hexdigest()
+
+
+def test_upload_spooled_to_disk_is_read_whole(tmp_path):
+    path = tmp_path / "spool"
+    path.write_bytes(JPEG)
+    with open(path, "rb") as spool:
+        image = UploadedImage("bill.jpg", "image/jpeg", len(JPEG), spool)
+        spool.read(10)
+
+        assert image.read() == JPEG
@@ -104,38 +104,78 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Function to get participant totals
-CREATE OR REPLACE FUNCTION get_participant_totals(bill_uuid UUID)
-RETURNS TABLE (
-    participant_id UUID,
-    participant_name VARCHAR,
-    exclusive_total DECIMAL,
-    shared_total DECIMAL,
-    grand_total DECIMAL
-) AS $$
+-- Function to load a bill with its items (each with claims and shared pool members)
+-- and participants as one JSON document, so the app can render a bill in a single round trip
+CREATE OR REPLACE FUNCTION get_bill_snapshot(bill_uuid UUID)
+RETURNS JSONB AS $$
+    SELECT to_jsonb(b) || jsonb_build_object(
+        'items', COALESCE((
+            SELECT jsonb_agg(
+                to_jsonb(i) || jsonb_build_object(
+                    'claims', COALESCE((
+                        SELECT jsonb_agg(to_jsonb(c) ORDER BY c.created_at)
+                        FROM claims c WHERE c.item_id = i.id
+                    ), '[]'::jsonb),
+                    'shared_members', COALESCE((
+                        SELECT jsonb_agg(to_jsonb(sm) ORDER BY sm.created_at)
+                        FROM shared_members sm WHERE sm.item_id = i.id
+                    ), '[]'::jsonb)
+                )
+                ORDER BY i.created_at
+            )
+            FROM items i WHERE i.bill_id = b.id
+        ), '[]'::jsonb),
+        'participants', COALESCE((
+            SELECT jsonb_agg(to_jsonb(p) ORDER BY p.created_at)
+            FROM participants p WHERE p.bill_id = b.id
+        ), '[]'::jsonb)
+    )
+    FROM bills b
+    WHERE b.id = bill_uuid;
+$$ LANGUAGE sql STABLE;
+
+-- Function to resolve a hashed link token straight to its bill snapshot
+CREATE OR REPLACE FUNCTION get_bill_snapshot_by_token(token_hash VARCHAR)
+RETURNS JSONB AS $$
+    SELECT get_bill_snapshot(b.id)
+    FROM bills b
+    WHERE b.link_token_hash = token_hash;
+$$ LANGUAGE sql STABLE;
+
+-- Function to claim part of an item in one call. The item row is locked while the
+-- remaining quantity is checked and the claim inserted, so concurrent claims cannot over-claim
+CREATE OR REPLACE FUNCTION claim_item_exclusive(token_hash VARCHAR, item_uuid UUID, participant_uuid UUID, qty INTEGER)
+RETURNS JSONB AS $$
+DECLARE
+    bill_uuid UUID;
+    item_row items%ROWTYPE;
+    exclusive_claimed INTEGER;
+    remaining_qty INTEGER;
+    new_claim claims%ROWTYPE;
 BEGIN
-    RETURN QUERY
-    SELECT 
-        p.id,
-        p.name,
-        COALESCE(SUM(i.unit_price * c.qty_claimed), 0) as exclusive_total,
-        COALESCE(
-            SUM(i.unit_price * i.qty_shared_pool / 
-                NULLIF((SELECT COUNT(*) FROM shared_members sm WHERE sm.item_id = i.id), 0)
-            ), 0
-        ) as shared_total,
-        COALESCE(SUM(i.unit_price * c.qty_claimed), 0) + 
-        COALESCE(
-            SUM(i.unit_price * i.qty_shared_pool / 
-                NULLIF((SELECT COUNT(*) FROM shared_members sm WHERE sm.item_id = i.id), 0)
-            ), 0
-        ) as grand_total
-    FROM participants p
-    LEFT JOIN claims c ON c.participant_id = p.id
-    LEFT JOIN items i ON i.id = c.item_id AND i.bill_id = bill_uuid
-    LEFT JOIN shared_members sm ON sm.participant_id = p.id AND sm.item_id = i.id
-    WHERE p.bill_id = bill_uuid
-    GROUP BY p.id, p.name;
+    SELECT id INTO bill_uuid FROM bills WHERE link_token_hash = token_hash;
+    IF bill_uuid IS NULL THEN
+        RETURN jsonb_build_object('status', 'bill_not_found');
+    END IF;
+    
+    SELECT * INTO item_row FROM items WHERE id = item_uuid AND bill_id = bill_uuid FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'item_not_found');
+    END IF;
+    
+    SELECT COALESCE(SUM(qty_claimed), 0) INTO exclusive_claimed
+    FROM claims WHERE item_id = item_uuid;
+    
+    remaining_qty := item_row.qty_total - exclusive_claimed - COALESCE(item_row.qty_shared_pool, 0);
+    IF remaining_qty < qty THEN
+        RETURN jsonb_build_object('status', 'insufficient_quantity', 'remaining', remaining_qty);
+    END IF;
+    
+    INSERT INTO claims (bill_id, item_id, participant_id, qty_claimed)
+    VALUES (bill_uuid, item_uuid, participant_uuid, qty)
+    RETURNING * INTO new_claim;
+    
+    RETURN jsonb_build_object('status', 'ok', 'claim', to_jsonb(new_claim), 'remaining', remaining_qty - qty);
 END;
 $$ LANGUAGE plpgsql;
 